@@ -0,0 +1,80 @@
+import time
+
+from hatsudenki.packages import field
+from hatsudenki.packages.table.index import PrimaryIndex
+from hatsudenki.packages.table.solo import SoloHatsudenkiTable
+
+ROWS = 500
+REPEAT = 20
+
+
+class BenchUser(SoloHatsudenkiTable):
+    class Meta(SoloHatsudenkiTable.Meta):
+        label = 'bench'
+        collection_name = 'bench_user'
+        table_name = 'bench_user'
+        primary_index = PrimaryIndex(name=None, hash_key='user_id', read_cap=1, write_cap=1)
+        fast_deserialize = True
+
+    class Field(SoloHatsudenkiTable.Field):
+        user_id = field.StringField()
+        name = field.StringField()
+        level = field.NumberField()
+        exp = field.NumberField()
+        gold = field.NumberField()
+        is_active = field.BoolField()
+        created_at = field.CreateDateField()
+        updated_at = field.UpdateDateField()
+        tags = field.StringSetField()
+
+    def __init__(self, user_id: str = None, **kwargs):
+        super().__init__(**kwargs)
+        ft = self.__class__.Field
+        self.user_id = ft.user_id.get_data(user_id, self)
+        self.name = ft.name.get_data_from_dict(kwargs, self)
+        self.level = ft.level.get_data_from_dict(kwargs, self)
+        self.exp = ft.exp.get_data_from_dict(kwargs, self)
+        self.gold = ft.gold.get_data_from_dict(kwargs, self)
+        self.is_active = ft.is_active.get_data_from_dict(kwargs, self)
+        self.created_at = ft.created_at.get_data_from_dict(kwargs, self)
+        self.updated_at = ft.updated_at.get_data_from_dict(kwargs, self)
+        self.tags = ft.tags.get_data_from_dict(kwargs, self)
+
+
+def make_rows():
+    return [{
+        'user_id': {'S': f'user{i:08}'},
+        'name': {'S': f'name{i}'},
+        'level': {'N': str(i % 100)},
+        'exp': {'N': str(i * 13)},
+        'gold': {'N': str(i * 7)},
+        'is_active': {'BOOL': i % 2 == 0},
+        'created_at': {'N': '1546300800'},
+        'updated_at': {'N': '1546300800'},
+        'tags': {'SS': ['a', 'b']},
+        '_v': {'N': '3'},
+    } for i in range(ROWS)]
+
+
+def bench(label, func, rows):
+    # ウォームアップ
+    [func(r) for r in rows]
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        [func(r) for r in rows]
+    sec = time.perf_counter() - begin
+    rps = ROWS * REPEAT / sec
+    print(f'{label:>10}: {rps:12,.0f} rows/sec')
+    return rps
+
+
+def main():
+    rows = make_rows()
+    print(f'deserialize {ROWS} rows x {REPEAT}')
+    before = bench('dynamic', BenchUser._deserialize_dynamic, rows)
+    after = bench('compiled', BenchUser.deserialize, rows)
+    print(f'speedup: x{after / before:.2f}')
+
+
+if __name__ == '__main__':
+    main()
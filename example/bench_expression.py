@@ -0,0 +1,141 @@
+import time
+import uuid
+
+from hatsudenki.packages import field
+from hatsudenki.packages.expression.base import parse_path
+from hatsudenki.packages.expression.projection import ProjectionExpression
+from hatsudenki.packages.expression.update import UpdateExpression
+from hatsudenki.packages.field import primal_serializer
+from hatsudenki.packages.table.child import ChildMultiHatsudenkiTable
+from hatsudenki.packages.table.index import PrimaryIndex, LSI
+from hatsudenki.packages.table.multi import MultiHatsudenkiTable
+from hatsudenki.packages.table.solo import SoloHatsudenkiTable
+
+REPEAT = 20000
+
+
+class BenchRoot(MultiHatsudenkiTable):
+    class Meta(SoloHatsudenkiTable.Meta):
+        label = 'bench'
+        is_root = True
+        table_name = 'bench_exp_root'
+        collection_name = 'bench_exp_root'
+        primary_index = PrimaryIndex(name=None, hash_key='user_id', range_key='kind', read_cap=1, write_cap=1)
+
+    class Field(SoloHatsudenkiTable.Field):
+        user_id = field.UUIDField()
+        kind = field.StringField()
+        score = field.NumberField()
+
+    class LSIndex:
+        lsi_score = LSI(name='lsi_score', hash_key='user_id', range_key='score', projection_keys=[])
+
+    class GSIndex:
+        pass
+
+    def __init__(self, user_id: uuid.UUID = None, kind: str = None, **kwargs):
+        super().__init__(**kwargs)
+        ft = self.__class__.Field
+        self.user_id = ft.user_id.get_data(user_id, self)
+        self.kind = ft.kind.get_data(kind, self)
+        self.score = ft.score.get_data_from_dict(kwargs, self)
+
+
+class BenchItem(BenchRoot, ChildMultiHatsudenkiTable):
+    class Meta(ChildMultiHatsudenkiTable.Meta, BenchRoot.Meta):
+        label = 'bench'
+        is_root = False
+        table_name = 'bench_exp_item'
+        tag_name = 'item'
+        key_alias_name = 'item_id'
+        key_alias_type = field.NumberField()
+
+    class Field(BenchRoot.Field):
+        count = field.NumberField()
+        name = field.StringField()
+
+    class LSIndex(BenchRoot.LSIndex):
+        pass
+
+    class GSIndex(BenchRoot.LSIndex):
+        pass
+
+    def __init__(self, item_id: int = None, **kwargs):
+        super().__init__(**kwargs)
+        self.item_id = self.Meta.key_alias_type.get_data(item_id, self)
+        self.count = self.Field.count.get_data_from_dict(kwargs, self)
+        self.name = self.Field.name.get_data_from_dict(kwargs, self)
+
+    @property
+    def item_id(self) -> int:
+        return int(self.kind[6:])
+
+    @item_id.setter
+    def item_id(self, val: int):
+        if val is None:
+            return
+        self.kind = f'item//{val}'
+
+
+UID = uuid.uuid4()
+PRJ = BenchItem.projection(BenchItem.fields.count, BenchItem.fields.name)
+
+
+def build_put(m: BenchItem):
+    # HatsudenkiClient.put_itemと同じ組み立て
+    p = {'Item': m.serialize()}
+    p.update(m.not_exist_condition().to_parameter())
+    return p
+
+
+def build_update(m: BenchItem):
+    # SoloHatsudenkiTable.updateと同じ組み立て
+    upd = UpdateExpression()
+    m.build_update_expression(upd)
+    upd.add('_v', 1)
+    cond = m._condition_template('version', m._build_version_condition, primal_serializer(m._v))
+    return upd.to_parameter(cond)
+
+
+def build_query(_):
+    kc, idx = BenchItem.query_parse({'user_id': UID, 'item_id__beginsWith': 1})
+    p = kc.to_parameter()
+    ProjectionExpression.apply(p, PRJ)
+    return p
+
+
+def clear_templates():
+    for c in (BenchRoot, BenchItem):
+        c._condition_templates.clear()
+        c._query_plans.clear()
+    parse_path.cache_clear()
+    ProjectionExpression._compile.cache_clear()
+
+
+def bench(label, build, cached):
+    m = BenchItem(user_id=UID, item_id=1, count=3, name='a')
+    m.count = 5
+    m.name = 'b'
+    build(m)
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        if not cached:
+            # 毎回テンプレートを組み立てる
+            clear_templates()
+        build(m)
+    sec = time.perf_counter() - begin
+    ops = REPEAT / sec
+    print(f'{label:>16}: {ops:12,.0f} builds/sec')
+    return ops
+
+
+def main():
+    print(f'parameter build x {REPEAT}')
+    for label, build in (('put', build_put), ('update', build_update), ('query', build_query)):
+        before = bench(f'{label} uncached', build, False)
+        after = bench(f'{label} cached', build, True)
+        print(f'{"":>16}  speedup: x{after / before:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import time
+import tracemalloc
+
+from hatsudenki.packages import field
+from hatsudenki.packages.marked import MarkedObject
+from hatsudenki.packages.table.index import PrimaryIndex
+from hatsudenki.packages.table.solo import SoloHatsudenkiTable
+
+ROWS = 200
+REPEAT = 10
+ITEMS = 50
+
+
+class Item(MarkedObject):
+    class Field:
+        item_id = field.StringField()
+        count = field.NumberField()
+        level = field.NumberField()
+
+    def __init__(self, name, parent, **kwargs):
+        super().__init__(name, parent, **kwargs)
+        ft = self.__class__.Field
+        self.item_id = ft.item_id.get_data_from_dict(kwargs)
+        self.count = ft.count.get_data_from_dict(kwargs)
+        self.level = ft.level.get_data_from_dict(kwargs)
+
+
+class Inventory(SoloHatsudenkiTable):
+    class Meta(SoloHatsudenkiTable.Meta):
+        label = 'bench'
+        collection_name = 'bench_inventory'
+        table_name = 'bench_inventory'
+        primary_index = PrimaryIndex(name=None, hash_key='user_id', read_cap=1, write_cap=1)
+        fast_deserialize = True
+
+    class Field(SoloHatsudenkiTable.Field):
+        user_id = field.StringField()
+        gold = field.NumberField()
+        items = field.ListField(Item)
+        equipment = field.MapField(Item)
+
+    def __init__(self, user_id: str = None, **kwargs):
+        super().__init__(**kwargs)
+        ft = self.__class__.Field
+        self.user_id = ft.user_id.get_data(user_id, self)
+        self.gold = ft.gold.get_data_from_dict(kwargs, self)
+        self.items = ft.items.get_data_from_dict(kwargs, self)
+        self.equipment = ft.equipment.get_data_from_dict(kwargs, self)
+
+
+class LazyInventory(Inventory):
+    class Meta(Inventory.Meta):
+        collection_name = 'bench_lazy_inventory'
+        table_name = 'bench_lazy_inventory'
+        lazy_deserialize = True
+
+
+def _item(i):
+    return {'M': {'item_id': {'S': f'item{i}'}, 'count': {'N': str(i)}, 'level': {'N': '1'}}}
+
+
+def make_rows():
+    return [{
+        'user_id': {'S': f'user{i:08}'},
+        'gold': {'N': str(i * 7)},
+        'items': {'L': [_item(n) for n in range(ITEMS)]},
+        'equipment': _item(0),
+        '_v': {'N': '3'},
+    } for i in range(ROWS)]
+
+
+def read_scalars(model_cls, raw):
+    # クエリ結果のうちスカラー値だけを参照する典型的な読み取り処理
+    m = model_cls.deserialize(raw)
+    return m.user_id, m.gold
+
+
+def bench(model_cls, rows):
+    [read_scalars(model_cls, r) for r in rows]
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        [read_scalars(model_cls, r) for r in rows]
+    sec = time.perf_counter() - begin
+    rps = ROWS * REPEAT / sec
+    tracemalloc.start()
+    models = [model_cls.deserialize(r) for r in rows]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'{model_cls.__name__:>15}: {rps:12,.0f} rows/sec {used / len(models):10,.0f} bytes/row')
+    return rps, used
+
+
+def main():
+    rows = make_rows()
+    print(f'deserialize {ROWS} rows ({ITEMS} list items each) x {REPEAT}, read scalar fields only')
+    before = bench(Inventory, rows)
+    after = bench(LazyInventory, rows)
+    print(f'speedup: x{after[0] / before[0]:.2f}, memory: x{before[1] / after[1]:.2f} smaller')
+
+
+if __name__ == '__main__':
+    main()
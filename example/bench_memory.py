@@ -0,0 +1,83 @@
+import time
+import tracemalloc
+
+from bench_deserialize import BenchUser, make_rows, ROWS, REPEAT
+from hatsudenki.packages import field
+from hatsudenki.packages.table.index import PrimaryIndex
+from hatsudenki.packages.table.slotted import SlottedTableMixin
+from hatsudenki.packages.table.solo import SoloHatsudenkiTable
+
+INSTANCES = 50
+
+
+class SlottedBenchUser(SlottedTableMixin, SoloHatsudenkiTable):
+    __slots__ = ('user_id', 'name', 'level', 'exp', 'gold', 'is_active', 'created_at', 'updated_at', 'tags')
+
+    class Meta(SoloHatsudenkiTable.Meta):
+        label = 'bench'
+        collection_name = 'bench_slotted_user'
+        table_name = 'bench_slotted_user'
+        primary_index = PrimaryIndex(name=None, hash_key='user_id', read_cap=1, write_cap=1)
+        fast_deserialize = True
+
+    Field = BenchUser.Field
+
+    def __init__(self, user_id: str = None, **kwargs):
+        super().__init__(**kwargs)
+        ft = self.__class__.Field
+        self.user_id = ft.user_id.get_data(user_id, self)
+        self.name = ft.name.get_data_from_dict(kwargs, self)
+        self.level = ft.level.get_data_from_dict(kwargs, self)
+        self.exp = ft.exp.get_data_from_dict(kwargs, self)
+        self.gold = ft.gold.get_data_from_dict(kwargs, self)
+        self.is_active = ft.is_active.get_data_from_dict(kwargs, self)
+        self.created_at = ft.created_at.get_data_from_dict(kwargs, self)
+        self.updated_at = ft.updated_at.get_data_from_dict(kwargs, self)
+        self.tags = ft.tags.get_data_from_dict(kwargs, self)
+
+
+def measure_memory(model_cls, rows):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    models = [model_cls.deserialize(r) for _ in range(INSTANCES) for r in rows]
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    per = used / len(models)
+    print(f'{model_cls.__name__:>20}: {per:10,.0f} bytes/instance ({len(models):,} instances)')
+    return per
+
+
+def modify(m):
+    m.level += 1
+    m.gold += 10
+    m.name = 'renamed'
+    m.flush()
+
+
+def measure_write(model_cls, rows):
+    models = [model_cls.deserialize(r) for r in rows]
+    # ウォームアップ
+    [modify(m) for m in models]
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        [modify(m) for m in models]
+    sec = time.perf_counter() - begin
+    rps = ROWS * REPEAT / sec
+    print(f'{model_cls.__name__:>20}: {rps:12,.0f} rows/sec (3 writes + flush)')
+    return rps
+
+
+def main():
+    rows = make_rows()
+    print('memory')
+    before = measure_memory(BenchUser, rows)
+    after = measure_memory(SlottedBenchUser, rows)
+    print(f'reduction: {1 - after / before:.1%}')
+    print('attribute write')
+    before = measure_write(BenchUser, rows)
+    after = measure_write(SlottedBenchUser, rows)
+    print(f'speedup: x{after / before:.2f}')
+
+
+if __name__ == '__main__':
+    main()
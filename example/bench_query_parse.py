@@ -0,0 +1,115 @@
+import time
+import uuid
+
+from hatsudenki.packages import field
+from hatsudenki.packages.table.child import ChildMultiHatsudenkiTable
+from hatsudenki.packages.table.index import PrimaryIndex, LSI, GSI
+from hatsudenki.packages.table.multi import MultiHatsudenkiTable
+from hatsudenki.packages.table.solo import SoloHatsudenkiTable
+
+REPEAT = 20000
+
+
+class BenchRoot(MultiHatsudenkiTable):
+    class Meta(SoloHatsudenkiTable.Meta):
+        label = 'bench'
+        is_root = True
+        table_name = 'bench_root'
+        collection_name = 'bench_root'
+        primary_index = PrimaryIndex(name=None, hash_key='user_id', range_key='kind', read_cap=1, write_cap=1)
+
+    class Field(SoloHatsudenkiTable.Field):
+        user_id = field.UUIDField()
+        kind = field.StringField()
+        score = field.NumberField()
+        group = field.StringField()
+
+    class LSIndex:
+        lsi_score = LSI(name='lsi_score', hash_key='user_id', range_key='score', projection_keys=[])
+
+    class GSIndex:
+        gsi_group = GSI(name='gsi_group__score', hash_key='group', range_key='score', read_cap=1, write_cap=1,
+                        projection_keys=[])
+
+    def __init__(self, user_id: uuid.UUID = None, kind: str = None, **kwargs):
+        super().__init__(**kwargs)
+        ft = self.__class__.Field
+        self.user_id = ft.user_id.get_data(user_id, self)
+        self.kind = ft.kind.get_data(kind, self)
+        self.score = ft.score.get_data_from_dict(kwargs, self)
+        self.group = ft.group.get_data_from_dict(kwargs, self)
+
+
+class BenchItem(BenchRoot, ChildMultiHatsudenkiTable):
+    class Meta(ChildMultiHatsudenkiTable.Meta, BenchRoot.Meta):
+        label = 'bench'
+        is_root = False
+        table_name = 'bench_item'
+        tag_name = 'item'
+        key_alias_name = 'item_id'
+        key_alias_type = field.NumberField()
+
+    class Field(BenchRoot.Field):
+        count = field.NumberField()
+
+    class LSIndex(BenchRoot.LSIndex):
+        pass
+
+    class GSIndex(BenchRoot.LSIndex):
+        pass
+
+    def __init__(self, item_id: int = None, **kwargs):
+        super().__init__(**kwargs)
+        self.item_id = self.Meta.key_alias_type.get_data(item_id, self)
+        self.count = self.Field.count.get_data_from_dict(kwargs, self)
+
+    @property
+    def item_id(self) -> int:
+        return int(self.kind[6:])
+
+    @item_id.setter
+    def item_id(self, val: int):
+        if val is None:
+            return
+        self.kind = f'item//{val}'
+
+
+UID = uuid.uuid4()
+QUERIES = [
+    (BenchItem, {'user_id': UID}),
+    (BenchItem, {'user_id': UID, 'item_id': 10}),
+    (BenchItem, {'user_id': UID, 'score__gte': 10}),
+    (BenchRoot, {'group': 'a', 'score__lt': 100}),
+]
+
+
+def parse(model_cls, query_dict):
+    kc, idx = model_cls.query_parse(query_dict)
+    return kc.to_parameter()
+
+
+def bench(label, cached):
+    # ウォームアップ
+    [parse(c, q) for c, q in QUERIES]
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        for c, q in QUERIES:
+            if not cached:
+                # 毎回インデックスの判定と式の組み立てから行う
+                c._query_plans.clear()
+            parse(c, q)
+    sec = time.perf_counter() - begin
+    qps = REPEAT * len(QUERIES) / sec
+    print(f'{label:>10}: {qps:12,.0f} queries/sec')
+    return qps
+
+
+def main():
+    print(f'query_parse {len(QUERIES)} shapes x {REPEAT}')
+    before = bench('uncached', False)
+    after = bench('cached', True)
+    print(f'speedup: x{after / before:.2f}')
+
+
+if __name__ == '__main__':
+    main()
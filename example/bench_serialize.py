@@ -0,0 +1,47 @@
+import time
+
+from bench_deserialize import BenchUser, make_rows, ROWS, REPEAT
+from hatsudenki.packages.expression.update import UpdateExpression
+
+
+def bench(label, func, models):
+    # ウォームアップ
+    [func(m) for m in models]
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        [func(m) for m in models]
+    sec = time.perf_counter() - begin
+    rps = ROWS * REPEAT / sec
+    print(f'{label:>20}: {rps:12,.0f} rows/sec')
+    return rps
+
+
+def build_update(m):
+    u = UpdateExpression()
+    m.build_update_expression(u)
+    return u.to_parameter()
+
+
+def run(label):
+    models = [BenchUser.deserialize(r) for r in make_rows()]
+    for m in models:
+        m.level += 1
+        m.gold += 10
+        m.name = ''
+    return bench(f'{label} serialize', BenchUser.serialize, models), bench(f'{label} update', build_update, models)
+
+
+def main():
+    print(f'serialize {ROWS} rows x {REPEAT}')
+    s, u = BenchUser._compiled_serializer, BenchUser._compiled_update_builder
+    BenchUser._compiled_serializer = BenchUser._compiled_update_builder = None
+    try:
+        before = run('dynamic')
+    finally:
+        BenchUser._compiled_serializer, BenchUser._compiled_update_builder = s, u
+    after = run('compiled')
+    print(f'speedup: serialize x{after[0] / before[0]:.2f}, update x{after[1] / before[1]:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import tempfile
+from pathlib import Path
+
+from hatsudenki.packages.command.hatsudenki.loader import HatsudenkiLoader
+from hatsudenki.packages.command.hatsudenki.renderer.tables import TableRenderUnit
+
+# lazy: trueを指定したテーブル定義
+DSL = '''
+attributes:
+  user_id:
+    hash: true
+    type: string
+  gold:
+    type: number
+  items:
+    type: list
+    value:
+      attributes:
+        item_id:
+          type: string
+        count:
+          type: number
+  equipment:
+    type: map
+    attributes:
+      item_id:
+        type: string
+      count:
+        type: number
+capacity_units:
+  read: 1
+  write: 1
+is_single: true
+lazy: true
+'''
+
+HEADER = '''
+from hatsudenki.packages import field
+from hatsudenki.packages.marked import MarkedObject, Markable, MarkedObjectWithIndex
+from hatsudenki.packages.table.index import PrimaryIndex, LSI, GSI
+from hatsudenki.packages.table.solo import SoloHatsudenkiTable
+'''
+
+NOT_SCALAR = {'items', 'equipment'}
+
+
+def _item(i):
+    return {'M': {'item_id': {'S': f'item{i}'}, 'count': {'N': str(i)}}}
+
+
+def generate():
+    # DSLからモデルのソースを出力してクラスを取得する
+    with tempfile.TemporaryDirectory() as d:
+        Path(d, 'check').mkdir()
+        Path(d, 'check', 'lazy_inventory.yml').write_text(DSL)
+        loader = HatsudenkiLoader(Path(d))
+        loader.setup()
+        (_, data), = loader.iter()
+        source = HEADER + TableRenderUnit(data).render().render()
+    ns = {}
+    exec(source, ns)
+    return ns[data.class_name]
+
+
+def main():
+    model_cls = generate()
+    assert model_cls.is_lazy_deserialize(), 'generated model is not lazy'
+
+    raw = {
+        'user_id': {'S': 'user'},
+        'gold': {'N': '10'},
+        'items': {'L': [_item(n) for n in range(3)]},
+        'equipment': _item(9),
+        '_v': {'N': '1'},
+    }
+    m = model_cls.deserialize(raw)
+    # スカラー値を参照しても非スカラー型フィールドは生データのまま
+    assert (m.user_id, m.gold) == ('user', 10)
+    assert set(m._lazy_raw) == NOT_SCALAR, m._lazy_raw
+
+    # はじめてアクセスしたフィールドだけがデシリアライズされる
+    assert m.items[2].count == 2
+    assert set(m._lazy_raw) == NOT_SCALAR - {'items'}, m._lazy_raw
+    assert m.equipment.value.item_id == 'item9'
+    assert not m._lazy_raw
+    assert not m.is_modified_record
+    print(f'{model_cls.__name__}: List/Map/DictMap fields stay raw until first access. OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import asyncio
+from copy import deepcopy
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Dict, List, Tuple, Callable, Awaitable, Optional, Set
+
+from hatsudenki.packages.expression.projection import ProjectionExpression
+from hatsudenki.packages.singleflight import make_flight_key
+
+_logger = getLogger(__name__)
+
+#: BatchGetItem1リクエストあたりのキー数上限
+MAX_BATCH_GET_KEYS = 100
+
+
+@dataclass
+class AutoBatchStats:
+    """
+    自動バッチ化の発生状況
+    """
+    # 受け付けたget_itemの数
+    loads: int = 0
+    # 同一バッチ内の重複キーとしてまとめられた数
+    deduped: int = 0
+    # 発行したBatchGetItemの数
+    batches: int = 0
+    # BatchGetItemで要求したキーの延べ数
+    keys: int = 0
+    # UnprocessedKeysが残ったため個別に取得し直した数
+    fallbacks: int = 0
+
+    @property
+    def avg_batch_size(self):
+        return self.keys / self.batches if self.batches else 0
+
+    def to_dict(self):
+        return {
+            'loads': self.loads,
+            'deduped': self.deduped,
+            'batches': self.batches,
+            'keys': self.keys,
+            'fallbacks': self.fallbacks,
+            'avg_batch_size': self.avg_batch_size,
+        }
+
+
+class _Entry(object):
+    __slots__ = ('key', 'future')
+
+    def __init__(self, key: dict, future: asyncio.Future):
+        self.key = key
+        self.future = future
+
+
+class AutoBatcher(object):
+    """
+    | 個別のget_itemをBatchGetItemにまとめて発行する（DataLoader方式）
+    | 同じイベントループのtick内（windowが指定されていればwindow秒以内）に要求されたキーを
+    | テーブル・プロジェクションごとに最大100件ずつまとめ、結果をキーで照合して各呼び出し元に返す
+    """
+
+    def __init__(self, fetch: Callable[[dict, int], Awaitable], fallback: Callable[[str, dict, List[str]], Awaitable],
+                 window: float = 0, max_batch: int = MAX_BATCH_GET_KEYS, max_retry: int = 10):
+        """
+        イニシャライザ
+
+        :param fetch: BatchGetItemを発行するコルーチン関数。HatsudenkiClient.batch_get_item_with_stats互換
+        :param fallback: 1件取得するコルーチン関数（テーブル名はプリフィックス付与済みで渡される）
+        :param window: キーを溜める秒数。0の場合は同一tick内のみまとめる
+        :param max_batch: 1リクエストあたりの最大キー数
+        :param max_retry: UnprocessedKeysに対する最大リクエスト回数。超えた分は個別に取得する
+        """
+        self._fetch = fetch
+        self._fallback = fallback
+        self.window = window
+        self.max_batch = min(max_batch, MAX_BATCH_GET_KEYS)
+        self.max_retry = max_retry
+        self.stats = AutoBatchStats()
+        # (テーブル名, プロジェクション, キー名) -> {キー -> _Entry}
+        self._pending: Dict[Tuple, Dict[Tuple, _Entry]] = {}
+        self._handle: Optional[asyncio.Handle] = None
+        self._tasks: Set[asyncio.Future] = set()
+
+    async def load(self, table_name: str, key: dict, prj: List[str] = None):
+        """
+        1件取得を予約し、結果を待つ
+
+        :param table_name: テーブル名（プリフィックス付与済み）
+        :param key: キー指定式辞書
+        :param prj: プロジェクション
+        :return: アイテム情報を格納した辞書配列。存在しない場合はNone
+        """
+        self.stats.loads += 1
+        group = (table_name, tuple(prj) if prj is not None else None, tuple(sorted(key.keys())))
+        fk = make_flight_key(key)
+
+        pending = self._pending.get(group)
+        if pending is None:
+            pending = self._pending[group] = {}
+
+        e = pending.get(fk)
+        if e is not None:
+            # 同じキーが既に予約されているので結果を共有する
+            self.stats.deduped += 1
+            return deepcopy(await asyncio.shield(e.future))
+
+        loop = asyncio.get_event_loop()
+        e = _Entry(key, loop.create_future())
+        pending[fk] = e
+
+        if len(pending) >= self.max_batch:
+            # 上限に達したグループは待たずに発行する
+            del self._pending[group]
+            self._dispatch(group, pending)
+        elif self._handle is None:
+            if self.window > 0:
+                self._handle = loop.call_later(self.window, self._flush)
+            else:
+                self._handle = loop.call_soon(self._flush)
+
+        return await asyncio.shield(e.future)
+
+    def _flush(self):
+        self._handle = None
+        pending, self._pending = self._pending, {}
+        for group, entries in pending.items():
+            self._dispatch(group, entries)
+
+    def _dispatch(self, group: Tuple, entries: Dict[Tuple, _Entry]):
+        t = asyncio.ensure_future(self._run(group, entries))
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group: Tuple, entries: Dict[Tuple, _Entry]):
+        try:
+            await self._resolve(group, entries)
+        except Exception as exc:
+            self._fail(entries, exc)
+        except BaseException:
+            # キャンセルされた場合も待っている呼び出し元が止まったままにならないようにする
+            for e in entries.values():
+                if not e.future.done():
+                    e.future.cancel()
+            raise
+
+    @staticmethod
+    def _fail(entries: Dict[Tuple, _Entry], exc: BaseException):
+        for e in entries.values():
+            if not e.future.done():
+                e.future.set_exception(exc)
+
+    async def _resolve(self, group: Tuple, entries: Dict[Tuple, _Entry]):
+        table_name, prj, key_names = group
+        req = {'Keys': [e.key for e in entries.values()]}
+        extra = []
+        if prj is not None:
+            # 照合のためキー属性は必ず取得し、返却前に取り除く
+            extra = [n for n in key_names if n not in prj]
+            ProjectionExpression.apply(req, list(prj) + extra)
+
+        self.stats.batches += 1
+        self.stats.keys += len(entries)
+        try:
+            ret, stats = await self._fetch({table_name: req}, self.max_retry)
+        except Exception as exc:
+            self._fail(entries, exc)
+            return
+
+        found = {}
+        for item in ret.get(table_name, []):
+            fk = make_flight_key({n: item[n] for n in key_names})
+            for n in extra:
+                item.pop(n, None)
+            found[fk] = item
+
+        st = stats.get(table_name)
+        complete = st is None or st.is_complete
+        retry = []
+        for fk, e in entries.items():
+            if e.future.done():
+                continue
+            item = found.get(fk)
+            if item is None and not complete:
+                # 取りこぼしたキーかもしれないので個別に取得する
+                retry.append(e)
+            else:
+                e.future.set_result(item)
+
+        if not retry:
+            return
+        self.stats.fallbacks += len(retry)
+        _logger.warning(f'auto batch fallback to get_item. table={table_name} num={len(retry)}')
+        p = list(prj) if prj is not None else None
+        res = await asyncio.gather(*[self._fallback(table_name, e.key, p) for e in retry], return_exceptions=True)
+        for e, r in zip(retry, res):
+            if e.future.done():
+                continue
+            if isinstance(r, BaseException):
+                e.future.set_exception(r)
+            else:
+                e.future.set_result(r)
+
+    def reset_stats(self):
+        self.stats = AutoBatchStats()
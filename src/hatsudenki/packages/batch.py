@@ -1,21 +1,28 @@
 import asyncio
-import itertools
 import pprint
+import time
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from pprint import pprint
-from typing import List, Dict, Type, TypeVar
+from typing import List, Dict, Type, TypeVar, Iterable, AsyncIterable, AsyncIterator, Union, Optional, Tuple
 
-from hatsudenki.packages.client import HatsudenkiClient
-from hatsudenki.packages.table.define import TableType
+from hatsudenki.define.config import TAG_SEPARATOR
+from hatsudenki.packages.client import HatsudenkiClient, BatchGetStat, BatchWriteStat
+from hatsudenki.packages.singleflight import make_flight_key
+from hatsudenki.packages.table.child import ChildMultiHatsudenkiTable
 from hatsudenki.packages.table.solo import SoloHatsudenkiTable
 
+#: BatchGetItem1リクエストあたりの最大キー数
+MAX_BATCH_GET_ITEM = 100
+
 
 @dataclass
 class BatchGetTask:
     table_name: str = None
     keys: dict = None
+    # 取得するテーブルのクラス（結果の振り分けに使用する）
+    table_type: Type[SoloHatsudenkiTable] = None
 
 
 class BatchWriteKind(Enum):
@@ -23,11 +30,33 @@ class BatchWriteKind(Enum):
     Delete = 'DeleteRequest'
 
 
+#: BatchWriteItem1リクエストあたりの最大件数
+MAX_BATCH_WRITE_ITEM = 25
+#: 同時に発行するBatchWriteItemの数（デフォルト）
+DEFAULT_BATCH_WRITE_CONCURRENCY = 8
+
+
 @dataclass
 class BatchWriteTask:
     table_name: str = None
     item: dict = None
     kind: BatchWriteKind = None
+    # シリアライズされたプライマリキー。同一バッチ内の重複排除に使用する
+    key: dict = None
+
+    @property
+    def dedup_key(self) -> Optional[Tuple]:
+        """
+        重複排除用のキーを取得
+
+        :return: tuple。キーが不明な場合はNone
+        """
+        k = self.key
+        if k is None and self.kind is BatchWriteKind.Delete:
+            k = self.item
+        if k is None:
+            return None
+        return self.real_table_name, make_flight_key(k)
 
     @property
     def query(self):
@@ -48,9 +77,9 @@ class QueryBatchGetItem(object):
 
     def append(self, table: SoloHatsudenkiTable):
         self._task.append(
-            BatchGetTask(table_name=table._collection_name, keys=table.serialized_key))
+            BatchGetTask(table_name=table._collection_name, keys=table.serialized_key, table_type=table.__class__))
 
-    def exec_query(self, limit=100):
+    def exec_query(self, limit=MAX_BATCH_GET_ITEM):
         query = defaultdict(lambda: {'Keys': []})
         w = 0
         for task in self._task:
@@ -60,24 +89,140 @@ class QueryBatchGetItem(object):
                 r = dict(query)
                 w = 0
                 query.clear()
-                yield HatsudenkiClient.batch_get_item(r)
+                yield HatsudenkiClient.batch_get_item_with_stats(r)
         if w is not 0:
-            yield HatsudenkiClient.batch_get_item(dict(query))
+            yield HatsudenkiClient.batch_get_item_with_stats(dict(query))
+
+    def make_response(self) -> 'BatchGetResponse':
+        """
+        追加されたタスクのテーブルを登録した空のレスポンスを生成する
+
+        :return: BatchGetResponse
+        """
+        return BatchGetResponse(table_types=[t.table_type for t in self._task if t.table_type is not None])
+
+    async def exec(self, limit=MAX_BATCH_GET_ITEM):
+        """
+        | 実行
+        | UnprocessedKeysはクライアント側で未処理のキーだけ再リクエストされる
+
+        :param limit: 1リクエストあたりのキー数
+        :return: BatchGetResponse
+        """
+        ret = self.make_response()
+        for items, stat in await asyncio.gather(*[q for q in self.exec_query(limit)]):
+            ret.add(items, stat)
+        return ret
 
-    async def exec(self, limit=100):
-        # TODO: unprocessへの対応がまだ
-        ret = defaultdict(list)
+    async def stream(self, limit=MAX_BATCH_GET_ITEM, response: 'BatchGetResponse' = None) -> AsyncIterator:
+        """
+        | 実行し、limit件ごとのリクエストが完了した順に取得できたモデルを返却する
+        | 遅いリクエストの完了を待たずに処理を始められる
+        | 取得結果はresponseにも蓄積されるので、完了後にget()やstatsで参照できる
 
-        [[ret[key].extend(v) for key, v in r.items()] for r in
-         await asyncio.gather(*[q for q in self.exec_query(limit)])]
+        .. code-block:: python
 
-        return BatchGetResponse(ret)
+            res = q.make_response()
+            async for m in q.stream(response=res):
+                render(m)
+            assert res.is_complete
+
+        :param limit: 1リクエストあたりのキー数
+        :param response: 結果を蓄積するBatchGetResponse。省略時は内部で生成する
+        :return: モデルインスタンスの非同期イテレータ
+        """
+        ret = response if response is not None else self.make_response()
+        futures = [asyncio.ensure_future(q) for q in self.exec_query(limit)]
+        try:
+            for f in asyncio.as_completed(futures):
+                items, stat = await f
+                for m in ret.add(items, stat, collect=True):
+                    yield m
+        finally:
+            # 途中で打ち切られた場合は残りのリクエストを破棄する
+            for f in futures:
+                if not f.done():
+                    f.cancel()
 
     @property
     def task_num(self):
         return len(self._task)
 
 
+@dataclass
+class BatchWriteReport:
+    """
+    BatchWriteの実行結果
+    """
+    # 受け付けたタスク数
+    tasks: int = 0
+    # 同一バッチ内で同じキーへの書き込みとしてまとめられた数
+    deduped: int = 0
+    # 発行したバッチ数
+    batches: int = 0
+    # UnprocessedItemsの再リクエストを含むリクエスト数
+    requests: int = 0
+    # UnprocessedItemsとして返却された延べ数
+    unprocessed: int = 0
+    # リトライ上限に達し書き込めなかった数
+    abandoned: int = 0
+    # 書き込めた数
+    written: int = 0
+    # 実行中に発生したスロットリング等によるリトライ数（プロセス全体の値の差分なので目安）
+    retries: int = 0
+    # 処理時間（秒）
+    elapsed: float = 0
+
+    @property
+    def throughput(self):
+        """
+        1秒あたりの書き込み数
+
+        :return: float
+        """
+        return self.written / self.elapsed if self.elapsed else 0
+
+    @property
+    def is_complete(self):
+        return self.abandoned == 0
+
+    def add_stat(self, stat: BatchWriteStat):
+        self.requests += stat.requests
+        self.unprocessed += stat.unprocessed
+        self.abandoned += stat.abandoned
+        self.written += stat.requested - stat.abandoned
+
+    def to_dict(self):
+        return {
+            'tasks': self.tasks,
+            'deduped': self.deduped,
+            'batches': self.batches,
+            'requests': self.requests,
+            'unprocessed': self.unprocessed,
+            'abandoned': self.abandoned,
+            'written': self.written,
+            'retries': self.retries,
+            'elapsed': self.elapsed,
+            'throughput': self.throughput,
+        }
+
+
+async def _iterate(tasks: Union[Iterable[BatchWriteTask], AsyncIterable[BatchWriteTask]]):
+    if hasattr(tasks, '__aiter__'):
+        async for t in tasks:
+            yield t
+    else:
+        for t in tasks:
+            yield t
+
+
+def _build_request(chunk: List[BatchWriteTask]):
+    query = defaultdict(list)
+    for t in chunk:
+        query[t.real_table_name].append(t.query)
+    return dict(query)
+
+
 class QueryBatchWriteItem(object):
     """
     Batch処理（書き込み）
@@ -103,7 +248,8 @@ class QueryBatchWriteItem(object):
         :return:
         """
         self._task.append(
-            BatchWriteTask(table_name=table._collection_name, item=table.serialize(), kind=BatchWriteKind.Put))
+            BatchWriteTask(table_name=table._collection_name, item=table.serialize(), kind=BatchWriteKind.Put,
+                           key=table.serialized_key))
 
     def append_delete(self, table: SoloHatsudenkiTable):
         """
@@ -116,21 +262,101 @@ class QueryBatchWriteItem(object):
                            kind=BatchWriteKind.Delete)
         self._task.append(t)
 
-    def exec_query(self, limit=25):
-        task_len = len(self._task)
-        chunk_heads = (r * limit for r in range(task_len // limit + (0 < (task_len % limit))))
+    def exec_query(self, limit=MAX_BATCH_WRITE_ITEM):
+        return (HatsudenkiClient.batch_write_item(_build_request(self._task[h:h + limit]))
+                for h in range(0, len(self._task), limit))
 
-        def group(head):
-            return itertools.groupby(self._task[head:(head + limit)], lambda x: x.real_table_name)
-
-        def query(head):
-            return {k: [val.query for val in v] for k, v in group(head)}
+    async def exec(self, limit=MAX_BATCH_WRITE_ITEM, concurrency=DEFAULT_BATCH_WRITE_CONCURRENCY):
+        """
+        実行
 
-        return (HatsudenkiClient.batch_write_item(query(h)) for h in chunk_heads)
+        :param limit: 1リクエストあたりの件数
+        :param concurrency: 同時に発行するリクエスト数
+        :return: BatchWriteReport
+        """
+        return await self.stream(self._task, limit, concurrency)
 
-    async def exec(self, limit=25):
-        g = [q for q in self.exec_query(limit)]
-        await asyncio.gather(*g)
+    @classmethod
+    async def stream(cls, tasks: Union[Iterable[BatchWriteTask], AsyncIterable[BatchWriteTask]],
+                     limit=MAX_BATCH_WRITE_ITEM, concurrency=DEFAULT_BATCH_WRITE_CONCURRENCY,
+                     max_retry=100) -> BatchWriteReport:
+        """
+        | タスクを順に読み込みながらlimit件ずつBatchWriteItemを発行する
+        | 同時に発行するリクエストはconcurrency件までで、空きが出るまでタスクの読み込みを待つ
+        | 同一バッチ内に同じキーへの書き込みがあった場合は後から来たものだけを残す
+        | 別々のバッチに入った同じキーへの書き込みは並列に発行されるので順序は保証されない
+        | いずれかのリクエストが失敗した場合は以降のバッチを発行せず、実行中のものを待ってから例外を送出する
+
+        :param tasks: BatchWriteTaskのイテラブルもしくは非同期イテラブル
+        :param limit: 1リクエストあたりの件数
+        :param concurrency: 同時に発行するリクエスト数
+        :param max_retry: UnprocessedItemsに対する最大リクエスト回数
+        :return: BatchWriteReport
+        """
+        limit = min(limit, MAX_BATCH_WRITE_ITEM)
+        report = BatchWriteReport()
+        begin = time.perf_counter()
+        retries = HatsudenkiClient.get_retry_stats().retries
+        sem = asyncio.Semaphore(concurrency)
+        running = set()
+        errors = []
+
+        async def run(chunk: List[BatchWriteTask]):
+            try:
+                report.add_stat(await HatsudenkiClient.batch_write_item_with_stats(_build_request(chunk), max_retry))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                sem.release()
+
+        async def dispatch(chunk: List[BatchWriteTask]):
+            await sem.acquire()
+            if errors:
+                sem.release()
+                return
+            report.batches += 1
+            t = asyncio.ensure_future(run(chunk))
+            running.add(t)
+            t.add_done_callback(running.discard)
+
+        try:
+            chunk: List[BatchWriteTask] = []
+            index: Dict[Tuple, int] = {}
+            async for task in _iterate(tasks):
+                report.tasks += 1
+                k = task.dedup_key
+                if k is not None:
+                    i = index.get(k)
+                    if i is not None:
+                        # DynamoDBは同一リクエスト内の重複キーを受け付けないので後勝ちにする
+                        chunk[i] = task
+                        report.deduped += 1
+                        continue
+                    index[k] = len(chunk)
+                chunk.append(task)
+
+                if len(chunk) >= limit:
+                    await dispatch(chunk)
+                    chunk = []
+                    index = {}
+                    if errors:
+                        break
+
+            if chunk and not errors:
+                await dispatch(chunk)
+
+            if running:
+                await asyncio.gather(*running)
+        except BaseException:
+            for t in running:
+                t.cancel()
+            raise
+
+        report.elapsed = time.perf_counter() - begin
+        report.retries = max(0, HatsudenkiClient.get_retry_stats().retries - retries)
+        if errors:
+            raise errors[0]
+        return report
 
     @property
     def task_num(self):
@@ -140,25 +366,276 @@ class QueryBatchWriteItem(object):
 T = TypeVar('T')
 
 
+def _row_tag(item: dict, range_key: Optional[str]) -> Optional[str]:
+    """
+    行のレンジキーから子テーブルのタグを取り出す
+
+    :param item: DynamoDBの行
+    :param range_key: レンジキー名
+    :return: タグ。タグを持たない行はNone
+    """
+    if range_key is None:
+        return None
+    v = item.get(range_key)
+    if v is None or 'S' not in v:
+        return None
+    return v['S'].split(TAG_SEPARATOR, 1)[0]
+
+
+def _table_tag(table_type: Type[SoloHatsudenkiTable]) -> Optional[str]:
+    """
+    テーブルクラスの子テーブルのタグ
+
+    :param table_type: テーブルクラス
+    :return: タグ。子テーブルでない場合はNone
+    """
+    if issubclass(table_type, ChildMultiHatsudenkiTable):
+        return table_type.get_tag_name() or None
+    return None
+
+
 class BatchGetResponse(object):
-    def __init__(self, result: Dict[str, List[any]]):
-        self.result = result
+    """
+    | BatchGetItemの結果
+    | 行は到着した時点でコレクションとタグ（子テーブルの種類）ごとに振り分けるので、get()は該当する行だけを参照する
+    | デシリアライズしたモデルはクラスごとにキャッシュされ、同じクラスに対するget()では再利用される
+    """
+
+    def __init__(self, result: Dict[str, List[any]] = None, stats: Dict[str, BatchGetStat] = None,
+                 table_types: Iterable[Type[SoloHatsudenkiTable]] = ()):
+        """
+        イニシャライザ
+
+        :param result: コレクション名をキーとした行リストの辞書
+        :param stats: テーブルごとの取得状況
+        :param table_types: 取得対象のテーブルクラス
+        """
+        self.result: Dict[str, List[dict]] = defaultdict(list)
+        # テーブルごとの取得状況
+        self.stats: Dict[str, BatchGetStat] = {}
+        # コレクション名 -> 取得対象のテーブルクラス
+        self._types: Dict[str, List[Type[SoloHatsudenkiTable]]] = {}
+        # コレクション名 -> プライマリキー名
+        self._key_names: Dict[str, Tuple[str, ...]] = {}
+        # (コレクション名, タグ) -> 行
+        self._buckets: Dict[Tuple[str, Optional[str]], List[dict]] = defaultdict(list)
+        # (コレクション名, シリアライズされたプライマリキー) -> (タグ, バケット内の位置, コレクション内の位置)
+        self._index: Dict[Tuple[str, Tuple], Tuple[Optional[str], int, int]] = {}
+        # コレクションごとの振り分け済みの行数
+        self._bucketed: Dict[str, int] = defaultdict(int)
+        # テーブルクラス -> デシリアライズ済みのモデル（_rows()と同じ並び）
+        self._models: Dict[Type, List] = {}
+
+        for t in table_types:
+            self.register(t)
+        if result:
+            self.add(result, stats)
+        elif stats:
+            self.stats.update(stats)
+
+    @property
+    def is_complete(self):
+        """
+        すべてのキーの処理が完了したか
+
+        :return: bool
+        """
+        return all(s.is_complete for s in self.stats.values())
 
     def __repr__(self):
         return pprint.pformat(self.result)
 
-    def get(self, target_table_type: Type[T]) -> List[T]:
-        col_items = self.result[HatsudenkiClient.resolve_table_name(target_table_type.get_collection_name())]
-        tt = target_table_type.get_table_type()
+    def register(self, table_type: Type[SoloHatsudenkiTable]) -> str:
+        """
+        取得対象のテーブルクラスを登録する
 
-        if tt in {TableType.RootTable, TableType.SingleSoloTable, TableType.SingleMultiTable}:
-            yield from (target_table_type.deserialize(c) for c in col_items)
+        :param table_type: テーブルクラス
+        :return: 実テーブル名
+        """
+        col = HatsudenkiClient.resolve_table_name(table_type.get_collection_name())
+        types = self._types.setdefault(col, [])
+        if table_type not in types:
+            types.append(table_type)
+        if col not in self._key_names:
+            self._key_names[col] = tuple(table_type.get_primary_key_names())
+        return col
+
+    def add(self, items: Dict[str, List[dict]], stats: Dict[str, BatchGetStat] = None, collect=False) -> List:
+        """
+        取得した行を追加する
+
+        :param items: コレクション名をキーとした行リストの辞書
+        :param stats: テーブルごとの取得状況
+        :param collect: 追加した行のうち登録済みのテーブルクラスに該当するものをデシリアライズして返却するか
+        :return: collectがTrueの場合はモデルのリスト。それ以外は空リスト
+        """
+        ret = []
+        for col, rows in items.items():
+            self.result[col].extend(rows)
+            self._bucket(col)
+            if collect:
+                ret.extend(self._collect(col, rows))
+        for k, v in (stats or {}).items():
+            if k in self.stats:
+                self.stats[k].merge(v)
+            else:
+                self.stats[k] = v
+        return ret
+
+    def _bucket(self, col: str):
+        names = self._key_names.get(col)
+        if names is None:
+            # キーが不明なコレクションは最初のget()で振り分ける
+            return
+        rows = self.result.get(col)
+        if not rows:
             return
+        rk = names[1] if len(names) > 1 else None
+        b = self._buckets
+        index = self._index
+        begin = self._bucketed[col]
+        for i, item in enumerate(rows[begin:], begin):
+            tag = _row_tag(item, rk)
+            bucket = b[(col, tag)]
+            index[(col, make_flight_key({k: item[k] for k in names if k in item}))] = (tag, len(bucket), i)
+            bucket.append(item)
+        self._bucketed[col] = len(rows)
+
+    def _rows(self, table_type: Type[SoloHatsudenkiTable], col: str) -> List[dict]:
+        tag = _table_tag(table_type)
+        if tag is None:
+            # 親テーブルや単独テーブルはコレクションのすべての行が対象
+            return self.result.get(col, [])
+        return self._buckets.get((col, tag), [])
+
+    def _materialize(self, table_type: Type[SoloHatsudenkiTable], col: str) -> List:
+        rows = self._rows(table_type, col)
+        models = self._models.setdefault(table_type, [])
+        n = len(models)
+        if n < len(rows):
+            models.extend(table_type.deserialize(r) for r in rows[n:])
+        return models
+
+    def _collect(self, col: str, rows: List[dict]) -> List:
+        types = self._types.get(col)
+        if not types:
+            return []
+        ret = []
+        children = {_table_tag(t): t for t in types if _table_tag(t) is not None}
+        others = [t for t in types if _table_tag(t) is None]
+        for t in children.values():
+            n = len(self._models.get(t, ()))
+            ret.extend(self._materialize(t, col)[n:])
+        for t in others:
+            if not children:
+                n = len(self._models.get(t, ()))
+                ret.extend(self._materialize(t, col)[n:])
+            else:
+                # 子テーブルに該当しなかった行だけを返却する（get()とは対象が異なるのでキャッシュしない）
+                names = self._key_names[col]
+                rk = names[1] if len(names) > 1 else None
+                ret.extend(t.deserialize(r) for r in rows if _row_tag(r, rk) not in children)
+        return ret
+
+    def get(self, target_table_type: Type[T]) -> List[T]:
+        """
+        | 指定したテーブルクラスの取得結果
+        | 子テーブルの場合はタグが一致する行だけ、それ以外の場合はコレクションのすべての行が対象
+
+        :param target_table_type: テーブルクラス
+        :return: モデルインスタンスのリスト
+        """
+        col = self.register(target_table_type)
+        self._bucket(col)
+        return list(self._materialize(target_table_type, col))
+
+    def get_by_key(self, target_table_type: Type[T], hash_val: any, range_val: any = None) -> Optional[T]:
+        """
+        | プライマリキーを指定して取得結果を参照する
+        | 子テーブルの場合はrange_valにエイリアスキーの値を指定する（Table.get()と同じ）
+
+        :param target_table_type: テーブルクラス
+        :param hash_val: ハッシュキーの値
+        :param range_val: レンジキー（エイリアスキー）の値
+        :return: モデルインスタンス。取得結果に含まれない場合はNone
+        """
+        col = self.register(target_table_type)
+        self._bucket(col)
+        return self._lookup(target_table_type, col, hash_val, range_val)
+
+    def get_many_by_keys(self, target_table_type: Type[T], keys: Iterable[any]) -> 'BatchGetLookup':
+        """
+        | 複数のプライマリキーを指定して取得結果を参照する
+        | 結果は指定したキーの順に並び、取得結果に含まれないキーはmissingに格納される
+
+        .. code-block:: python
+
+            r = res.get_many_by_keys(UserItem, [(uid, item_id) for item_id in item_ids])
+            if r.missing:
+                ...
+
+        :param target_table_type: テーブルクラス
+        :param keys: ハッシュキーの値もしくは(ハッシュキー, レンジキー（エイリアスキー）)のタプルのイテラブル
+        :return: BatchGetLookup
+        """
+        col = self.register(target_table_type)
+        self._bucket(col)
+        ret = BatchGetLookup()
+        for k in keys:
+            m = self._lookup(target_table_type, col, *k) if isinstance(k, tuple) else \
+                self._lookup(target_table_type, col, k)
+            ret.items.append(m)
+            if m is None:
+                ret.missing.append(k)
+        return ret
+
+    def _lookup(self, table_type: Type[SoloHatsudenkiTable], col: str, hash_val: any, range_val: any = None):
+        if issubclass(table_type, ChildMultiHatsudenkiTable):
+            range_val = table_type.resolve_alias(range_val)
+        pos = self._index.get((col, make_flight_key(table_type.get_serialized_key(hash_val, range_val))))
+        if pos is None:
+            return None
+        tag, in_bucket, in_col = pos
+        t = _table_tag(table_type)
+        if t is None:
+            return self._materialize(table_type, col)[in_col]
+        if t != tag:
+            # 同じキーの別の子テーブル（通常は起こらない）
+            return None
+        return self._materialize(table_type, col)[in_bucket]
+
+
+@dataclass
+class BatchGetLookup:
+    """
+    BatchGetResponse.get_many_by_keys()の結果
+    """
+    # 指定したキーの順に並んだモデルインスタンス（見つからなかったキーはNone）
+    items: List[any] = field(default_factory=list)
+    # 取得結果に含まれなかったキー（指定した形式のまま）
+    missing: List[any] = field(default_factory=list)
+
+    @property
+    def is_complete(self):
+        """
+        すべてのキーが見つかったか
 
-        for item in col_items:
-            if tt is TableType.ChildTable:
-                if item[target_table_type.get_range_key_name()]['S'].startswith(target_table_type.get_tag_name()):
-                    yield target_table_type.deserialize(item)
-            elif tt is TableType.ChildSoloTable:
-                if item[target_table_type.get_range_key_name()]['S'] == target_table_type.get_tag_name():
-                    yield target_table_type.deserialize(item)
+        :return: bool
+        """
+        return len(self.missing) == 0
+
+    @property
+    def found(self) -> List[any]:
+        """
+        見つかったモデルインスタンスのみ
+
+        :return: list
+        """
+        return [m for m in self.items if m is not None]
+
+    def to_dict(self):
+        return {
+            'items': len(self.items),
+            'found': len(self.items) - len(self.missing),
+            'missing': self.missing,
+        }
@@ -4,23 +4,125 @@ import os
 import time
 from asyncio import sleep
 from copy import deepcopy
+from dataclasses import dataclass, field
 from datetime import date, datetime
 from logging import getLogger
-from random import choice
-from typing import List, AsyncGenerator, IO
+from typing import List, AsyncGenerator, IO, Dict, Optional
 
 from aioboto3 import Session
-from botocore.config import Config
 
-from hatsudenki.packages.counter import QueryCounter
+from hatsudenki.packages.autobatch import AutoBatcher, MAX_BATCH_GET_KEYS
+from hatsudenki.packages.counter import QueryCounter, payload_size, table_label
 from hatsudenki.packages.expression.base import BaseExpression
 from hatsudenki.packages.expression.condition import ConditionExpression, KeyConditionExpression, \
     FilterConditionExpression
+from hatsudenki.packages.expression.projection import ProjectionExpression
 from hatsudenki.packages.expression.update import UpdateExpression
+from hatsudenki.packages.limiter import RateLimiter, Priority, priority, OPERATION_CAPACITY_KIND
+from hatsudenki.packages.pool import ClientPool, PoolConfig
+from hatsudenki.packages.retry import RetryPolicy, RetryCategory
+from hatsudenki.packages.singleflight import SingleFlight, make_flight_key
+from hatsudenki.packages.slowlog import SlowLog, SlowLogSink
+from hatsudenki.packages.tracing import Tracer, Span, span_name, request_attributes, set_response_attributes
 
 _logger = getLogger(__name__)
 
 
+@dataclass
+class BatchGetStat:
+    """
+    BatchGetItemのテーブルごとの取得状況
+    """
+    # リクエストしたキー数
+    requested: int = 0
+    # 取得できたアイテム数（存在しないキーは含まれない）
+    returned: int = 0
+    # このテーブルを含むリクエストの発行回数
+    requests: int = 0
+    # UnprocessedKeysとして返却されたキーの延べ数
+    unprocessed: int = 0
+    # リトライ上限に達し、取得できなかったキー数
+    abandoned: int = 0
+
+    @property
+    def is_complete(self):
+        """
+        すべてのキーの処理が完了したか
+
+        :return: bool
+        """
+        return self.abandoned == 0
+
+    def merge(self, other: 'BatchGetStat'):
+        """
+        他の取得状況を合算する
+
+        :param other: 合算するBatchGetStat
+        :return: None
+        """
+        self.requested += other.requested
+        self.returned += other.returned
+        self.requests += other.requests
+        self.unprocessed += other.unprocessed
+        self.abandoned += other.abandoned
+
+
+@dataclass
+class BatchWriteStat:
+    """
+    BatchWriteItemの書き込み状況
+    """
+    # リクエストした書き込み数
+    requested: int = 0
+    # リクエストの発行回数
+    requests: int = 0
+    # UnprocessedItemsとして返却された書き込みの延べ数
+    unprocessed: int = 0
+    # リトライ上限に達し、書き込めなかった数
+    abandoned: int = 0
+
+    @property
+    def is_complete(self):
+        """
+        すべての書き込みが完了したか
+
+        :return: bool
+        """
+        return self.abandoned == 0
+
+    def merge(self, other: 'BatchWriteStat'):
+        """
+        他の書き込み状況を合算する
+
+        :param other: 合算するBatchWriteStat
+        :return: None
+        """
+        self.requested += other.requested
+        self.requests += other.requests
+        self.unprocessed += other.unprocessed
+        self.abandoned += other.abandoned
+
+
+@dataclass
+class QueryPage:
+    """
+    Queryの1ページ分の結果
+    """
+    # アイテムリスト
+    items: list = field(default_factory=list)
+    # 続きを取得するためのキー（ExclusiveStartKeyに渡す）。最終ページの場合はNone
+    last_key: Optional[dict] = None
+
+    @property
+    def has_next(self):
+        """
+        続きのページが存在するか
+
+        :return: bool
+        """
+        return self.last_key is not None
+
+
 class HatsudenkiClient(object):
     """
     DynamoDBクライアント
@@ -28,31 +130,78 @@ class HatsudenkiClient(object):
 
     #: クライアントインスタンス
     _clients = []
+    #: クライアントプール
+    _pool: ClientPool = None
     _prefix: str = None
-    _is_out_slow_log = False
-    _slow_log_duration = 0.1
+    #: スロークエリログ。Noneの場合は記録しない
+    _slow_log: Optional[SlowLog] = None
+    #: トレーサー。Noneの場合はスパンを生成しない
+    _tracer: Optional[Tracer] = None
     _use_profiler = False
+    _retry_policy: RetryPolicy = RetryPolicy()
+    #: get_itemの集約。Noneの場合は集約しない
+    _single_flight: Optional[SingleFlight] = None
+    #: get_itemの自動バッチ化。Noneの場合はget_itemをそのまま発行する
+    _auto_batcher: Optional[AutoBatcher] = None
+    #: クライアント側レートリミッター。Noneの場合は制限しない
+    _rate_limiter: Optional[RateLimiter] = None
 
     @classmethod
     def dump_count(cls):
         if cls._use_profiler:
             QueryCounter.dump_counter()
+            print('-retry-')
+            print(cls._retry_policy.stats.to_dict())
 
     @classmethod
-    def setup_by_session(cls, session, prefix: str, endpoint: str = None, connection_num: int = 10):
-        con = Config(
-            parameter_validation=False,
-            max_pool_connections=1,
-        )
+    def setup_by_session(cls, session, prefix: str, endpoint: str = None, connection_num: int = 10,
+                         retry_policy: RetryPolicy = None, pool_config: PoolConfig = None):
+        """
+        | セッションを指定して初期設定を行う。
+
+        :param session: aioboto3のSession
+        :param prefix: テーブルのプリフィックス
+        :param endpoint: エンドポイント
+        :param connection_num: HTTPコネクション数の上限（pool_configが指定された場合は無視される）
+        :param retry_policy: リトライポリシー
+        :param pool_config: コネクションプールの設定
+        :return: None
+        """
+        if retry_policy is not None:
+            cls.set_retry_policy(retry_policy)
+
+        if pool_config is None:
+            pool_config = PoolConfig(max_connections=connection_num)
 
-        print(f'connect dynamodb. endpoint={endpoint} prefix={prefix}, connection_num={connection_num}')
-        for _ in range(connection_num):
-            cls._clients.append(session.client('dynamodb', endpoint_url=endpoint, config=con, use_ssl=False))
+        print(f'connect dynamodb. endpoint={endpoint} prefix={prefix}, '
+              f'client_num={pool_config.client_num} max_connections={pool_config.max_connections}')
+        cls.set_pool(ClientPool.create(session, pool_config, endpoint))
         cls._prefix = prefix
 
+    @classmethod
+    def set_pool(cls, pool: ClientPool):
+        """
+        クライアントプールを差し替える
+
+        :param pool: ClientPool
+        :return: None
+        """
+        cls._pool = pool
+        cls._clients = pool.clients
+
+    @classmethod
+    def get_pool_stats(cls):
+        """
+        コネクションプールの利用状況を取得
+
+        :return: dict
+        """
+        return cls._pool.get_stats()
+
     @classmethod
     def setup(cls, loop, endpoint: str, prefix: str = '', region_name: str = None, aws_access_key_id: str = None,
-              aws_secret_access_key: str = None, pool_num: int = 10):
+              aws_secret_access_key: str = None, pool_num: int = 10, retry_policy: RetryPolicy = None,
+              pool_config: PoolConfig = None):
         """
         | 初期設定を行う。
         | すべての処理より先に一度だけ呼び出すこと
@@ -60,6 +209,9 @@ class HatsudenkiClient(object):
         :param loop: 処理を行うIOループ
         :param endpoint: エンドポイント
         :param prefix: テーブルのプリフィックス
+        :param pool_num: HTTPコネクション数の上限（pool_configが指定された場合は無視される）
+        :param retry_policy: リトライポリシー。省略時はデフォルト設定のRetryPolicyを使用する
+        :param pool_config: コネクションプールの設定
         :return: None
         """
 
@@ -88,35 +240,264 @@ class HatsudenkiClient(object):
             **d
         )
 
-        cls.setup_by_session(session=ses, prefix=prefix, endpoint=endpoint, connection_num=pool_num)
+        cls.setup_by_session(session=ses, prefix=prefix, endpoint=endpoint, connection_num=pool_num,
+                             retry_policy=retry_policy, pool_config=pool_config)
+
+    @classmethod
+    def set_single_flight(cls, flg: bool, window: float = 0):
+        """
+        | get_itemの集約を設定する
+        | 有効にすると同一テーブル・同一キー・同一プロジェクションの同時読み込みが1リクエストにまとめられる
+
+        :param flg: 有効にする場合はTrue
+        :param window: 完了後に結果を再利用する秒数。0の場合は処理中のリクエストのみ共有する
+        :return: None
+        """
+        cls._single_flight = SingleFlight(window) if flg else None
+
+    @classmethod
+    def get_single_flight_stats(cls):
+        """
+        get_itemの集約状況を取得
+
+        :return: dict。集約が無効な場合はNone
+        """
+        if cls._single_flight is None:
+            return None
+        return cls._single_flight.stats.to_dict()
 
     @classmethod
-    def set_slow_log(cls, flg: bool, duration: float):
-        cls._is_out_slow_log = flg
-        cls._slow_log_duration = duration
+    def set_auto_batch(cls, flg: bool, window: float = 0, max_batch: int = MAX_BATCH_GET_KEYS, max_retry: int = 10):
+        """
+        | get_itemの自動バッチ化を設定する
+        | 有効にすると同一tick内（もしくはwindow秒以内）に発行されたget_itemがBatchGetItemにまとめられる
+        | 集約（set_single_flight）と併用した場合は集約された後のリクエストがバッチ化の対象となる
+
+        :param flg: 有効にする場合はTrue
+        :param window: キーを溜める秒数。0の場合は同一tick内のみまとめる
+        :param max_batch: 1リクエストあたりの最大キー数（上限100）
+        :param max_retry: UnprocessedKeysに対する最大リクエスト回数。超えた分は個別にget_itemする
+        :return: None
+        """
+        if not flg:
+            cls._auto_batcher = None
+            return
+        cls._auto_batcher = AutoBatcher(
+            fetch=cls.batch_get_item_with_stats,
+            fallback=lambda t, k, p: cls._get_item(t, k, p, raw_table_name=True),
+            window=window, max_batch=max_batch, max_retry=max_retry)
+
+    @classmethod
+    def get_auto_batch_stats(cls):
+        """
+        get_itemの自動バッチ化の状況を取得
+
+        :return: dict。自動バッチ化が無効な場合はNone
+        """
+        if cls._auto_batcher is None:
+            return None
+        return cls._auto_batcher.stats.to_dict()
+
+    @classmethod
+    def set_rate_limiter(cls, limiter: Optional[RateLimiter]):
+        """
+        | クライアント側レートリミッターを設定する
+        | 設定するとConsumedCapacityを取得するため、すべてのリクエストにReturnConsumedCapacityが付与される
+
+        :param limiter: RateLimiter。Noneの場合は制限しない
+        :return: None
+        """
+        cls._rate_limiter = limiter
+
+    @classmethod
+    async def enable_rate_limit(cls, table_names: List[str] = None, adaptive: bool = True, utilization: float = 1,
+                                burst_seconds: float = 1, background_reserve: float = 0.5):
+        """
+        | describe_tableのProvisionedThroughputを元にテーブル・GSIごとのレートリミッターを有効にする
+        | オンデマンドのテーブルは制限しない
+
+        :param table_names: 対象テーブル名のリスト。省略時はlist_tablesで取得したすべてのテーブル
+        :param adaptive: スロットリングに応じてレートを調整するか
+        :param utilization: プロビジョニングされたキャパシティのうち使用する割合
+        :param burst_seconds: 何秒分のキャパシティをバースト可能とするか
+        :param background_reserve: Background優先度のリクエストが発行できるトークン残量（容量に対する割合）
+        :return: RateLimiter
+        """
+        limiter = RateLimiter(adaptive=adaptive, burst_seconds=burst_seconds, utilization=utilization,
+                              background_reserve=background_reserve)
+        if table_names is None:
+            table_names = await cls.list_tables()
+        for desc in await asyncio.gather(*[cls.describe_table(t) for t in table_names]):
+            limiter.seed(desc)
+        cls.set_rate_limiter(limiter)
+        return limiter
+
+    @classmethod
+    def get_rate_limit_stats(cls):
+        """
+        レートリミッターの状況を取得
+
+        :return: dict。レートリミッターが無効な場合はNone
+        """
+        if cls._rate_limiter is None:
+            return None
+        return cls._rate_limiter.get_stats()
+
+    @classmethod
+    def _invalidate_flight(cls, table_name: str):
+        if cls._single_flight is not None:
+            cls._single_flight.invalidate(table_name)
+
+    @classmethod
+    def set_slow_log(cls, flg: bool, duration: float, sink: SlowLogSink = None, sample_rate: float = 1.0,
+                     max_per_sec: float = 10):
+        """
+        | スロークエリログを設定する
+        | リトライを含めたレイテンシが閾値を超えたリクエストを、可読化した式やConsumedCapacityと共に記録する
+        | 設定するとConsumedCapacityを取得するため、すべてのリクエストにReturnConsumedCapacityが付与される
+
+        :param flg: 有効にするか
+        :param duration: 閾値（秒）
+        :param sink: 出力先。省略時はloggingに出力する
+        :param sample_rate: 閾値を超えたリクエストのうち出力する割合（0〜1）
+        :param max_per_sec: 1秒あたりの最大出力数
+        :return: SlowLog。無効にした場合はNone
+        """
+        cls._slow_log = SlowLog(duration, sink, sample_rate, max_per_sec) if flg else None
+        return cls._slow_log
+
+    @classmethod
+    def get_slow_log_stats(cls):
+        """
+        スロークエリログの出力状況を取得
+
+        :return: dict。スロークエリログが無効な場合はNone
+        """
+        if cls._slow_log is None:
+            return None
+        return cls._slow_log.stats.to_dict()
+
+    @classmethod
+    def set_tracer(cls, tracer: Optional[Tracer]):
+        """
+        | トレーサーを設定する
+        | DynamoDBへのリクエストごと（リトライを含む）にスパンを生成し、テーブル名・件数・リトライ回数・消費キャパシティを属性に設定する
+        | OpenTelemetryのTracerをそのまま設定できる
+        | 設定するとConsumedCapacityを取得するため、すべてのリクエストにReturnConsumedCapacityが付与される
+
+        :param tracer: Tracer。Noneの場合はスパンを生成しない
+        :return: None
+        """
+        cls._tracer = tracer
 
     @classmethod
     def set_use_profiler(cls, flg: bool):
         cls._use_profiler = flg
 
     @classmethod
-    def _take(cls):
-        if cls._is_out_slow_log:
-            return time.time()
-        return None
+    def set_retry_policy(cls, policy: RetryPolicy):
+        cls._retry_policy = policy
 
     @classmethod
-    def _cheese(cls, sec, label: str, key: dict):
-        if cls._is_out_slow_log:
-            p = time.time() - sec
-            if p >= cls._slow_log_duration:
-                _logger.warning(f'[SLOW] {label} sec={p}', key)
-        else:
-            return
+    def get_retry_stats(cls):
+        """
+        リトライの発生状況を取得
+
+        :return: RetryStatsインスタンス
+        """
+        return cls._retry_policy.stats
+
+    @classmethod
+    def get_retry_policy(cls) -> RetryPolicy:
+        """
+        設定されているリトライポリシーを取得
+
+        :return: RetryPolicyインスタンス
+        """
+        return cls._retry_policy
 
     @classmethod
     def _get_client(cls):
-        return choice(cls._clients)
+        return cls._pool.pick().client
+
+    @classmethod
+    async def _request(cls, operation: str, params: dict):
+        """
+        | DynamoDBへのリクエストを発行する
+        | スロットリングや一時的な障害はリトライポリシーに従ってバックオフしながらリトライする
+        | 一時的な障害は冪等なリクエストのみリトライする（RetryPolicy.is_idempotent）
+        | レートリミッターが有効な場合はトークンが貯まるまで待ってから発行する
+        | トレーサーが設定されている場合はリトライを含めたリクエスト全体をスパンで囲む
+
+        :param operation: オペレーション名(get_item等)
+        :param params: リクエストパラメータ
+        :return: AWSレスポンス
+        """
+        tracer = cls._tracer
+        if tracer is None:
+            return await cls._send(operation, params, None)
+
+        span = tracer.start_span(span_name(operation), attributes=request_attributes(operation, params))
+        try:
+            return await cls._send(operation, params, span)
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end()
+
+    @classmethod
+    async def _send(cls, operation: str, params: dict, span: Optional[Span]):
+        policy = cls._retry_policy
+        pool = cls._pool
+        limiter = cls._rate_limiter
+        slow_log = cls._slow_log
+        need_capacity = limiter is not None or slow_log is not None or span is not None
+        if need_capacity and operation in OPERATION_CAPACITY_KIND:
+            params['ReturnConsumedCapacity'] = 'INDEXES'
+        policy.on_call()
+        idempotent = policy.is_idempotent(operation, params)
+        begin = time.perf_counter() if cls._use_profiler or slow_log is not None else None
+        attempt = 0
+        while True:
+            buckets = await limiter.acquire(operation, params) if limiter is not None else None
+            c = await pool.acquire()
+            try:
+                res = await getattr(c.client, operation)(**params)
+            except Exception as e:
+                if limiter is not None:
+                    limiter.refund(buckets)
+                    if policy.classify(e) is RetryCategory.Throttle:
+                        limiter.on_throttle(operation, params)
+                delay = policy.on_error(e, attempt, idempotent)
+                if delay is None:
+                    if span is not None:
+                        span.set_attribute('hatsudenki.retries', attempt)
+                    raise
+                _logger.warning(f'{operation} failed. retry={attempt} delay={delay:.3f} error={e}')
+                if span is not None:
+                    span.add_event('retry', {'attempt': attempt, 'delay': delay, 'error': repr(e)})
+            else:
+                if limiter is not None:
+                    limiter.consume(operation, res, buckets)
+                policy.on_success()
+                if begin is not None:
+                    sec = time.perf_counter() - begin
+                    if cls._use_profiler:
+                        cls._observe(operation, params, res, sec)
+                    if slow_log is not None:
+                        slow_log.on_request(operation, params, res, sec, attempt)
+                if span is not None:
+                    set_response_attributes(span, operation, res, attempt)
+                return res
+            finally:
+                pool.release(c)
+            attempt += 1
+            await sleep(delay)
+
+    @classmethod
+    def _observe(cls, operation: str, params: dict, res: dict, sec: float):
+        QueryCounter.observe(operation, table_label(params), sec, payload_size(params, res))
 
     @classmethod
     def resolve_table_name(cls, table_name: str, skip: bool = False):
@@ -166,7 +547,7 @@ class HatsudenkiClient(object):
                     del g['ProvisionedThroughput']
             p['GlobalSecondaryIndexes'] = gsi
 
-        res = await cls._get_client().create_table(**p)
+        res = await cls._request('create_table', p)
 
         return res
 
@@ -261,7 +642,7 @@ class HatsudenkiClient(object):
                     }
                 ],
             }
-            await cls._get_client().update_table(**p)
+            await cls._request('update_table', p)
 
             # 完了を待つ
             for _ in range(60):
@@ -297,7 +678,7 @@ class HatsudenkiClient(object):
                 ],
             }
 
-            await cls._get_client().update_table(**p)
+            await cls._request('update_table', p)
 
             # 完了を待つ
             for _ in range(60):
@@ -312,12 +693,10 @@ class HatsudenkiClient(object):
 
     @classmethod
     async def drop_table(cls, table_name: str):
-        _start = cls._take()
         p = {
             'TableName': cls.resolve_table_name(table_name)
         }
-        res = await cls._get_client().delete_table(**p)
-        cls._cheese(_start, f'drop_table {table_name}', p)
+        res = await cls._request('delete_table', p)
         return res
 
     @classmethod
@@ -329,12 +708,10 @@ class HatsudenkiClient(object):
         :return: テーブル情報を格納した辞書配列。AWSのレスポンス参照
         """
 
-        _start = cls._take()
         p = {
             'TableName': cls.resolve_table_name(table_name)
         }
-        res = await cls._get_client().describe_table(**p)
-        cls._cheese(_start, f'describe_table {table_name}', p)
+        res = await cls._request('describe_table', p)
         return res['Table']
 
     @classmethod
@@ -344,7 +721,6 @@ class HatsudenkiClient(object):
 
         :return: テーブル名のリスト
         """
-        _start = cls._take()
         st = cls._prefix or ''
 
         if start_table_name:
@@ -354,37 +730,59 @@ class HatsudenkiClient(object):
             **({'ExclusiveStartTableName': st} if len(st) is not 0 else {})
         }
 
-        res = await cls._get_client().list_tables(**p)
-        cls._cheese(_start, f'list_tables {start_table_name}', p)
+        res = await cls._request('list_tables', p)
         return [i.replace(st, '') for i in res.get('TableNames')]
 
     @classmethod
-    async def get_item(cls, table_name: str, key: dict, prj: List[str] = None):
+    async def get_item(cls, table_name: str, key: dict, prj: List[str] = None, consistent_read=False):
         """
-        キー指定式を使用して一件取得
+        | キー指定式を使用して一件取得
+        | set_single_flightで集約が有効になっている場合、同じキーへの同時読み込みは1リクエストにまとめられる
+        | consistent_readを指定した場合は強い整合性で読み込み、集約や自動バッチ化は行わない
 
         :param table_name: テーブル名
         :param key: キー指定式辞書配列
+        :param prj: プロジェクション情報
+        :param consistent_read: 強い整合性で読み込むか
         :return: アイテム情報を格納した辞書配列。AWSレスポンス参照。アイテムが存在しない場合はNone
         """
+        if consistent_read:
+            # 他の読み込み結果を共有すると古い値が返る可能性がある
+            return await cls._get_item(table_name, key, prj, consistent_read=True)
+
+        sf = cls._single_flight
+        if sf is None:
+            return await cls._load_item(table_name, key, prj)
+
+        return await sf.do(cls.resolve_table_name(table_name), make_flight_key(key, prj),
+                           lambda: cls._load_item(table_name, key, prj))
 
-        _start = cls._take()
+    @classmethod
+    async def _load_item(cls, table_name: str, key: dict, prj: List[str] = None):
+        ab = cls._auto_batcher
+        if ab is None:
+            return await cls._get_item(table_name, key, prj)
+        return await ab.load(cls.resolve_table_name(table_name), key, prj)
+
+    @classmethod
+    async def _get_item(cls, table_name: str, key: dict, prj: List[str] = None, raw_table_name=False,
+                        consistent_read=False):
         p = {
-            'TableName': cls.resolve_table_name(table_name),
+            'TableName': cls.resolve_table_name(table_name, raw_table_name),
             'Key': key
         }
+        if consistent_read:
+            p['ConsistentRead'] = True
 
-        if prj is not None:
-            p['ProjectionExpression'] = ','.join(prj)
-
-        res = await cls._get_client().get_item(**p)
+        ProjectionExpression.apply(p, prj)
 
         if cls._use_profiler:
             p['ReturnConsumedCapacity'] = 'INDEXES'
 
+        res = await cls._request('get_item', p)
+
         r = res.get('Item', None)
 
-        cls._cheese(_start, f'get_item, {table_name}', p)
         if cls._use_profiler:
             if key.get('kind', None):
                 QueryCounter.count('get', f"{table_name} - {key['kind']['S'].split('//')[0]}")
@@ -409,7 +807,6 @@ class HatsudenkiClient(object):
         :param raw_table_name: テーブル名にプリフィックスを付与しない
         :return: AWSレスポンス
         """
-        _start = cls._take()
 
         p = {
             'TableName': cls.resolve_table_name(table_name, raw_table_name),
@@ -420,9 +817,9 @@ class HatsudenkiClient(object):
         if cls._use_profiler:
             p['ReturnConsumedCapacity'] = 'INDEXES'
 
-        res = await cls._get_client().put_item(**p)
+        res = await cls._request('put_item', p)
+        cls._invalidate_flight(p['TableName'])
 
-        cls._cheese(_start, f'put_item {table_name}', p)
         if cls._use_profiler:
             if item.get('kind', None):
                 QueryCounter.count('put', f"{table_name} - {item['kind']['S'].split('//')[0]}")
@@ -437,7 +834,6 @@ class HatsudenkiClient(object):
 
     @classmethod
     async def delete_item(cls, table_name, key: dict, condition: ConditionExpression = None, raw_table_name=False):
-        _start = cls._take()
 
         p = {
             'TableName': cls.resolve_table_name(table_name, raw_table_name),
@@ -445,9 +841,9 @@ class HatsudenkiClient(object):
             **(condition.to_parameter() if condition is not None else {})
         }
 
-        res = await cls._get_client().delete_item(**p)
+        res = await cls._request('delete_item', p)
+        cls._invalidate_flight(p['TableName'])
 
-        cls._cheese(_start, f'delete_item {table_name}', p)
         return res
 
     @classmethod
@@ -462,7 +858,6 @@ class HatsudenkiClient(object):
         :param condition: 更新条件式インスタンス
         :return: AWSレスポンス
         """
-        _start = cls._take()
 
         p = {
             'TableName': cls.resolve_table_name(table_name, raw_table_name),
@@ -472,9 +867,9 @@ class HatsudenkiClient(object):
 
         if cls._use_profiler:
             p['ReturnConsumedCapacity'] = 'INDEXES'
-        res = await cls._get_client().update_item(**p)
+        res = await cls._request('update_item', p)
+        cls._invalidate_flight(p['TableName'])
 
-        cls._cheese(_start, f'update_item {table_name}', p)
         if cls._use_profiler:
             if key.get('kind', None):
                 QueryCounter.count('update', f"{table_name} - {key['kind']['S'].split('//')[0]}")
@@ -489,7 +884,8 @@ class HatsudenkiClient(object):
     async def query(cls, table_name: str, key_cond: KeyConditionExpression, filter_cond: BaseExpression = None,
                     use_index_name: str = None, limit=0, prj: List[str] = None, raw_table_name=False, max_retry=100):
         """
-        条件式を複数指定する検索。複数件のアイテムを返却する
+        | 条件式を複数指定する検索。複数件のアイテムを返却する
+        | limitが指定された場合はlimit件集まった時点でページングを打ち切る
 
         :param table_name: 対象テーブル名
         :param key_cond: キー絞り込み
@@ -498,29 +894,65 @@ class HatsudenkiClient(object):
         :param limit: リミット
         :param prj: プロジェクション情報
         :param raw_table_name: テーブル名にプリフィックスを付与しない
+        :param max_retry: 最大ページ数
         :return: AWSレスポンス
         """
         ret = []
-        last_key = None
+        page = None
 
-        for query_num in range(max_retry):
-            _start = cls._take()
+        gen = cls.query_generator(table_name=table_name, key_cond=key_cond, filter_cond=filter_cond,
+                                  use_index_name=use_index_name, page_size=limit, prj=prj,
+                                  raw_table_name=raw_table_name, max_pages=max_retry)
+        async for page in gen:
+            ret.extend(page.items)
+            if 0 < limit <= len(ret):
+                del ret[limit:]
+                await gen.aclose()
+                return ret
 
-            p = {
-                'TableName': cls.resolve_table_name(table_name, raw_table_name),
-                **({'IndexName': use_index_name} if use_index_name is not None else {}),
-                **({'Limit': limit} if limit > 0 is not None else {}),
-                **(BaseExpression.merge(key_cond, filter_cond))
-            }
-            if prj is not None:
-                p['ProjectionExpression'] = ','.join(prj)
+        if page is not None and page.has_next:
+            _logger.warning(f'query truncated. table={table_name} pages={max_retry}')
 
-            if cls._use_profiler:
-                p['ReturnConsumedCapacity'] = 'INDEXES'
+        return ret
 
-            res = await cls._get_client().query(**p)
+    @classmethod
+    async def query_generator(cls, table_name: str, key_cond: KeyConditionExpression,
+                              filter_cond: BaseExpression = None, use_index_name: str = None, page_size=0,
+                              prj: List[str] = None, raw_table_name=False, start_key: dict = None,
+                              max_pages: int = None) -> AsyncGenerator['QueryPage', None]:
+        """
+        | 検索結果をページ単位で返却するジェネレータ
+        | 1ページ取得するごとに返却するので、保持するのは常に1ページ分だけとなる
+        | 返却されたQueryPageのlast_keyをstart_keyに渡すことで続きから再開できる
 
-            cls._cheese(_start, f'query {table_name}', p)
+        :param table_name: 対象テーブル名
+        :param key_cond: キー絞り込み
+        :param filter_cond: フィルター
+        :param use_index_name: 使用するインデックス名
+        :param page_size: 1ページあたりの最大評価件数（0の場合は1MBまで）
+        :param prj: プロジェクション情報
+        :param raw_table_name: テーブル名にプリフィックスを付与しない
+        :param start_key: 再開位置（ExclusiveStartKey）
+        :param max_pages: 最大ページ数
+        :return: QueryPageのジェネレータ
+        """
+        p = {
+            'TableName': cls.resolve_table_name(table_name, raw_table_name),
+            **({'IndexName': use_index_name} if use_index_name is not None else {}),
+            **({'Limit': page_size} if page_size > 0 else {}),
+            **(BaseExpression.merge(key_cond, filter_cond))
+        }
+        ProjectionExpression.apply(p, prj)
+
+        if cls._use_profiler:
+            p['ReturnConsumedCapacity'] = 'INDEXES'
+
+        if start_key is not None:
+            p['ExclusiveStartKey'] = start_key
+
+        page_num = 0
+        while True:
+            res = await cls._request('query', p)
 
             if cls._use_profiler:
                 if p['ExpressionAttributeValues'].get(':key_value__1', None):
@@ -531,15 +963,14 @@ class HatsudenkiClient(object):
                 consumed_cu = res.get('ConsumedCapacity', False)
                 if consumed_cu:
                     QueryCounter.count_read_ccu(consumed_cu)
-            ret.extend(res['Items'])
+
             last_key = res.get('LastEvaluatedKey')
-            if last_key is None:
-                break
-            else:
-                _logger.warning(f'over 1MB response. query next {query_num}')
-                await asyncio.sleep(0.1)
+            yield QueryPage(items=res['Items'], last_key=last_key)
 
-        return ret
+            page_num += 1
+            if last_key is None or (max_pages is not None and page_num >= max_pages):
+                return
+            p['ExclusiveStartKey'] = last_key
 
     @classmethod
     async def scan(cls, table_name: str, filter_cond: FilterConditionExpression = None, limit=20,
@@ -551,27 +982,22 @@ class HatsudenkiClient(object):
         :param filter_cond: 絞り込み条件式
         :return: AWSレスポンス
         """
-        _start = cls._take()
         p = {
             'TableName': cls.resolve_table_name(table_name, raw_table_name),
             **(filter_cond.to_parameter() if filter_cond is not None else {}),
             'Limit': limit
         }
-        if prj is not None:
-            p['ProjectionExpression'] = ','.join(prj)
+        ProjectionExpression.apply(p, prj)
 
-        res = await cls._get_client().scan(**p)
+        res = await cls._request('scan', p)
         ret = res['Items']
-        cls._cheese(_start, f'scan {table_name}', p)
         if len(ret) >= limit:
             return ret[:limit]
 
         while 'LastEvaluatedKey' in res:
-            _start = cls._take()
             p['ExclusiveStartKey'] = res['LastEvaluatedKey']
-            res = await cls._get_client().scan(**p)
+            res = await cls._request('scan', p)
             ret.extend(res['Items'])
-            cls._cheese(_start, f'scan {table_name}', p)
             if len(ret) >= limit:
                 return ret[:limit]
 
@@ -579,17 +1005,35 @@ class HatsudenkiClient(object):
 
     @classmethod
     async def scan_generator(cls, table_name: str, filter_cond: FilterConditionExpression = None, tick=100,
-                             prj: List[str] = None, raw_table_name=False) -> AsyncGenerator[List[dict], None]:
+                             prj: List[str] = None, raw_table_name=False, segments: int = 1,
+                             max_pages: int = None) -> AsyncGenerator[List[dict], None]:
+        """
+        フルスキャンをページ単位で返却するジェネレータ
+
+        :param table_name: 対象テーブル名
+        :param filter_cond: 絞り込み条件式
+        :param tick: 1リクエストあたりの取得件数
+        :param prj: プロジェクション情報
+        :param raw_table_name: テーブル名にプリフィックスを付与しない
+        :param segments: 並列スキャンのセグメント数。2以上の場合はparallel_scan_generatorを使用する
+        :param max_pages: 並列スキャン時に保持できる未処理ページ数の上限
+        :return: アイテムリストのジェネレータ
+        """
+        if segments > 1:
+            gen = cls.parallel_scan_generator(table_name=table_name, segments=segments, filter_cond=filter_cond,
+                                              tick=tick, prj=prj, raw_table_name=raw_table_name, max_pages=max_pages)
+            async for l in gen:
+                yield l
+            return
 
         p = {
             'TableName': cls.resolve_table_name(table_name, raw_table_name),
             **(filter_cond.to_parameter() if filter_cond is not None else {}),
             'Limit': tick
         }
-        if prj is not None:
-            p['ProjectionExpression'] = ','.join(prj)
+        ProjectionExpression.apply(p, prj)
 
-        res = await cls._get_client().scan(**p)
+        res = await cls._request('scan', p)
         ret = res['Items']
         yield ret
 
@@ -598,12 +1042,81 @@ class HatsudenkiClient(object):
 
         while 'LastEvaluatedKey' in res:
             p['ExclusiveStartKey'] = res['LastEvaluatedKey']
-            res = await cls._get_client().scan(**p)
+            res = await cls._request('scan', p)
             yield res['Items']
 
+    @classmethod
+    async def parallel_scan_generator(cls, table_name: str, segments: int, filter_cond: FilterConditionExpression = None,
+                                      tick=100, prj: List[str] = None, raw_table_name=False,
+                                      max_pages: int = None) -> AsyncGenerator[List[dict], None]:
+        """
+        | Segment/TotalSegmentsを使用した並列フルスキャン
+        | セグメントごとにワーカーを起動し、取得できたページから順に返却する（順序は保証されない）
+        | 未処理ページがmax_pagesに達した場合、ワーカーは消費されるまで次のリクエストを待機する
+
+        :param table_name: 対象テーブル名
+        :param segments: セグメント数（同時に走るワーカー数）
+        :param filter_cond: 絞り込み条件式
+        :param tick: 1リクエストあたりの取得件数
+        :param prj: プロジェクション情報
+        :param raw_table_name: テーブル名にプリフィックスを付与しない
+        :param max_pages: 保持できる未処理ページ数の上限。省略時はセグメント数と同じ
+        :return: アイテムリストのジェネレータ
+        """
+        if segments < 1:
+            raise Exception(f'invalid segments {segments}')
+
+        p = {
+            'TableName': cls.resolve_table_name(table_name, raw_table_name),
+            **(filter_cond.to_parameter() if filter_cond is not None else {}),
+            'Limit': tick,
+            'TotalSegments': segments
+        }
+        ProjectionExpression.apply(p, prj)
+
+        # ワーカーの終了通知
+        done = object()
+        queue = asyncio.Queue(maxsize=max_pages or segments)
+
+        async def _worker(segment: int):
+            sp = {**p, 'Segment': segment}
+            try:
+                while True:
+                    res = await cls._request('scan', sp)
+                    await queue.put(res['Items'])
+
+                    last_key = res.get('LastEvaluatedKey')
+                    if last_key is None:
+                        break
+                    sp['ExclusiveStartKey'] = last_key
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 例外は消費側で送出する
+                await queue.put(e)
+                return
+            await queue.put(done)
+
+        workers = [asyncio.ensure_future(_worker(s)) for s in range(segments)]
+        try:
+            remain = segments
+            while remain > 0:
+                r = await queue.get()
+                if r is done:
+                    remain -= 1
+                    continue
+                if isinstance(r, Exception):
+                    raise r
+                yield r
+        finally:
+            # 途中で打ち切られた場合も含め、残っているワーカーは止める
+            for w in workers:
+                if not w.done():
+                    w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
     @classmethod
     async def set_ttl_mode(cls, table_name: str, attr_name: str, set_mode=True, raw_table_name=False):
-        _start = cls._take()
         p = {
             'TableName': cls.resolve_table_name(table_name),
             'TimeToLiveSpecification': {
@@ -611,53 +1124,108 @@ class HatsudenkiClient(object):
                 'AttributeName': attr_name
             }
         }
-        res = await cls._get_client().update_time_to_live(**p)
+        res = await cls._request('update_time_to_live', p)
 
-        cls._cheese(_start, f'set_ttl_mode {table_name}', p)
         return res
 
     @classmethod
     async def batch_get_item(cls, request_items: dict, max_retry=100):
-        ret = {}
+        """
+        BatchGetItemを発行する
+
+        :param request_items: テーブル名をキーとしたリクエスト
+        :param max_retry: UnprocessedKeysに対する最大リクエスト回数
+        :return: テーブル名をキーとしたアイテムリストの辞書配列
+        """
+        ret, _ = await cls.batch_get_item_with_stats(request_items, max_retry)
+        return ret
+
+    @classmethod
+    async def batch_get_item_with_stats(cls, request_items: dict, max_retry=100):
+        """
+        | BatchGetItemを発行し、テーブルごとの取得状況も合わせて返却する
+        | UnprocessedKeysが返却された場合は未処理のキーだけをバックオフしながら再リクエストする
+
+        :param request_items: テーブル名をキーとしたリクエスト
+        :param max_retry: UnprocessedKeysに対する最大リクエスト回数
+        :return: [0]テーブル名をキーとしたアイテムリストの辞書配列、[1]テーブル名をキーとしたBatchGetStatの辞書配列
+        """
+        ret: Dict[str, List[dict]] = {}
+        stats = {k: BatchGetStat(requested=len(v['Keys'])) for k, v in request_items.items()}
         req_items = request_items
 
         for cnt in range(max_retry):
-            _start = cls._take()
             p = {
                 'RequestItems': req_items
             }
             if cls._use_profiler:
                 p['ReturnConsumedCapacity'] = 'INDEXES'
 
-            res = await cls._get_client().batch_get_item(**p)
-            cls._cheese(_start, 'batch_get_item', p)
+            res = await cls._request('batch_get_item', p)
 
             if cls._use_profiler:
                 QueryCounter.count('batch_get')
-                consumed_cu_list = res.get('ConsumedCapacity', False)
+                consumed_cu_list = res.get('ConsumedCapacity', [])
                 for consumed_cu in consumed_cu_list:
                     QueryCounter.count_read_ccu(consumed_cu)
 
+            for k in req_items.keys():
+                stats[k].requests += 1
+
             # 値の回収
             for k, i in res['Responses'].items():
-                if k in res:
+                if k in ret:
                     ret[k].extend(i)
                 else:
                     ret[k] = i
+                stats[k].returned += len(i)
 
-            # unprocessが存在した場合はもう一回
-            req_item = res['UnprocessedKeys']
-            if not req_item:
+            # unprocessが存在した場合は未処理のキーだけもう一回
+            req_items = res.get('UnprocessedKeys')
+            if not req_items:
                 break
-            else:
-                _logger.warning(f'exists UnprocessedKeys. retrying...{cnt}')
-        return ret
+
+            for k, v in req_items.items():
+                stats[k].unprocessed += len(v['Keys'])
+
+            if cnt + 1 >= max_retry:
+                break
+            _logger.warning(f'exists UnprocessedKeys. retrying...{cnt}')
+            await sleep(cls._retry_policy.on_unprocessed(cnt))
+
+        if req_items:
+            # リトライ上限に達してしまった
+            for k, v in req_items.items():
+                stats[k].abandoned += len(v['Keys'])
+            _logger.error(f'UnprocessedKeys remain after {max_retry} requests. '
+                          f'{ {k: len(v["Keys"]) for k, v in req_items.items()} }')
+
+        return ret, stats
 
     @classmethod
     async def batch_write_item(cls, request_items: dict, max_retry=100):
+        """
+        BatchWriteItemを発行する
+
+        :param request_items: テーブル名をキーとしたリクエスト
+        :param max_retry: UnprocessedItemsに対する最大リクエスト回数
+        :return: BatchWriteStat
+        """
+        return await cls.batch_write_item_with_stats(request_items, max_retry)
+
+    @classmethod
+    async def batch_write_item_with_stats(cls, request_items: dict, max_retry=100) -> 'BatchWriteStat':
+        """
+        | BatchWriteItemを発行し、書き込み状況を返却する
+        | UnprocessedItemsが返却された場合は未処理のものだけをバックオフしながら再リクエストする
+
+        :param request_items: テーブル名をキーとしたリクエスト
+        :param max_retry: UnprocessedItemsに対する最大リクエスト回数
+        :return: BatchWriteStat
+        """
+        stat = BatchWriteStat(requested=sum(len(v) for v in request_items.values()))
         req_items = request_items
         for cnt in range(max_retry):
-            _start = cls._take()
             p = {
                 'RequestItems': req_items
             }
@@ -665,8 +1233,10 @@ class HatsudenkiClient(object):
             if cls._use_profiler:
                 p['ReturnConsumedCapacity'] = 'INDEXES'
 
-            res = await cls._get_client().batch_write_item(**p)
-            cls._cheese(_start, 'batch_write_item', p)
+            res = await cls._request('batch_write_item', p)
+            stat.requests += 1
+            for t in req_items.keys():
+                cls._invalidate_flight(t)
 
             if cls._use_profiler:
                 QueryCounter.count('batch_write')
@@ -678,21 +1248,41 @@ class HatsudenkiClient(object):
             req_items = res['UnprocessedItems']
             if not req_items:
                 break
-            else:
-                _logger.warning(f'UnprocessedItems foud. next={cnt}')
-                await asyncio.sleep(0.1)
+
+            stat.unprocessed += sum(len(v) for v in req_items.values())
+            if cnt + 1 >= max_retry:
+                break
+            _logger.warning(f'UnprocessedItems foud. next={cnt}')
+            await sleep(cls._retry_policy.on_unprocessed(cnt))
+
+        if req_items:
+            # リトライ上限に達してしまった
+            stat.abandoned = sum(len(v) for v in req_items.values())
+            _logger.error(f'UnprocessedItems remain after {max_retry} requests. num={stat.abandoned}')
+
+        return stat
 
     @classmethod
-    async def transaction_write(cls, items: list):
-        _start = cls._take()
+    async def transaction_write(cls, items: list, token: str = None):
+        """
+        TransactWriteItemsを発行する
+
+        :param items: TransactItems
+        :param token: ClientRequestToken。同じトークンでの再リクエストは一度だけ適用される
+        :return: AWSレスポンス
+        """
         p = {
             'TransactItems': items
         }
+        if token is not None:
+            p['ClientRequestToken'] = token
 
         if cls._use_profiler:
             p['ReturnConsumedCapacity'] = 'INDEXES'
-        res = await cls._get_client().transact_write_items(**p)
-        cls._cheese(_start, 'transact_write', p)
+        res = await cls._request('transact_write_items', p)
+        for item in items:
+            for v in item.values():
+                cls._invalidate_flight(v['TableName'])
 
         if cls._use_profiler:
             QueryCounter.count('transact_write')
@@ -704,7 +1294,6 @@ class HatsudenkiClient(object):
     @classmethod
     async def transaction_get(cls, items: list) -> List[dict]:
 
-        _start = cls._take()
         p = {
             'TransactItems': items
         }
@@ -712,8 +1301,7 @@ class HatsudenkiClient(object):
         if cls._use_profiler:
             p['ReturnConsumedCapacity'] = 'INDEXES'
 
-        res = await cls._get_client().transact_get_items(**p)
-        cls._cheese(_start, 'transact_get', p)
+        res = await cls._request('transact_get_items', p)
         if cls._use_profiler:
             QueryCounter.count('transact_get')
             consumed_cu_list = res.get('ConsumedCapacity', False)
@@ -727,11 +1315,23 @@ class HatsudenkiClient(object):
 
     @classmethod
     async def die(cls):
-        t = [c.close() for c in cls._clients]
-        await asyncio.gather(*t)
+        await cls._pool.close()
 
     @classmethod
-    async def export_json(cls, table_name: str, out_stream: IO, tick=100, raw_table_name=False):
+    async def export_json(cls, table_name: str, out_stream: IO, tick=100, raw_table_name=False, segments: int = 1,
+                          prio: Priority = Priority.Background):
+        """
+        テーブルの内容をJSON Lines形式で書き出す
+
+        :param table_name: 対象テーブル名
+        :param out_stream: 出力先
+        :param tick: 1リクエストあたりの取得件数
+        :param raw_table_name: テーブル名にプリフィックスを付与しない
+        :param segments: 並列スキャンのセグメント数。2以上の場合アイテムの出力順は保証されない
+        :param prio: レートリミッター有効時の優先度
+        :return: None
+        """
+
         def json_serial(obj):
             if isinstance(obj, (datetime, date)):
                 return obj.isoformat()
@@ -740,14 +1340,15 @@ class HatsudenkiClient(object):
         desc = await cls.describe_table(table_name)
         out_stream.write(json.dumps(desc, ensure_ascii=False, default=json_serial) + '\n')
 
-        gen = cls.scan_generator(table_name=table_name, filter_cond=None, tick=tick, prj=None,
-                                 raw_table_name=raw_table_name)
-        async for l in gen:
-            for i in l:
-                out_stream.write(json.dumps(i, ensure_ascii=False) + '\n')
+        with priority(prio):
+            gen = cls.scan_generator(table_name=table_name, filter_cond=None, tick=tick, prj=None,
+                                     raw_table_name=raw_table_name, segments=segments)
+            async for l in gen:
+                for i in l:
+                    out_stream.write(json.dumps(i, ensure_ascii=False) + '\n')
 
     @classmethod
-    async def import_json(cls, table_name: str, in_stream: IO, recreate=False):
+    async def import_json(cls, table_name: str, in_stream: IO, recreate=False, prio: Priority = Priority.Background):
         desc = json.loads(in_stream.readline())
         if recreate:
             p = {
@@ -793,21 +1394,20 @@ class HatsudenkiClient(object):
 
             # 作り直す
             await cls.drop_table(table_name)
-            await cls._get_client().create_table(**p)
-
-        idx = 0
-        items = []
-        for line in in_stream:
-            d = json.loads(line)
-            items.append({'PutRequest': {'Item': d}})
-            idx += 1
-            if idx >= 25:
+            await cls._request('create_table', p)
+
+        with priority(prio):
+            items = []
+            for line in in_stream:
+                d = json.loads(line)
+                items.append({'PutRequest': {'Item': d}})
+                if len(items) >= 25:
+                    await cls.batch_write_item(
+                        request_items={cls.resolve_table_name(table_name): items}
+                    )
+                    items = []
+
+            if len(items) > 0:
                 await cls.batch_write_item(
                     request_items={cls.resolve_table_name(table_name): items}
                 )
-                items = []
-
-        if len(items) > 0:
-            await cls.batch_write_item(
-                request_items={cls.resolve_table_name(table_name): items}
-            )
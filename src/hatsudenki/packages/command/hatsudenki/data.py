@@ -102,6 +102,27 @@ class HatsudenkiData(object):
         """
         return self.is_root or self.is_single
 
+    @property
+    def is_slotted(self):
+        """
+        | __slots__で属性を保持するモデルを出力するか
+        | 子テーブルは親テーブルの設定に従う
+
+        :return: boolean
+        """
+        if self.is_alone:
+            return self.data.get('slots', False)
+        return self.parent_table.is_slotted
+
+    @property
+    def is_lazy(self):
+        """
+        非スカラー型フィールドを遅延デシリアライズするモデルを出力するか
+
+        :return: boolean
+        """
+        return self.data.get('lazy', False)
+
     @property
     def label(self):
         """
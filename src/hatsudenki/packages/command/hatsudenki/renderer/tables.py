@@ -91,6 +91,10 @@ class TableRenderUnit(RenderUnit[HatsudenkiData]):
                 meta.add(f'key_alias_name = "{rk.name}"')
                 # aliasキータイプ
                 meta.add(f'key_alias_type = {rk.def_python_field_class({})}')
+        if table.is_lazy:
+            # 非スカラー型フィールドの遅延デシリアライズ。専用のデシリアライザで行うので明示的に有効にする
+            meta.add('fast_deserialize = True')
+            meta.add('lazy_deserialize = True')
         # 空行
         meta.blank_line()
         return meta
@@ -193,6 +197,16 @@ class TableRenderUnit(RenderUnit[HatsudenkiData]):
             body.add('pass')
         return body
 
+    def render_slots(self):
+        """
+        __slots__の出力
+
+        :return: str
+        """
+        # aliasキーはプロパティなので対象外。親テーブルのフィールドは親クラスで定義済み
+        names = [k for k, attr in self.data.attributes.items() if not attr.is_alias_key]
+        return f'__slots__ = ({"".join(repr(n) + ", " for n in names)})'
+
     def render_init(self):
         """
         イニシャライザの出力
@@ -258,6 +272,9 @@ class TableRenderUnit(RenderUnit[HatsudenkiData]):
                 parent_cls_name = 'MultiHatsudenkiTable'
             else:
                 parent_cls_name = 'SoloHatsudenkiTable'
+            if table.is_slotted:
+                # 子テーブルは親テーブルから引き継ぐ
+                parent_cls_name = f'SlottedTableMixin, {parent_cls_name}'
         else:
             # solo or multi
             if table.range_key:
@@ -268,6 +285,10 @@ class TableRenderUnit(RenderUnit[HatsudenkiData]):
         # クラス定義
         cls = IndentString(f'class {table.class_name}({parent_cls_name}):')
 
+        if table.is_slotted:
+            cls.add(self.render_slots())
+            cls.blank_line()
+
         # Metaクラス
         cls.add(self.render_meta())
 
@@ -334,6 +355,7 @@ class TableFileRenderer(FileRenderer):
             'from hatsudenki.packages.table.solo import SoloHatsudenkiTable',
             'from hatsudenki.packages.table.child import ChildMultiHatsudenkiTable',
             'from hatsudenki.packages.table.child_solo import ChildSoloHatsudenkiTable',
+            'from hatsudenki.packages.table.slotted import SlottedTableMixin',
         ]
         d.add(*l)
         d.blank_line(2)
@@ -1,7 +1,9 @@
+from bisect import bisect_left
 from collections import defaultdict, Counter
+from contextvars import ContextVar, Token
 from dataclasses import dataclass, field
 from pprint import pprint
-from typing import Dict, DefaultDict, Counter as Counter_type
+from typing import Dict, DefaultDict, Counter as Counter_type, List, Tuple, Optional
 
 QUERY_COUNTER_LABEL_DEFINE = [
     'get',
@@ -11,9 +13,223 @@ QUERY_COUNTER_LABEL_DEFINE = [
     'batch_write',
     'batch_get',
     'transact_write',
-    'transact_get'
+    'transact_get',
+    'single_flight',
+    'optimistic'
 ]
 
+#: レイテンシヒストグラムのバケット境界（秒）
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+#: ペイロードサイズヒストグラムのバケット境界（バイト）
+PAYLOAD_BUCKETS = [64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+
+class Histogram(object):
+    """
+    | 固定バケットのヒストグラム
+    | バケット境界は生成時に決まり、記録はbisectで該当バケットを加算するだけなので軽い
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, bounds: List[float]):
+        """
+        イニシャライザ
+
+        :param bounds: バケット境界（昇順）。最後に+Infのバケットが追加される
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        """
+        値を記録する
+
+        :param value: 値
+        :return: None
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p: float):
+        """
+        | パーセンタイル値を取得する
+        | 該当バケットの上限値（最大値を超える場合は最大値）を返すので実際の値以上になる
+
+        :param p: 0〜100
+        :return: 値。記録が無い場合はNone
+        """
+        if self.count == 0:
+            return None
+        target = self.count * p / 100
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= target:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def merge(self, other: 'Histogram'):
+        """
+        他のヒストグラムを合算する
+
+        :param other: 同じバケット境界のヒストグラム
+        :return: None
+        """
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': {str(b): c for b, c in zip(self.bounds + ['+Inf'], self.counts)},
+        }
+
+
+def item_size(item: dict) -> int:
+    """
+    | AWSアイテム表現のおおよそのサイズ（バイト）を求める
+    | 属性名と値の長さを合計する。DynamoDBのアイテムサイズの計算方法に近いが厳密ではない
+
+    :param item: {'name': {'S': 'value'}}形式の辞書
+    :return: バイト数
+    """
+    return sum(len(k) + _value_size(v) for k, v in item.items())
+
+
+def _value_size(v: dict) -> int:
+    for t, x in v.items():
+        if t == 'S':
+            return len(x.encode('utf-8'))
+        if t == 'N':
+            return len(x) // 2 + 1
+        if t == 'B':
+            return len(x)
+        if t == 'M':
+            return 3 + item_size(x)
+        if t == 'L':
+            return 3 + sum(_value_size(i) for i in x)
+        if t == 'SS':
+            return sum(len(i.encode('utf-8')) for i in x)
+        if t == 'NS':
+            return sum(len(i) // 2 + 1 for i in x)
+        if t == 'BS':
+            return sum(len(i) for i in x)
+        return 1
+    return 0
+
+
+def payload_size(params: dict, res: dict) -> Optional[int]:
+    """
+    | リクエストもしくはレスポンスに含まれるアイテムのおおよそのサイズ（バイト）を求める
+    | 読み込みはレスポンスのアイテム、書き込みはリクエストのアイテムを対象とする
+
+    :param params: リクエストパラメータ
+    :param res: AWSレスポンス
+    :return: バイト数。アイテムを含まない場合はNone
+    """
+    if 'Item' in res:
+        return item_size(res['Item'])
+    if 'Items' in res:
+        return sum(item_size(i) for i in res['Items'])
+    r = res.get('Responses')
+    if isinstance(r, dict):
+        return sum(item_size(i) for l in r.values() for i in l)
+    if isinstance(r, list):
+        return sum(item_size(i['Item']) for i in r if 'Item' in i)
+    if 'Item' in params:
+        return item_size(params['Item'])
+    ri = params.get('RequestItems')
+    if ri and isinstance(next(iter(ri.values())), list):
+        return sum(item_size(w['PutRequest']['Item']) for l in ri.values() for w in l if 'PutRequest' in w)
+    return None
+
+
+def table_names(params: dict) -> List[str]:
+    """
+    リクエストの対象テーブル名を取得
+
+    :param params: リクエストパラメータ
+    :return: テーブル名のリスト（重複なし）
+    """
+    if 'TableName' in params:
+        return [params['TableName']]
+    if 'RequestItems' in params:
+        return list(params['RequestItems'].keys())
+    if 'TransactItems' in params:
+        return list(dict.fromkeys(v['TableName'] for i in params['TransactItems'] for v in i.values()))
+    return []
+
+
+def table_label(params: dict) -> str:
+    """
+    | 集計用のテーブル名を取得
+    | 複数テーブルにまたがる場合は+で連結する
+
+    :param params: リクエストパラメータ
+    :return: テーブル名
+    """
+    return '+'.join(sorted(table_names(params)))
+
+
+def item_count(operation: str, res: dict) -> Optional[int]:
+    """
+    レスポンスに含まれるアイテム数を取得
+
+    :param operation: オペレーション名
+    :param res: AWSレスポンス
+    :return: アイテム数。読み込み以外の場合はNone
+    """
+    if 'Items' in res:
+        return res.get('Count', len(res['Items']))
+    if 'Item' in res:
+        return 1
+    if operation == 'get_item':
+        return 0
+    r = res.get('Responses')
+    if isinstance(r, dict):
+        return sum(len(l) for l in r.values())
+    if isinstance(r, list):
+        return sum(1 for i in r if 'Item' in i)
+    return None
+
+
+def consumed_units(res: dict) -> Optional[float]:
+    """
+    レスポンスのConsumedCapacityの合計を取得
+
+    :param res: AWSレスポンス
+    :return: キャパシティユニット。ConsumedCapacityを含まない場合はNone
+    """
+    cc = res.get('ConsumedCapacity')
+    if not cc:
+        return None
+    return sum(c.get('CapacityUnits', 0) for c in (cc if isinstance(cc, list) else [cc]))
+
+
+#: (オペレーション名, テーブル名)
+MetricKey = Tuple[str, str]
+
 
 @dataclass
 class QueryCounterUnit:
@@ -25,6 +241,8 @@ class QueryCounterUnit:
     write_ccu_counter: Counter_type = field(default_factory=Counter)
     write_ccu_detail_dict: Dict = field(default_factory=dict)
     total_write_ccu: float = 0
+    latency: Dict[MetricKey, Histogram] = field(default_factory=dict)
+    payload: Dict[MetricKey, Histogram] = field(default_factory=dict)
 
     def count(self, label, key='unknown'):
         counter = self.counters.get(label, None)
@@ -60,6 +278,18 @@ class QueryCounterUnit:
         for key, dic in info['GlobalSecondaryIndexes'].items():
             self.write_ccu_detail_dict[info['TableName']][key] += dic['CapacityUnits']
 
+    def observe_latency(self, key: MetricKey, sec: float):
+        h = self.latency.get(key)
+        if h is None:
+            h = self.latency[key] = Histogram(LATENCY_BUCKETS)
+        h.observe(sec)
+
+    def observe_payload(self, key: MetricKey, size: int):
+        h = self.payload.get(key)
+        if h is None:
+            h = self.payload[key] = Histogram(PAYLOAD_BUCKETS)
+        h.observe(size)
+
     def init_counter(self):
         self.counters = dict()
         self.total_counter = Counter()
@@ -69,31 +299,169 @@ class QueryCounterUnit:
         self.write_ccu_counter = Counter()
         self.write_ccu_detail_dict = dict()
         self.total_write_ccu = 0
+        self.latency = dict()
+        self.payload = dict()
+
+    def to_dict(self):
+        """
+        集計結果を辞書に変換する
+
+        :return: dict
+        """
+        return {
+            'counters': {k: dict(v) for k, v in self.counters.items()},
+            'total_counter': dict(self.total_counter),
+            'read_ccu': dict(self.read_ccu_counter),
+            'total_read_ccu': self.total_read_ccu,
+            'read_ccu_detail': {k: dict(v) for k, v in self.read_ccu_detail_dict.items()},
+            'write_ccu': dict(self.write_ccu_counter),
+            'total_write_ccu': self.total_write_ccu,
+            'write_ccu_detail': {k: dict(v) for k, v in self.write_ccu_detail_dict.items()},
+            'latency': {f'{op} {t}': h.to_dict() for (op, t), h in self.latency.items()},
+            'payload': {f'{op} {t}': h.to_dict() for (op, t), h in self.payload.items()},
+        }
+
+    def to_prometheus(self, prefix='hatsudenki'):
+        """
+        Prometheusのテキスト形式に変換する
+
+        :param prefix: メトリクス名のプリフィックス
+        :return: str
+        """
+        lines = [f'# TYPE {prefix}_query_total counter']
+        for label, c in self.counters.items():
+            for key, v in c.items():
+                lines.append(f'{prefix}_query_total{{label="{_esc(label)}",key="{_esc(key)}"}} {v}')
+
+        lines.append(f'# TYPE {prefix}_consumed_capacity_total counter')
+        for kind, c in (('read', self.read_ccu_counter), ('write', self.write_ccu_counter)):
+            for t, v in c.items():
+                lines.append(f'{prefix}_consumed_capacity_total{{table="{_esc(t)}",kind="{kind}"}} {v}')
+
+        for name, hists in ((f'{prefix}_request_latency_seconds', self.latency),
+                            (f'{prefix}_payload_bytes', self.payload)):
+            lines.append(f'# TYPE {name} histogram')
+            for (op, t), h in hists.items():
+                labels = f'operation="{_esc(op)}",table="{_esc(t)}"'
+                acc = 0
+                for b, c in zip(h.bounds + ['+Inf'], h.counts):
+                    acc += c
+                    lines.append(f'{name}_bucket{{{labels},le="{b}"}} {acc}')
+                lines.append(f'{name}_sum{{{labels}}} {h.sum}')
+                lines.append(f'{name}_count{{{labels}}} {h.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _esc(s) -> str:
+    return str(s).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_current_unit: ContextVar[Optional[QueryCounterUnit]] = ContextVar('hatsudenki_query_counter', default=None)
+
+
+class CounterScope(object):
+    """
+    | QueryCounterの集計範囲
+    | with（async with）ブロック内の記録はブロック専用のQueryCounterUnitとプロセス全体の集計の両方に加算される
+    | コンテキスト変数で管理するので、ブロック内から生成したタスクの記録も含まれる
+    """
+
+    def __init__(self):
+        self.unit = QueryCounterUnit()
+        self._token: Optional[Token] = None
+
+    def __enter__(self) -> QueryCounterUnit:
+        self._token = _current_unit.set(self.unit)
+        return self.unit
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_unit.reset(self._token)
+        self._token = None
+
+    async def __aenter__(self) -> QueryCounterUnit:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
 
 
 class QueryCounter:
+    # プロセス全体の集計
     _counter: QueryCounterUnit = None
 
     @classmethod
-    def _get_context_data(cls):
+    def _get_total(cls):
         if cls._counter is None:
             cls._counter = QueryCounterUnit()
         return cls._counter
 
+    @classmethod
+    def _get_context_data(cls):
+        """
+        現在のスコープの集計を取得する。スコープ外の場合はプロセス全体の集計
+
+        :return: QueryCounterUnit
+        """
+        u = _current_unit.get()
+        if u is None:
+            return cls._get_total()
+        return u
+
+    @classmethod
+    def _targets(cls):
+        total = cls._get_total()
+        u = _current_unit.get()
+        if u is None:
+            return total,
+        return total, u
+
+    @classmethod
+    def scope(cls):
+        """
+        | リクエスト単位などで集計を分けるためのスコープを生成する
+
+        .. code-block:: python
+
+            with QueryCounter.scope() as unit:
+                await User.get('hoge')
+            print(unit.to_dict())
+
+        :return: CounterScope
+        """
+        return CounterScope()
+
     @classmethod
     def count(cls, label, key='unknown'):
-        query_counter = cls._get_context_data()
-        query_counter.count(label, key)
+        for query_counter in cls._targets():
+            query_counter.count(label, key)
 
     @classmethod
     def count_read_ccu(cls, info: Dict):
-        query_counter = cls._get_context_data()
-        query_counter.count_read_ccu(info)
+        for query_counter in cls._targets():
+            query_counter.count_read_ccu(info)
 
     @classmethod
     def count_write_ccu(cls, info: Dict):
-        query_counter = cls._get_context_data()
-        query_counter.count_write_ccu(info)
+        for query_counter in cls._targets():
+            query_counter.count_write_ccu(info)
+
+    @classmethod
+    def observe(cls, operation: str, table_name: str, sec: float, payload_size: int = None):
+        """
+        リクエストのレイテンシとペイロードサイズを記録する
+
+        :param operation: オペレーション名
+        :param table_name: テーブル名
+        :param sec: レイテンシ（秒）
+        :param payload_size: ペイロードサイズ（バイト）。Noneの場合は記録しない
+        :return: None
+        """
+        key = (operation, table_name)
+        for query_counter in cls._targets():
+            query_counter.observe_latency(key, sec)
+            if payload_size is not None:
+                query_counter.observe_payload(key, payload_size)
 
     @classmethod
     def init_counter(cls):
@@ -115,6 +483,10 @@ class QueryCounter:
         pprint(query_counter.read_ccu_detail_dict)
         print('-write detail-')
         pprint(query_counter.write_ccu_detail_dict)
+        print('-latency-')
+        for (op, t), h in sorted(query_counter.latency.items(), key=lambda x: -x[1].sum):
+            print(f'{op} {t}: count={h.count} sum={h.sum:.3f} p50={h.percentile(50)} p99={h.percentile(99)} '
+                  f'max={h.max:.3f}')
 
     @classmethod
     def get_consumed_cu(cls):
@@ -125,3 +497,33 @@ class QueryCounter:
     def get_cu_detail_counters(cls):
         query_counter = cls._get_context_data()
         return query_counter.read_ccu_detail_dict, query_counter.write_ccu_detail_dict
+
+    @classmethod
+    def get_unit(cls, total=False) -> QueryCounterUnit:
+        """
+        集計を取得する
+
+        :param total: Trueの場合はスコープ内であってもプロセス全体の集計を返す
+        :return: QueryCounterUnit
+        """
+        return cls._get_total() if total else cls._get_context_data()
+
+    @classmethod
+    def to_dict(cls, total=False):
+        """
+        集計結果を辞書で取得する
+
+        :param total: Trueの場合はスコープ内であってもプロセス全体の集計を返す
+        :return: dict
+        """
+        return (cls._get_total() if total else cls._get_context_data()).to_dict()
+
+    @classmethod
+    def to_prometheus(cls, prefix='hatsudenki'):
+        """
+        プロセス全体の集計をPrometheusのテキスト形式で取得する
+
+        :param prefix: メトリクス名のプリフィックス
+        :return: str
+        """
+        return cls._get_total().to_prometheus(prefix)
@@ -1,4 +1,28 @@
 from enum import Enum
+from functools import lru_cache
+from typing import List, Tuple, Type
+
+#: テンプレート生成時に値の代わりに登録するダミー
+TEMPLATE_SLOT = object()
+
+
+@lru_cache(maxsize=1024)
+def parse_path(key: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    | 属性パスを属性名と添字に分解する
+    | 'a.b[0]' -> (('a', ''), ('b', '[0]'))
+
+    :param key: 属性パス（map.keyやlist[0]形式も可）
+    :return: (属性名, 添字)のタプル
+    """
+    ret = []
+    for sp in key.split('.'):
+        bracket_pos = sp.find('[')
+        if bracket_pos >= 0:
+            ret.append((sp[:bracket_pos], sp[bracket_pos:]))
+        else:
+            ret.append((sp, ''))
+    return tuple(ret)
 
 
 class BaseExpression(object):
@@ -14,6 +38,8 @@ class BaseExpression(object):
         self.prefix = self.__class__.ValuePrefix
         self.names = {}
         self._rev_names = {}
+        # 属性パス -> 置き換え後の文字列
+        self._rev_paths = {}
         self.values = {}
         self._rev_vals = {}
         self.val_num = 0
@@ -87,44 +113,28 @@ class BaseExpression(object):
     def _register_key(self, key: str):
         """
         キー名を追加
+        同じ属性名（パスの途中も含む）には同じプレースホルダーを使い回す
         :param key: 追加するキー名
         :return: プレースホルダー文字列
         """
-        # TODO: DictMapの更新を行った際に同じ内容のキーが複数生成されてしまう。すでにあるやつは使い回すべき
+        ret = self._rev_paths.get(key)
+        if ret is not None:
+            return ret
 
         # .で分割しないとmap型の更新に対応できない
-        sps = key.split('.')
-
         r = []
-        for sp in sps:
-            # 他のExpressionとかぶらないようにPrefixを付与しておく（一応
-            k = f'#{self.prefix}_key__{self.key_num}'
-
-            # 配列判定
-            bracket_pos = sp.find('[')
-            if bracket_pos >= 0:
-                bracket_end = sp.index(']')
-                idx = sp[bracket_pos + 1:bracket_end]
-                sp = sp[0:bracket_pos]
-
-                old = self._rev_names.get(sp)
-                if old:
-                    k = old
-                else:
-                    self.names[k] = sp
-                    self._rev_names[sp] = k
-                    self.key_num += 1
-                r.append(f'{k}[{idx}]')
-            else:
-                old = self._rev_names.get(sp)
-                if old:
-                    k = old
-                else:
-                    self.names[k] = sp
-                    self._rev_names[sp] = k
-                    self.key_num += 1
-                r.append(k)
-        return '.'.join(r)
+        for name, index in parse_path(key):
+            k = self._rev_names.get(name)
+            if k is None:
+                # 他のExpressionとかぶらないようにPrefixを付与しておく（一応
+                k = f'#{self.prefix}_key__{self.key_num}'
+                self.names[k] = name
+                self._rev_names[name] = k
+                self.key_num += 1
+            r.append(k + index)
+        ret = '.'.join(r)
+        self._rev_paths[key] = ret
+        return ret
 
     def _register_value(self, value: any, raw=False):
         """
@@ -133,31 +143,85 @@ class BaseExpression(object):
         :param raw: すでにシリアライズされている値を直接代入する場合はTrue
         :return: プレースホルダー文字列
         """
-        # 循環参照の回避
-        # rawフラグが設定されていない場合は内部でprimalシリアライザを使用する
-        from hatsudenki.packages.field import primal_serializer
-        sv = value if raw else primal_serializer(value)
+        if raw:
+            sv = value
+        else:
+            # 循環参照の回避
+            # rawフラグが設定されていない場合は内部でprimalシリアライザを使用する
+            from hatsudenki.packages.field import primal_serializer
+            sv = primal_serializer(value)
         if sv is None:
             # DynamoDBは値をNoneで保持できないのでスキップ
             # （Noneを返すとクライアント側がスキップするようになっている）
             return None
 
-        # TODO: 値の方のクエリ圧縮はそもそも必要なのか。tupleだとListで死ぬのでjsonで判定している（ダサい）
-        # hashed_val = ujson.dumps(sv)
-        # already = self._rev_vals.get(hashed_val)
-        # if already:
-        #     k = already
-        # else:
-        #     k = f':{self.prefix}_value__{self.val_num}'
-        #     self.values[k] = sv
-        #     self._rev_vals[hashed_val] = k
-        #     self.val_num += 1
+        rk = None
+        if type(sv) is dict and len(sv) == 1:
+            # スカラー値（{'S': 'xxx'}等）は同じ値のプレースホルダーを使い回す
+            rk = next(iter(sv.items()))
+            if type(rk[1]) not in (str, bool):
+                rk = None
+            else:
+                already = self._rev_vals.get(rk)
+                if already is not None:
+                    return already
 
         k = f':{self.prefix}_value__{self.val_num}'
         self.values[k] = sv
         self.val_num += 1
+        if rk is not None:
+            self._rev_vals[rk] = k
 
         return k
 
     def is_empty(self):
         return False
+
+
+class ExpressionTemplate(object):
+    """
+    | 組み立て済みの条件式
+    | 値をプレースホルダーのまま保持しておき、生成時は値を埋め込むだけにする
+    | 値の位置にTEMPLATE_SLOTを登録して組み立てた式から生成する
+
+    .. code-block:: python
+
+        c = ConditionExpression()
+        c.equal('_v', TEMPLATE_SLOT, raw=True)
+        t = ExpressionTemplate.capture(c)
+        cond = t.bind({'N': '1'})
+    """
+    __slots__ = ('expression_class', 'expression', 'names', 'value_names')
+
+    def __init__(self, expression_class: Type[BaseExpression], expression: str, names: dict, value_names: List[str]):
+        """
+        イニシャライザ
+
+        :param expression_class: 生成する式のクラス（from_templateを持つもの）
+        :param expression: 式
+        :param names: ExpressionAttributeNames
+        :param value_names: 値のプレースホルダー（bindに渡す値の順）
+        """
+        self.expression_class = expression_class
+        self.expression = expression
+        self.names = names
+        self.value_names = value_names
+
+    @classmethod
+    def capture(cls, exp: BaseExpression) -> 'ExpressionTemplate':
+        """
+        組み立てた式からテンプレートを生成する
+
+        :param exp: 式
+        :return: ExpressionTemplate
+        """
+        return cls(exp.__class__, exp.expression, dict(exp.names), list(exp.values.keys()))
+
+    def bind(self, *values: any) -> BaseExpression:
+        """
+        値を埋め込んだ式を生成する
+
+        :param values: シリアライズ済みの値（value_namesの順）
+        :return: 式インスタンス
+        """
+        return self.expression_class.from_template(self.expression, self.names, dict(zip(self.value_names, values)))
@@ -1,6 +1,6 @@
 import re
 from enum import Enum
-from typing import Match
+from typing import List, Match
 
 from hatsudenki.packages.expression.base import BaseExpression
 
@@ -30,8 +30,36 @@ class KeyConditionExpression(BaseExpression):
 
     def __init__(self):
         super().__init__()
-        self.operations = ''
-        self.val_num = 0
+        # 式の断片（結合はexpression参照時に一度だけ行う）
+        self._ops: List[str] = []
+
+    @property
+    def operations(self) -> str:
+        return ''.join(self._ops)
+
+    @operations.setter
+    def operations(self, value: str):
+        self._ops = [value] if value else []
+
+    @classmethod
+    def from_template(cls, operations: str, names: dict, values: dict):
+        """
+        | 組み立て済みの式とプレースホルダーからインスタンスを生成する
+        | namesは他の式とマージされる際に書き換えられるので複製して保持する
+
+        :param operations: 式
+        :param names: ExpressionAttributeNames
+        :param values: ExpressionAttributeValues
+        :return: インスタンス
+        """
+        ret = cls()
+        ret.operations = operations
+        ret.names = dict(names)
+        ret._rev_names = {v: k for k, v in names.items()}
+        ret.values = values
+        ret.key_num = len(names)
+        ret.val_num = len(values)
+        return ret
 
     def get_operation_by_word(self, word: str, *args, **kwargs):
         op = getattr(self, self.__class__.FilterWordMap.get(word, word), None)
@@ -55,11 +83,11 @@ class KeyConditionExpression(BaseExpression):
             self.equal(key, value)
 
     def is_empty(self):
-        return len(self.operations) is 0
+        return not self._ops
 
     def _make_func(self, op: str, key: str):
         k = self._register_key(key)
-        self.operations += f'{op}({k})'
+        self._ops.append(f'{op}({k})')
 
     def attribute_exists(self, key: str):
         self._make_func('attribute_exists', key)
@@ -70,8 +98,7 @@ class KeyConditionExpression(BaseExpression):
     def _make_comp(self, op: str, key: str, val: dict, raw=False):
         k = self._register_key(key)
         v = self._register_value(val, raw)
-        op = f'{k} {op} {v}'
-        self.operations += op
+        self._ops.append(f'{k} {op} {v}')
 
     def equal(self, key: str, val: any, raw=False):
         self._make_comp('=', key, val, raw)
@@ -92,32 +119,32 @@ class KeyConditionExpression(BaseExpression):
         k = self._register_key(key)
         l = self._register_value(lo, raw)
         h = self._register_value(hi, raw)
-        self.operations += f'{k} BETWEEN {l} AND {h}'
+        self._ops.append(f'{k} BETWEEN {l} AND {h}')
 
     def begins_with(self, key: str, val: str, raw=False):
         k = self._register_key(key)
         v = self._register_value(val, raw)
-        self.operations += f'begins_with({k} ,  {v})'
+        self._ops.append(f'begins_with({k} ,  {v})')
 
     def op_and(self):
         if self.is_empty():
             return self
-        self.operations = f'{self.operations} AND '
+        self._ops.append(' AND ')
         return self
 
     def op_or(self):
-        self.operations = f'{self.operations} OR '
+        self._ops.append(' OR ')
         return self
 
     def __enter__(self):
-        self.operations += '('
+        self._ops.append('(')
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.operations += ')'
+        self._ops.append(')')
 
     @property
     def expression(self):
-        return self.operations
+        return ''.join(self._ops)
 
     @classmethod
     def dump(cls, data: dict):
@@ -151,8 +178,7 @@ class ConditionExpression(KeyConditionExpression):
         for v in val:
             s.append(self._register_value(v))
         sa = ', '.join(s)
-        op = f'{k} IN ({sa})'
-        self.operations += op
+        self._ops.append(f'{k} IN ({sa})')
 
     def not_equal(self, key: str, val: dict, raw=False):
         self._make_comp('<>', key, val, raw)
@@ -0,0 +1,72 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+from hatsudenki.packages.expression.base import BaseExpression
+
+
+class ProjectionExpression(BaseExpression):
+    """
+    | 取得する属性を指定する式
+    | 属性名はすべてプレースホルダーに置き換えるので予約語（nameなど）もそのまま指定できる
+    """
+    ParameterLabel = 'ProjectionExpression'
+    ValuePrefix = 'prj'
+
+    def __init__(self, keys: Iterable[str] = ()):
+        """
+        イニシャライザ
+
+        :param keys: 属性名（map.keyやlist[0]形式も可）
+        """
+        super().__init__()
+        self._keys = []
+        for k in keys:
+            self.add(k)
+
+    def add(self, key: str):
+        """
+        取得する属性を追加
+
+        :param key: 属性名
+        :return: None
+        """
+        self._keys.append(self._register_key(key))
+
+    @property
+    def expression(self):
+        return ','.join(self._keys)
+
+    def is_empty(self):
+        return len(self._keys) == 0
+
+    @classmethod
+    def apply(cls, params: dict, prj: Optional[Iterable[str]]):
+        """
+        | リクエストパラメータにプロジェクションを設定する
+        | 設定済みのExpressionAttributeNamesは他の式の持ち物なので書き換えずに複製してマージする
+
+        :param params: リクエストパラメータ
+        :param prj: 属性名リスト。Noneの場合は何もしない
+        :return: None
+        """
+        if prj is None:
+            return
+        expression, names = cls._compile(tuple(prj))
+        if not expression:
+            return
+        label = cls.ParameterAttributeName.Names.value
+        params[cls.ParameterLabel] = expression
+        params[label] = {**params.get(label, {}), **names}
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _compile(cls, prj: Tuple[str, ...]) -> Tuple[str, Dict[str, str]]:
+        """
+        | プロジェクションの式とExpressionAttributeNamesを生成する
+        | 同じプロジェクションは使い回されるので組み立て結果をキャッシュする（namesは書き換えないこと）
+
+        :param prj: 属性名
+        :return: (式, ExpressionAttributeNames)
+        """
+        e = cls(prj)
+        return e.expression, e.names
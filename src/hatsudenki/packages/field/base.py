@@ -16,6 +16,13 @@ class BaseHatsudenkiField(Generic[T]):
     DefaultValue = None
     TypeName = ''
     IsScalar = True
+    #: | デシリアライズ処理をインライン展開する際のテンプレート（{v}にDynamoDBの値が入る）
+    #: | Noneの場合はdeserializeを呼び出す
+    DeserializeTemplate = None
+    #: | シリアライズ処理と空判定をインライン展開する際のテンプレート（{v}にPythonの値が入る）
+    #: | 両方が設定されている場合のみ展開し、それ以外はserialize・is_empty・build_update_expressionを呼び出す
+    SerializeTemplate = None
+    EmptyTemplate = None
 
     def __init__(self, *, name=None, default=None, ttl=False):
         """
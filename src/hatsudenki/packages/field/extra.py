@@ -15,6 +15,7 @@ class UUIDField(BaseHatsudenkiField[UUID]):
 
     TypeStr = 'S'
     TypeName = 'UUID'
+    DeserializeTemplate = "_UUID(hex={v}['S'])"
 
     def serialize(self, value, table=None):
         if type(value) is str:
@@ -47,6 +48,7 @@ class DateField(BaseHatsudenkiField[datetime]):
     TypeStr = 'N'
     PythonType = datetime
     TypeName = 'Date'
+    DeserializeTemplate = "_fromtimestamp(int({v}['N']))"
 
     def serialize(self, value, table=None):
         if type(value) is str:
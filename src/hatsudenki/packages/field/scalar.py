@@ -9,6 +9,9 @@ class StringField(BaseHatsudenkiField[str]):
     PythonType = str
     TypeStr = 'S'
     TypeName = 'String'
+    DeserializeTemplate = "{v}['S']"
+    SerializeTemplate = "{'S': {v}}"
+    EmptyTemplate = "{v} is None or len({v}) == 0"
 
     @classmethod
     def is_empty(cls, value):
@@ -33,6 +36,9 @@ class NumberField(BaseHatsudenkiField[int]):
     PythonType = int
     TypeStr = 'N'
     TypeName = 'Integer'
+    DeserializeTemplate = "int({v}['N'])"
+    SerializeTemplate = "{'N': format({v})}"
+    EmptyTemplate = "{v} is None"
 
     # @classmethod
     # def add_expression(cls, name: str, new_value, old_value, update: UpdateExpression):
@@ -60,6 +66,9 @@ class BinaryField(BaseHatsudenkiField[bytes]):
     PythonType = bytes
     TypeStr = 'B'
     TypeName = 'Binary'
+    DeserializeTemplate = "{v}['B']"
+    SerializeTemplate = "{'B': {v}}"
+    EmptyTemplate = "{v} is None or len({v}) == 0"
 
     @classmethod
     def is_empty(cls, value):
@@ -85,6 +94,9 @@ class BoolField(BaseHatsudenkiField[bool]):
     PythonType = bool
     TypeStr = 'BOOL'
     TypeName = 'Boolean'
+    DeserializeTemplate = "{v}['BOOL']"
+    SerializeTemplate = "{'BOOL': {v}}"
+    EmptyTemplate = "{v} is None"
 
     def deserialize(self, value, table=None):
         if value is None:
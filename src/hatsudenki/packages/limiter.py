@@ -0,0 +1,373 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import Enum
+from logging import getLogger
+from typing import Dict, Tuple, Optional, List
+
+_logger = getLogger(__name__)
+
+
+class Priority(Enum):
+    """
+    リクエストの優先度
+    """
+    # 通常のリクエスト
+    Normal = 0
+    # バッチ処理など。トークンに余裕がある時だけ発行する
+    Background = 1
+
+
+#: リクエスト前に確保するキャパシティの見積もり
+ESTIMATE_UNITS = 1
+
+
+class CapacityKind(Enum):
+    Read = 'read'
+    Write = 'write'
+
+
+#: オペレーションごとのキャパシティ種別
+OPERATION_CAPACITY_KIND: Dict[str, CapacityKind] = {
+    'get_item': CapacityKind.Read,
+    'query': CapacityKind.Read,
+    'scan': CapacityKind.Read,
+    'batch_get_item': CapacityKind.Read,
+    'transact_get_items': CapacityKind.Read,
+    'put_item': CapacityKind.Write,
+    'update_item': CapacityKind.Write,
+    'delete_item': CapacityKind.Write,
+    'batch_write_item': CapacityKind.Write,
+    'transact_write_items': CapacityKind.Write,
+}
+
+_current_priority: ContextVar[Priority] = ContextVar('hatsudenki_priority', default=Priority.Normal)
+
+
+@contextmanager
+def priority(p: Priority):
+    """
+    | ブロック内のリクエストの優先度を設定する
+    | コンテキスト変数で管理するので、ブロック内から生成したタスクにも引き継がれる
+
+    :param p: 優先度
+    """
+    token = _current_priority.set(p)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@dataclass
+class BucketStats:
+    """
+    トークンバケットの利用状況
+    """
+    # 待機したリクエスト数
+    waited: int = 0
+    # 待機した合計秒数
+    total_wait: float = 0
+    # 消費したキャパシティの合計
+    consumed: float = 0
+    # スロットリングされた回数
+    throttled: int = 0
+
+    def to_dict(self):
+        return {
+            'waited': self.waited,
+            'total_wait': self.total_wait,
+            'consumed': self.consumed,
+            'throttled': self.throttled,
+        }
+
+
+class TokenBucket(object):
+    """
+    | トークンバケット
+    | リクエスト前に見積もり分（1ユニット）を確保し、レスポンスのConsumedCapacityで実際の消費量に精算する
+    | 消費量は事後にしか分からないのでトークンは負になりうる。その場合は回復するまで後続のリクエストが待たされる
+    | adaptiveの場合はスロットリング時にレートを下げ（乗算減少）、成功が続くと少しずつ戻す（加算増加）
+    """
+
+    def __init__(self, rate: float, burst: float = None, adaptive: bool = False, min_rate: float = 1,
+                 increase: float = 1, decrease: float = 0.5, background_reserve: float = 0.5):
+        """
+        イニシャライザ
+
+        :param rate: 1秒あたりのキャパシティ
+        :param burst: バケットの容量。省略時はrateと同じ
+        :param adaptive: AIMDでレートを調整するか
+        :param min_rate: adaptive時のレートの下限
+        :param increase: adaptive時に1秒あたり加算するレート
+        :param decrease: adaptive時にスロットリングされた際にレートに掛ける係数
+        :param background_reserve: Background優先度のリクエストが発行できるトークン残量（容量に対する割合）
+        """
+        self.max_rate = rate
+        self.rate = rate
+        # 見積もり分を確保できないと永遠に待つことになるので最低でも1ユニット
+        self.burst = max(burst or rate, ESTIMATE_UNITS)
+        self.adaptive = adaptive
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.background_reserve = background_reserve
+        self.tokens = self.burst
+        self.stats = BucketStats()
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.adaptive and self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase * elapsed)
+        self.tokens = min(self.burst, self.tokens + self.rate * elapsed)
+
+    def wait_time(self, p: Priority = Priority.Normal) -> float:
+        """
+        リクエストを発行できるまでの秒数を取得
+
+        :param p: 優先度
+        :return: 秒数。すぐに発行できる場合は0
+        """
+        self._refill()
+        need = self.burst * self.background_reserve if p is Priority.Background else 0
+        # 最低1ユニット分は残っていること
+        lack = max(need, 1) - self.tokens
+        if lack <= 0:
+            return 0
+        return lack / self.rate
+
+    async def acquire(self, p: Priority = Priority.Normal):
+        """
+        トークンが貯まるまで待ち、見積もり分を確保する
+
+        :param p: 優先度
+        :return: None
+        """
+        w = self.wait_time(p)
+        if w > 0:
+            self.stats.waited += 1
+            begin = time.monotonic()
+            while w > 0:
+                await asyncio.sleep(w)
+                w = self.wait_time(p)
+            self.stats.total_wait += time.monotonic() - begin
+        self.tokens -= ESTIMATE_UNITS
+
+    def refund(self):
+        """
+        確保した見積もり分を戻す
+
+        :return: None
+        """
+        self.tokens = min(self.burst, self.tokens + ESTIMATE_UNITS)
+
+    def consume(self, units: float):
+        """
+        実際に消費したキャパシティを差し引く
+
+        :param units: 消費したキャパシティ
+        :return: None
+        """
+        self._refill()
+        self.tokens -= units
+        self.stats.consumed += units
+
+    def on_throttle(self):
+        """
+        スロットリングされた
+
+        :return: None
+        """
+        self.stats.throttled += 1
+        # 溜まっているトークンは当てにならないので捨てる
+        self.tokens = min(self.tokens, 0)
+        if self.adaptive:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def to_dict(self):
+        return {
+            'rate': self.rate,
+            'max_rate': self.max_rate,
+            'tokens': self.tokens,
+            **self.stats.to_dict(),
+        }
+
+
+#: (テーブル名, インデックス名, キャパシティ種別)
+BucketKey = Tuple[str, Optional[str], CapacityKind]
+
+
+class RateLimiter(object):
+    """
+    | テーブル・GSIごとのクライアント側レートリミッター
+    | describe_tableのProvisionedThroughputでバケットを生成し、HatsudenkiClientのリクエスト前に待機、
+    | レスポンスのConsumedCapacityで消費量を差し引く
+    | バケットが無いテーブル（オンデマンド等）は制限しない
+    | GSIとして登録されていないインデックス（LSI）への読み込みはテーブルのバケットで制限する
+    """
+
+    def __init__(self, adaptive: bool = True, burst_seconds: float = 1, utilization: float = 1,
+                 background_reserve: float = 0.5):
+        """
+        イニシャライザ
+
+        :param adaptive: スロットリングに応じてレートを調整するか
+        :param burst_seconds: 何秒分のキャパシティをバースト可能とするか
+        :param utilization: プロビジョニングされたキャパシティのうち使用する割合
+        :param background_reserve: Background優先度のリクエストが発行できるトークン残量（容量に対する割合）
+        """
+        self.adaptive = adaptive
+        self.burst_seconds = burst_seconds
+        self.utilization = utilization
+        self.background_reserve = background_reserve
+        self._buckets: Dict[BucketKey, TokenBucket] = {}
+        # テーブル名 -> GSI名リスト
+        self._indexes: Dict[str, List[str]] = {}
+
+    def set_limit(self, table_name: str, read: float = None, write: float = None, index_name: str = None):
+        """
+        バケットを設定する
+
+        :param table_name: テーブル名（プリフィックス付与済み）
+        :param read: 1秒あたりの読み込みキャパシティ。0もしくはNoneの場合は制限しない
+        :param write: 1秒あたりの書き込みキャパシティ。0もしくはNoneの場合は制限しない
+        :param index_name: GSI名
+        :return: None
+        """
+        for kind, units in ((CapacityKind.Read, read), (CapacityKind.Write, write)):
+            k = (table_name, index_name, kind)
+            if not units:
+                self._buckets.pop(k, None)
+                continue
+            rate = units * self.utilization
+            self._buckets[k] = TokenBucket(rate, rate * self.burst_seconds, adaptive=self.adaptive,
+                                           background_reserve=self.background_reserve)
+        if index_name is not None:
+            idx = self._indexes.setdefault(table_name, [])
+            if index_name not in idx:
+                idx.append(index_name)
+
+    def seed(self, desc: dict):
+        """
+        describe_tableの結果からバケットを設定する
+
+        :param desc: describe_tableのレスポンス（Table以下）
+        :return: None
+        """
+        table_name = desc['TableName']
+        pt = desc.get('ProvisionedThroughput') or {}
+        self.set_limit(table_name, pt.get('ReadCapacityUnits'), pt.get('WriteCapacityUnits'))
+        for g in desc.get('GlobalSecondaryIndexes', []):
+            gpt = g.get('ProvisionedThroughput') or {}
+            self.set_limit(table_name, gpt.get('ReadCapacityUnits'), gpt.get('WriteCapacityUnits'),
+                           index_name=g['IndexName'])
+
+    @staticmethod
+    def _targets(operation: str, params: dict) -> List[Tuple[str, Optional[str]]]:
+        if 'TableName' in params:
+            return [(params['TableName'], params.get('IndexName'))]
+        if 'RequestItems' in params:
+            return [(t, None) for t in params['RequestItems'].keys()]
+        if 'TransactItems' in params:
+            return [(v['TableName'], None) for item in params['TransactItems'] for v in item.values()]
+        return []
+
+    def _wait_buckets(self, kind: CapacityKind, params: dict, operation: str):
+        for table_name, index_name in self._targets(operation, params):
+            if kind is CapacityKind.Read:
+                if index_name is not None and index_name not in self._indexes.get(table_name, ()):
+                    # LSIはテーブルのキャパシティを消費する
+                    index_name = None
+                b = self._buckets.get((table_name, index_name, kind))
+                if b is not None:
+                    yield b
+                continue
+            # 書き込みはGSIにも伝搬する
+            b = self._buckets.get((table_name, None, kind))
+            if b is not None:
+                yield b
+            for idx in self._indexes.get(table_name, []):
+                b = self._buckets.get((table_name, idx, kind))
+                if b is not None:
+                    yield b
+
+    async def acquire(self, operation: str, params: dict) -> List[TokenBucket]:
+        """
+        リクエスト前にトークンが貯まるまで待ち、見積もり分を確保する
+
+        :param operation: オペレーション名
+        :param params: リクエストパラメータ
+        :return: 確保したバケットのリスト。consumeもしくはrefundに渡すこと
+        """
+        kind = OPERATION_CAPACITY_KIND.get(operation)
+        if kind is None:
+            return []
+        p = _current_priority.get()
+        buckets = list(self._wait_buckets(kind, params, operation))
+        for b in buckets:
+            await b.acquire(p)
+        return buckets
+
+    @staticmethod
+    def refund(buckets: List[TokenBucket]):
+        """
+        リクエストが失敗した際に確保した見積もり分を戻す
+
+        :param buckets: acquireで確保したバケットのリスト
+        :return: None
+        """
+        for b in buckets:
+            b.refund()
+
+    def consume(self, operation: str, res: dict, buckets: List[TokenBucket]):
+        """
+        見積もり分を戻した上でレスポンスのConsumedCapacityを差し引く
+
+        :param operation: オペレーション名
+        :param res: AWSレスポンス
+        :param buckets: acquireで確保したバケットのリスト
+        :return: None
+        """
+        self.refund(buckets)
+        kind = OPERATION_CAPACITY_KIND.get(operation)
+        info = res.get('ConsumedCapacity')
+        if kind is None or not info:
+            return
+        for c in info if isinstance(info, list) else [info]:
+            table_name = c['TableName']
+            t = c.get('Table')
+            units = t['CapacityUnits'] if t is not None else c.get('CapacityUnits', 0)
+            b = self._buckets.get((table_name, None, kind))
+            if b is not None and units:
+                b.consume(units)
+            for index_name, g in c.get('GlobalSecondaryIndexes', {}).items():
+                b = self._buckets.get((table_name, index_name, kind))
+                if b is not None:
+                    b.consume(g['CapacityUnits'])
+
+    def on_throttle(self, operation: str, params: dict):
+        """
+        スロットリングされたバケットのレートを下げる
+
+        :param operation: オペレーション名
+        :param params: リクエストパラメータ
+        :return: None
+        """
+        kind = OPERATION_CAPACITY_KIND.get(operation)
+        if kind is None:
+            return
+        for b in list(self._wait_buckets(kind, params, operation)):
+            b.on_throttle()
+
+    def get_stats(self):
+        """
+        バケットごとの状況を取得
+
+        :return: dict
+        """
+        return {f'{t}{"/" + i if i else ""}:{k.value}': b.to_dict() for (t, i, k), b in self._buckets.items()}
@@ -0,0 +1,188 @@
+import asyncio
+import inspect
+from functools import wraps
+from logging import getLogger
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar, Union
+
+from hatsudenki.packages.client import HatsudenkiClient
+from hatsudenki.packages.counter import QueryCounter, QueryCounterUnit
+from hatsudenki.packages.retry import RetryPolicy
+from hatsudenki.packages.session import HatsudenkiSession
+
+_logger = getLogger(__name__)
+
+T = TypeVar('T')
+
+#: 競合時の最大リトライ回数（デフォルト）
+DEFAULT_CONFLICT_RETRY = 5
+#: QueryCounterのラベル
+CONFLICT_COUNTER_LABEL = 'optimistic'
+
+
+class ConflictRetryExhausted(Exception):
+    """
+    リトライ上限に達しても競合が解消しなかった
+    """
+
+    def __init__(self, model, attempts: int, cause: Exception):
+        super().__init__(f'{model.get_table_name()} update conflicted {attempts} times.')
+        self.model = model
+        self.attempts = attempts
+        self.cause = cause
+
+
+def _is_conflict(e: Exception) -> bool:
+    return RetryPolicy.get_error_code(e) == 'ConditionalCheckFailedException'
+
+
+async def _reload(model, prj_exp: Optional[List[str]]):
+    """
+    | DBから取得し直して内容を上書きする
+    | 競合した直後の読み込みで古い_vを掴まないよう強い整合性で読み込む
+    | プロジェクションを指定した場合は取得した属性だけを上書きする
+
+    :param model: モデルインスタンス
+    :param prj_exp: プロジェクション
+    :return: None
+    """
+    cls = model.__class__
+    key = model.serialized_key
+    s = HatsudenkiSession.current()
+    if s is not None:
+        # セッションに保持している自分自身が返却されないよう一旦破棄する
+        s.invalidate(cls.get_collection_name(), key)
+    c = await cls.get_raw(key, prj_exp, consistent_read=True)
+    if c is None:
+        raise Exception(f'{cls.get_table_name()} item not found. key={key}')
+    keys = model._attributes.keys() if prj_exp is None else [k for k in prj_exp if k in model._attributes]
+    for k in keys:
+        v = c[k]
+        if hasattr(v, '_parent'):
+            # 変更マークが取得し直したインスタンスではなくmodelに伝搬するよう親を付け替える
+            v._parent = model
+        model.force_set_key(k, v)
+    model.flush()
+    model._store_session()
+
+
+async def _apply(model, mutate: Callable):
+    r = mutate(model)
+    if inspect.isawaitable(r):
+        r = await r
+    return r
+
+
+async def retry_on_conflict(model: T, mutate: Callable[[T], Union[None, Awaitable]], max_retry=DEFAULT_CONFLICT_RETRY,
+                            prj_exp: List[str] = None, skip_hook=False, policy: RetryPolicy = None):
+    """
+    | _vによる楽観的排他制御付きで更新する
+    | mutateでモデルを変更してupdate()し、他の更新と競合した（_vが一致しない）場合は
+    | DBから取得し直してmutateを再実行する。リトライ間隔はリトライポリシーのバックオフに従う
+    | mutateは何度呼ばれても同じ結果になるよう、現在の値から変更内容を決めること
+    | 競合の発生状況はQueryCounterのoptimisticラベルにテーブルごとに記録される
+
+    .. code-block:: python
+
+        def add_coin(u: User):
+            u.coin += 100
+
+        await retry_on_conflict(user, add_coin, prj_exp=User.projection(User.fields.coin))
+
+    :param model: 取得済みのモデルインスタンス（未保存の変更が無いこと）
+    :param mutate: モデルを変更する関数もしくはコルーチン関数
+    :param max_retry: 競合時の最大リトライ回数
+    :param prj_exp: 取得し直す際のプロジェクション。mutateはこの属性以外を変更してはならない
+    :param skip_hook: フック処理をスキップするか
+    :param policy: バックオフに使用するリトライポリシー。省略時はクライアントのもの
+    :return: mutateの戻り値
+    """
+    if model.is_modified_record:
+        # 取得し直した際に失われてしまう
+        raise Exception('model has unsaved changes.')
+    if prj_exp is not None and any('.' in p or '[' in p for p in prj_exp):
+        # 部分的に取得した属性で上書きすると他の要素が失われる
+        raise Exception('retry_on_conflict projection must be top level attribute names.')
+    if prj_exp is not None:
+        # キーと_vを補完する
+        prj_exp = model.projection(*prj_exp)
+
+    table_name = model.get_table_name()
+    policy = policy or HatsudenkiClient.get_retry_policy()
+    attempt = 0
+    while True:
+        ret = await _apply(model, mutate)
+        if attempt > 0 and not model.is_modified_record:
+            # 再実行した変更が記録されていないと更新されないまま成功扱いになってしまう
+            raise Exception(f'{table_name} replayed mutation did not modify the model.')
+        if prj_exp is not None:
+            extra = [k for k in model._update_keys if k not in prj_exp]
+            if extra:
+                raise Exception(f'mutation changed attributes out of projection. {extra}')
+        QueryCounter.count(CONFLICT_COUNTER_LABEL, f'attempt {table_name}')
+        try:
+            await model.update(skip_hook=skip_hook)
+            return ret
+        except Exception as e:
+            if not _is_conflict(e):
+                raise
+            QueryCounter.count(CONFLICT_COUNTER_LABEL, f'conflict {table_name}')
+            if attempt >= max_retry:
+                QueryCounter.count(CONFLICT_COUNTER_LABEL, f'give_up {table_name}')
+                raise ConflictRetryExhausted(model, attempt + 1, e)
+        delay = policy.backoff(attempt)
+        _logger.info(f'{table_name} update conflicted. retry={attempt} delay={delay:.3f}')
+        await asyncio.sleep(delay)
+        await _reload(model, prj_exp)
+        attempt += 1
+
+
+def conflict_retry(max_retry=DEFAULT_CONFLICT_RETRY, prj_exp: List[str] = None, skip_hook=False):
+    """
+    | retry_on_conflictのデコレータ版
+    | 第一引数のモデルを変更する関数を、競合時に取得し直して再実行する更新処理に変換する
+
+    .. code-block:: python
+
+        @conflict_retry(prj_exp=['coin'])
+        def add_coin(u: User, amount: int):
+            u.coin += amount
+
+        await add_coin(user, 100)
+
+    :param max_retry: 競合時の最大リトライ回数
+    :param prj_exp: 取得し直す際のプロジェクション
+    :param skip_hook: フック処理をスキップするか
+    :return: デコレータ
+    """
+
+    def deco(func):
+        @wraps(func)
+        async def wrapper(model, *args, **kwargs):
+            return await retry_on_conflict(model, lambda m: func(m, *args, **kwargs), max_retry, prj_exp, skip_hook)
+
+        return wrapper
+
+    return deco
+
+
+def conflict_rates(unit: QueryCounterUnit = None) -> Dict[str, dict]:
+    """
+    テーブルごとの競合発生状況をQueryCounterから集計する
+
+    :param unit: 集計元。省略時は現在のスコープ（スコープ外の場合はプロセス全体）の集計
+    :return: テーブル名をキーとした{'attempts', 'conflicts', 'give_up', 'rate'}の辞書
+    """
+    u = unit or QueryCounter.get_unit()
+    ret: Dict[str, dict] = {}
+    for key, v in u.counters.get(CONFLICT_COUNTER_LABEL, {}).items():
+        kind, table_name = key.split(' ', 1)
+        d = ret.setdefault(table_name, {'attempts': 0, 'conflicts': 0, 'give_up': 0})
+        if kind == 'attempt':
+            d['attempts'] = v
+        elif kind == 'conflict':
+            d['conflicts'] = v
+        elif kind == 'give_up':
+            d['give_up'] = v
+    for d in ret.values():
+        d['rate'] = d['conflicts'] / d['attempts'] if d['attempts'] else 0
+    return ret
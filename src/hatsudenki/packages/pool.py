@@ -0,0 +1,205 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from aiobotocore.config import AioConfig
+
+
+@dataclass
+class PoolConfig:
+    """
+    コネクションプールの設定
+    """
+    # 生成するクライアント数。クライアントごとにHTTPコネクションプールと認証情報を持つ
+    client_num: int = 1
+    # 全クライアント合計のHTTPコネクション数の上限
+    max_connections: int = 10
+    # 同時に発行できるリクエスト数の上限。超えた分は待ち行列に入る。省略時はmax_connectionsと同じ
+    max_in_flight: Optional[int] = None
+    # アイドル状態のコネクションを保持する秒数
+    keepalive_timeout: float = 30
+    # 接続タイムアウト秒数
+    connect_timeout: float = 5
+    # 読み込みタイムアウト秒数
+    read_timeout: float = 10
+
+    def to_client_config(self):
+        """
+        クライアント1つあたりの設定を取得
+
+        :return: AioConfig
+        """
+        per_client = max(1, self.max_connections // max(1, self.client_num))
+        return AioConfig(
+            parameter_validation=False,
+            max_pool_connections=per_client,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            connector_args={'keepalive_timeout': self.keepalive_timeout},
+            # リトライはRetryPolicyで行うのでbotocore側のリトライは無効にする
+            retries={'max_attempts': 0},
+        )
+
+
+class PooledClient(object):
+    """
+    プールが管理するクライアント
+    """
+
+    def __init__(self, client):
+        self.client = client
+        # 処理中のリクエスト数
+        self.outstanding = 0
+        # 累計リクエスト数
+        self.requests = 0
+
+
+@dataclass
+class PoolStats:
+    """
+    プールの利用状況
+    """
+    # 処理中のリクエスト数
+    in_use: int = 0
+    # 空きを待っているリクエスト数
+    queued: int = 0
+    # 処理中リクエスト数の最大値
+    max_in_use: int = 0
+    # 待ち行列の最大長
+    max_queued: int = 0
+    # 累計リクエスト数
+    requests: int = 0
+    # 待ちが発生したリクエスト数
+    waited: int = 0
+    # 待ち時間の合計秒数
+    total_wait: float = 0
+    # 最大待ち時間秒数
+    max_wait: float = 0
+
+    @property
+    def avg_wait(self):
+        return self.total_wait / self.requests if self.requests else 0
+
+    def to_dict(self):
+        return {
+            'in_use': self.in_use,
+            'queued': self.queued,
+            'max_in_use': self.max_in_use,
+            'max_queued': self.max_queued,
+            'requests': self.requests,
+            'waited': self.waited,
+            'total_wait': self.total_wait,
+            'max_wait': self.max_wait,
+            'avg_wait': self.avg_wait,
+        }
+
+
+class ClientPool(object):
+    """
+    | クライアントプール
+    | 処理中のリクエストが最も少ないクライアントに振り分ける（least outstanding requests）
+    | 同時リクエスト数がmax_in_flightに達した場合は空きが出るまで待機する
+    """
+
+    def __init__(self, clients: list, max_in_flight: int):
+        """
+        イニシャライザ
+
+        :param clients: aiobotocoreのクライアントリスト
+        :param max_in_flight: 同時リクエスト数の上限
+        """
+        self._clients: List[PooledClient] = [PooledClient(c) for c in clients]
+        self.max_in_flight = max_in_flight
+        self.stats = PoolStats()
+        # イベントループが確定してから生成する
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def create(cls, session, config: PoolConfig, endpoint: str = None):
+        """
+        セッションからプールを生成する
+
+        :param session: aioboto3のSession
+        :param config: プール設定
+        :param endpoint: エンドポイント
+        :return: ClientPool
+        """
+        con = config.to_client_config()
+        clients = [session.client('dynamodb', endpoint_url=endpoint, config=con, use_ssl=False)
+                   for _ in range(config.client_num)]
+        return cls(clients, config.max_in_flight or config.max_connections)
+
+    @property
+    def clients(self):
+        return [c.client for c in self._clients]
+
+    def pick(self) -> PooledClient:
+        """
+        処理中のリクエストが最も少ないクライアントを選ぶ
+
+        :return: PooledClient
+        """
+        return min(self._clients, key=lambda c: c.outstanding)
+
+    async def acquire(self) -> PooledClient:
+        """
+        クライアントを借りる。使用後は必ずreleaseすること
+
+        :return: PooledClient
+        """
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_in_flight)
+
+        st = self.stats
+        if self._sem.locked():
+            # 空きがないので待つ
+            st.queued += 1
+            st.max_queued = max(st.max_queued, st.queued)
+            begin = time.perf_counter()
+            try:
+                await self._sem.acquire()
+            finally:
+                st.queued -= 1
+            w = time.perf_counter() - begin
+            st.waited += 1
+            st.total_wait += w
+            st.max_wait = max(st.max_wait, w)
+        else:
+            await self._sem.acquire()
+
+        c = self.pick()
+        c.outstanding += 1
+        c.requests += 1
+        st.requests += 1
+        st.in_use += 1
+        st.max_in_use = max(st.max_in_use, st.in_use)
+        return c
+
+    def release(self, c: PooledClient):
+        """
+        借りたクライアントを返す
+
+        :param c: acquireで取得したPooledClient
+        :return: None
+        """
+        c.outstanding -= 1
+        self.stats.in_use -= 1
+        self._sem.release()
+
+    def get_stats(self):
+        """
+        利用状況を取得
+
+        :return: dict
+        """
+        return {
+            **self.stats.to_dict(),
+            'clients': [{'outstanding': c.outstanding, 'requests': c.requests} for c in self._clients],
+        }
+
+    def reset_stats(self):
+        self.stats = PoolStats(in_use=self.stats.in_use, queued=self.stats.queued)
+
+    async def close(self):
+        await asyncio.gather(*[c.client.close() for c in self._clients])
@@ -0,0 +1,252 @@
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+from enum import Enum, auto
+from logging import getLogger
+from random import uniform
+from typing import Dict, Iterable, Optional, Counter as Counter_type
+
+from botocore.exceptions import ClientError, HTTPClientError
+
+_logger = getLogger(__name__)
+
+
+class RetryCategory(Enum):
+    """
+    エラーの分類
+    """
+    # スループット超過。バックオフしてリトライする
+    Throttle = auto()
+    # 一時的な障害。バックオフしてリトライする
+    Transient = auto()
+    # リトライしても結果が変わらないもの
+    Fatal = auto()
+
+
+#: エラーコードごとの分類。ここに無いものはFatalとして扱う
+DEFAULT_ERROR_CLASSIFICATION: Dict[str, RetryCategory] = {
+    'ProvisionedThroughputExceededException': RetryCategory.Throttle,
+    'ThrottlingException': RetryCategory.Throttle,
+    'RequestLimitExceeded': RetryCategory.Throttle,
+    'LimitExceededException': RetryCategory.Throttle,
+    'InternalServerError': RetryCategory.Transient,
+    'InternalFailure': RetryCategory.Transient,
+    'ServiceUnavailable': RetryCategory.Transient,
+    'TransactionInProgressException': RetryCategory.Transient,
+}
+
+#: 一時的な障害の際にリトライしても二重に書き込まれないオペレーション
+#: 書き込み系はパラメータ次第のためRetryPolicy.is_idempotentで個別に判定する
+DEFAULT_IDEMPOTENT_OPERATIONS = frozenset([
+    'get_item', 'query', 'scan', 'batch_get_item', 'transact_get_items', 'describe_table', 'list_tables',
+])
+
+
+@dataclass
+class RetryStats:
+    """
+    リトライ発生状況のカウンタ
+    """
+    # 呼び出し回数
+    calls: int = 0
+    # リトライ回数
+    retries: int = 0
+    # UnprocessedItems/UnprocessedKeysによる再リクエスト回数
+    unprocessed_retries: int = 0
+    # エラーコード別のリトライ回数
+    retry_by_code: Counter_type = field(default_factory=Counter)
+    # リトライを諦めて例外を送出した回数
+    give_up: int = 0
+    # バジェット枯渇によりリトライできなかった回数
+    budget_exhausted: int = 0
+    # 冪等でないためリトライしなかった回数
+    not_idempotent: int = 0
+    # バックオフで待機した合計秒数
+    total_sleep: float = 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'unprocessed_retries': self.unprocessed_retries,
+            'retry_by_code': dict(self.retry_by_code),
+            'give_up': self.give_up,
+            'budget_exhausted': self.budget_exhausted,
+            'not_idempotent': self.not_idempotent,
+            'total_sleep': self.total_sleep,
+        }
+
+
+class RetryPolicy(object):
+    """
+    | リトライポリシー
+    | 上限付き指数バックオフ（Full Jitter）でリトライ間隔を決定する
+    | リトライのたびにプロセス全体で共有するバジェットを消費し、成功すると少しずつ回復する
+    | バジェットが枯渇している間はリトライを行わない（リトライストームの抑止）
+    | 一時的な障害はリクエストが処理済みの可能性があるため、冪等なオペレーションのみリトライする
+    """
+
+    def __init__(self, base: float = 0.025, cap: float = 2.0, max_attempts: int = 10, budget: int = 500,
+                 throttle_cost: int = 5, transient_cost: int = 10, success_refill: int = 1,
+                 classification: Dict[str, RetryCategory] = None, idempotent_operations: Iterable[str] = None):
+        """
+        イニシャライザ
+
+        :param base: バックオフの基準秒数
+        :param cap: バックオフの上限秒数
+        :param max_attempts: 1回の呼び出しあたりの最大リトライ回数
+        :param budget: リトライバジェットの上限
+        :param throttle_cost: スロットリングによるリトライ1回で消費するバジェット
+        :param transient_cost: 一時的な障害によるリトライ1回で消費するバジェット
+        :param success_refill: 成功時に回復するバジェット
+        :param classification: エラーコードごとの分類。DEFAULT_ERROR_CLASSIFICATIONを上書きする
+        :param idempotent_operations: 一時的な障害でリトライするオペレーション。省略時はDEFAULT_IDEMPOTENT_OPERATIONS
+        """
+        self.base = base
+        self.cap = cap
+        self.max_attempts = max_attempts
+        self.max_budget = budget
+        self.budget = budget
+        self.throttle_cost = throttle_cost
+        self.transient_cost = transient_cost
+        self.success_refill = success_refill
+        self.classification = {**DEFAULT_ERROR_CLASSIFICATION, **(classification or {})}
+        self.idempotent_operations = frozenset(
+            DEFAULT_IDEMPOTENT_OPERATIONS if idempotent_operations is None else idempotent_operations)
+        self.stats = RetryStats()
+
+    @staticmethod
+    def get_error_code(e: Exception) -> Optional[str]:
+        """
+        例外からエラーコードを取得
+
+        :param e: 例外
+        :return: エラーコード文字列。AWSのエラーでない場合はNone
+        """
+        if isinstance(e, ClientError):
+            return e.response.get('Error', {}).get('Code')
+        return None
+
+    def classify(self, e: Exception) -> RetryCategory:
+        """
+        例外を分類する
+
+        :param e: 例外
+        :return: RetryCategory
+        """
+        if isinstance(e, ClientError):
+            return self.classification.get(self.get_error_code(e), RetryCategory.Fatal)
+        if isinstance(e, (HTTPClientError, asyncio.TimeoutError)):
+            # 通信エラーは一時的な障害とみなす
+            return RetryCategory.Transient
+        return RetryCategory.Fatal
+
+    def is_idempotent(self, operation: str, params: dict) -> bool:
+        """
+        | 一時的な障害の際にリトライしてよいリクエストか判定する
+        | 読み込み系に加え、トークン付きのトランザクションと条件付きのputも二重に書き込まれないので対象とする
+        | ADDを含むupdate_item等は処理済みだった場合に二重に適用されてしまうので対象外
+
+        :param operation: オペレーション名
+        :param params: リクエストパラメータ
+        :return: bool
+        """
+        if operation in self.idempotent_operations:
+            return True
+        if operation == 'transact_write_items':
+            return 'ClientRequestToken' in params
+        if operation == 'put_item':
+            return 'ConditionExpression' in params
+        return False
+
+    def backoff(self, attempt: int) -> float:
+        """
+        バックオフ秒数を取得（Full Jitter）
+
+        :param attempt: 何回目のリトライか（0始まり）
+        :return: 待機秒数
+        """
+        return uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+    def _consume(self, cost: int):
+        if self.budget < cost:
+            return False
+        self.budget -= cost
+        return True
+
+    def on_call(self):
+        """
+        呼び出し開始を記録
+
+        :return: None
+        """
+        self.stats.calls += 1
+
+    def on_success(self):
+        """
+        成功時にバジェットを回復する
+
+        :return: None
+        """
+        if self.budget < self.max_budget:
+            self.budget = min(self.max_budget, self.budget + self.success_refill)
+
+    def on_error(self, e: Exception, attempt: int, idempotent: bool = True) -> Optional[float]:
+        """
+        | 例外発生時にリトライ可否を判定する
+        | リトライする場合はバックオフ秒数を、しない場合はNoneを返す
+        | スロットリングはリクエストが処理されていないので冪等でなくてもリトライする
+
+        :param e: 発生した例外
+        :param attempt: 何回目のリトライか（0始まり）
+        :param idempotent: 冪等なリクエストか
+        :return: 待機秒数もしくはNone
+        """
+        category = self.classify(e)
+        if category is RetryCategory.Fatal:
+            return None
+
+        if category is RetryCategory.Transient and not idempotent:
+            self.stats.not_idempotent += 1
+            return None
+
+        if attempt >= self.max_attempts:
+            self.stats.give_up += 1
+            return None
+
+        cost = self.throttle_cost if category is RetryCategory.Throttle else self.transient_cost
+        if not self._consume(cost):
+            self.stats.budget_exhausted += 1
+            self.stats.give_up += 1
+            return None
+
+        delay = self.backoff(attempt)
+        self.stats.retries += 1
+        self.stats.retry_by_code[self.get_error_code(e) or type(e).__name__] += 1
+        self.stats.total_sleep += delay
+        return delay
+
+    def on_unprocessed(self, attempt: int) -> float:
+        """
+        | UnprocessedItems/UnprocessedKeysが返却された際の待機秒数を取得する
+        | 取りこぼすわけにはいかないのでバジェットが枯渇していても諦めず、上限秒数で待機する
+
+        :param attempt: 何回目のリトライか（0始まり）
+        :return: 待機秒数
+        """
+        self.stats.unprocessed_retries += 1
+        if self._consume(self.throttle_cost):
+            delay = self.backoff(attempt)
+        else:
+            self.stats.budget_exhausted += 1
+            delay = self.cap
+        self.stats.total_sleep += delay
+        return delay
+
+    def reset_stats(self):
+        """
+        カウンタをクリア
+
+        :return: None
+        """
+        self.stats = RetryStats()
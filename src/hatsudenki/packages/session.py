@@ -0,0 +1,161 @@
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from typing import Dict, Tuple, Optional, Type
+
+from hatsudenki.packages.singleflight import make_flight_key
+
+_current_session: ContextVar[Optional['HatsudenkiSession']] = ContextVar('hatsudenki_session', default=None)
+
+
+@dataclass
+class SessionStats:
+    """
+    セッションの利用状況
+    """
+    # セッションから返却した回数
+    hits: int = 0
+    # セッションに無くDBから取得した回数
+    misses: int = 0
+    # 登録・更新した回数
+    stores: int = 0
+    # 破棄した回数
+    invalidations: int = 0
+
+    def to_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'invalidations': self.invalidations,
+        }
+
+
+class HatsudenkiSession(object):
+    """
+    | リクエスト単位のアイデンティティマップ
+    | with（async with）ブロック内で取得したモデルインスタンスを (コレクション名, シリアライズされたキー) で保持し、
+    | 同じキーの読み込みはDBへ問い合わせずに同じインスタンスを返す
+    | put/updateで保存したインスタンスは登録し直され、deleteしたキーは破棄される
+    | プロジェクション付きの読み込みは対象外
+    | コンテキスト変数で管理するので、ブロック内から生成したタスクにも引き継がれる
+
+    .. code-block:: python
+
+        async with HatsudenkiSession():
+            a = await User.get('hoge')
+            b = await User.get('hoge')
+            assert a is b
+    """
+
+    def __init__(self):
+        self._identity: Dict[Tuple[str, Tuple], object] = {}
+        self._token: Optional[Token] = None
+        self.stats = SessionStats()
+
+    @staticmethod
+    def current() -> Optional['HatsudenkiSession']:
+        """
+        現在のコンテキストのセッションを取得
+
+        :return: HatsudenkiSession。セッション外の場合はNone
+        """
+        return _current_session.get()
+
+    @staticmethod
+    def make_key(collection_name: str, serialized_key: dict) -> Tuple[str, Tuple]:
+        """
+        アイデンティティマップのキーを生成する
+
+        :param collection_name: コレクション名
+        :param serialized_key: シリアライズされたキー情報
+        :return: tuple
+        """
+        return collection_name, make_flight_key(serialized_key)
+
+    def get(self, model_cls: Type, serialized_key: dict):
+        """
+        保持しているインスタンスを取得する
+
+        :param model_cls: モデルクラス
+        :param serialized_key: シリアライズされたキー情報
+        :return: モデルインスタンス。保持していない場合はNone
+        """
+        m = self._identity.get(self.make_key(model_cls.get_collection_name(), serialized_key))
+        if m is None or not isinstance(m, model_cls):
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return m
+
+    def merge(self, model):
+        """
+        | DBから取得したインスタンスを登録する
+        | 既に同じキーのインスタンスを保持している場合はそちらを返す（未保存の変更を失わないため）
+
+        :param model: モデルインスタンス
+        :return: セッションが保持しているモデルインスタンス
+        """
+        k = self.make_key(model.get_collection_name(), model.serialized_key)
+        m = self._identity.get(k)
+        if m is not None and isinstance(m, model.__class__):
+            return m
+        self._identity[k] = model
+        self.stats.stores += 1
+        return model
+
+    def store(self, model):
+        """
+        インスタンスを登録する。同じキーのインスタンスを保持している場合は置き換える
+
+        :param model: モデルインスタンス
+        :return: None
+        """
+        self._identity[self.make_key(model.get_collection_name(), model.serialized_key)] = model
+        self.stats.stores += 1
+
+    def invalidate(self, collection_name: str, serialized_key: dict = None):
+        """
+        保持しているインスタンスを破棄する
+
+        :param collection_name: コレクション名
+        :param serialized_key: シリアライズされたキー情報。省略した場合はコレクション全体を破棄する
+        :return: None
+        """
+        if serialized_key is not None:
+            if self._identity.pop(self.make_key(collection_name, serialized_key), None) is not None:
+                self.stats.invalidations += 1
+            return
+
+        for k in [k for k in self._identity.keys() if k[0] == collection_name]:
+            del self._identity[k]
+            self.stats.invalidations += 1
+
+    def invalidate_model(self, model):
+        """
+        指定したインスタンスのキーを破棄する
+
+        :param model: モデルインスタンス
+        :return: None
+        """
+        self.invalidate(model.get_collection_name(), model.serialized_key)
+
+    def clear(self):
+        self._identity = {}
+
+    def __len__(self):
+        return len(self._identity)
+
+    def __enter__(self):
+        self._token = _current_session.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_session.reset(self._token)
+        self._token = None
+        self.clear()
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from copy import deepcopy
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple, Callable, Awaitable
+
+from hatsudenki.packages.counter import QueryCounter
+
+
+def _normalize_value(v: dict) -> Tuple:
+    n = v.get('N')
+    if n is not None:
+        return 'N', Decimal(n)
+    return tuple(v.items())
+
+
+def make_flight_key(key: dict, prj: List[str] = None) -> Tuple:
+    """
+    | キー指定式辞書からハッシュ可能なキーを生成する
+    | 数値型は表記が異なっても同じ値であれば同じキーになるようDecimalに変換する（'1.50'と'1.5'等）
+
+    :param key: キー指定式辞書（{'name': {'S': 'value'}}形式）
+    :param prj: プロジェクション
+    :return: tuple
+    """
+    k = tuple(sorted((name, _normalize_value(v)) for name, v in key.items()))
+    return k, tuple(prj) if prj is not None else None
+
+
+@dataclass
+class SingleFlightStats:
+    """
+    リクエスト集約の発生状況
+    """
+    # 実際にリクエストを発行した回数
+    leaders: int = 0
+    # 処理中のリクエストに相乗りした回数
+    merges: int = 0
+    # ウィンドウ内の完了済み結果を再利用した回数
+    hits: int = 0
+
+    def to_dict(self):
+        return {
+            'leaders': self.leaders,
+            'merges': self.merges,
+            'hits': self.hits,
+        }
+
+
+class _Flight(object):
+    __slots__ = ('task', 'expire')
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        # 完了時刻+ウィンドウ。処理中はNone
+        self.expire: Optional[float] = None
+
+
+class SingleFlight(object):
+    """
+    | 同一キーに対する同時読み込みを1リクエストに集約する
+    | 処理中のリクエストがあればその結果を共有し、windowが指定されていれば完了後もwindow秒間結果を再利用する
+    | 失敗した結果は共有はするが再利用はしない
+    """
+
+    def __init__(self, window: float = 0):
+        """
+        イニシャライザ
+
+        :param window: 完了後に結果を再利用する秒数。0の場合は処理中のリクエストのみ共有する
+        """
+        self.window = window
+        self.stats = SingleFlightStats()
+        self._flights: Dict[str, Dict[Tuple, _Flight]] = {}
+
+    async def do(self, table_name: str, key: Tuple, func: Callable[[], Awaitable]):
+        """
+        集約して実行する
+
+        :param table_name: テーブル名
+        :param key: make_flight_keyで生成したキー
+        :param func: 実際にリクエストを発行するコルーチン関数
+        :return: funcの結果。相乗りした場合は複製を返す
+        """
+        flights = self._flights.get(table_name)
+        if flights is None:
+            flights = self._flights[table_name] = {}
+
+        f = flights.get(key)
+        if f is not None:
+            if f.expire is None:
+                self.stats.merges += 1
+                QueryCounter.count('single_flight', f'merge {table_name}')
+                return deepcopy(await asyncio.shield(f.task))
+            if f.expire > time.monotonic():
+                self.stats.hits += 1
+                QueryCounter.count('single_flight', f'hit {table_name}')
+                return deepcopy(f.task.result())
+            del flights[key]
+
+        self.stats.leaders += 1
+        f = _Flight(asyncio.ensure_future(func()))
+        flights[key] = f
+        f.task.add_done_callback(lambda t: self._on_done(table_name, key, f))
+        # 呼び出し元がキャンセルされても相乗りしている側には影響させない
+        r = await asyncio.shield(f.task)
+        # ウィンドウ内で再利用される結果を呼び出し元に書き換えられないよう複製する
+        return deepcopy(r) if self.window > 0 else r
+
+    def _on_done(self, table_name: str, key: Tuple, f: _Flight):
+        # 待っている呼び出し元がいなくても例外は回収しておく
+        ok = not f.task.cancelled() and f.task.exception() is None
+        flights = self._flights.get(table_name)
+        if flights is None or flights.get(key) is not f:
+            return
+        if ok and self.window > 0:
+            f.expire = time.monotonic() + self.window
+        else:
+            del flights[key]
+
+    def invalidate(self, table_name: str):
+        """
+        | 指定テーブルの集約対象を破棄する
+        | 書き込み後に古い結果を返さないために呼び出す。処理中のリクエストはそのまま完了させるが、以降の読み込みは相乗りしない
+
+        :param table_name: テーブル名
+        :return: None
+        """
+        self._flights.pop(table_name, None)
+
+    def clear(self):
+        self._flights = {}
+
+    def reset_stats(self):
+        self.stats = SingleFlightStats()
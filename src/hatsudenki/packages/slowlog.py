@@ -0,0 +1,240 @@
+import json
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from logging import getLogger, Logger, WARNING
+from random import random
+from typing import Optional, Dict, List
+
+from hatsudenki.packages.counter import payload_size, table_label, item_count, consumed_units
+
+_logger = getLogger(__name__)
+
+#: 可読化の対象とする式のパラメータ名
+EXPRESSION_LABELS = ['KeyConditionExpression', 'FilterExpression', 'ConditionExpression', 'UpdateExpression',
+                     'ProjectionExpression']
+
+_NAME_PATTERN = re.compile(r'#\w+')
+_VALUE_PATTERN = re.compile(r':\w+')
+
+
+def _format_value(v) -> str:
+    if isinstance(v, dict) and len(v) == 1:
+        t, x = next(iter(v.items()))
+        if t in ('S', 'N'):
+            return repr(x) if t == 'S' else x
+        if t == 'B':
+            return f'<binary {len(x)}>'
+        if t == 'BOOL':
+            return str(x)
+        if t == 'NULL':
+            return 'NULL'
+    return json.dumps(v, ensure_ascii=False, default=str)
+
+
+def render_expressions(params: dict) -> Dict[str, str]:
+    """
+    | リクエストパラメータに含まれる式のプレースホルダーを実際の名前と値に置き換える
+    | KeyConditionExpression.dumpと同等の表記をすべての式に対して行う
+
+    :param params: リクエストパラメータ
+    :return: 式のパラメータ名をキーとした可読化済み文字列の辞書
+    """
+    names = params.get('ExpressionAttributeNames', {})
+    values = params.get('ExpressionAttributeValues', {})
+
+    def _name(m):
+        return names.get(m.group(), m.group())
+
+    def _value(m):
+        v = values.get(m.group())
+        return m.group() if v is None else _format_value(v)
+
+    ret = {}
+    for label in EXPRESSION_LABELS:
+        e = params.get(label)
+        if e:
+            ret[label] = _VALUE_PATTERN.sub(_value, _NAME_PATTERN.sub(_name, e))
+    return ret
+
+
+@dataclass
+class SlowLogRecord:
+    """
+    スロークエリの記録
+    """
+    # オペレーション名
+    operation: str
+    # テーブル名（複数テーブルにまたがる場合は+で連結）
+    table: str
+    # レイテンシ（秒）。リトライを含む
+    latency: float
+    # リトライ回数
+    retries: int = 0
+    # 使用したインデックス名
+    index: Optional[str] = None
+    # 可読化された式
+    expressions: Dict[str, str] = field(default_factory=dict)
+    # キー指定（get_item等）
+    key: Optional[str] = None
+    # 返却されたアイテム数
+    items: Optional[int] = None
+    # 評価されたアイテム数（query/scan）
+    scanned: Optional[int] = None
+    # アイテムのおおよそのバイト数
+    bytes: Optional[int] = None
+    # 消費したキャパシティ
+    consumed_capacity: Optional[float] = None
+    # 記録時刻（UNIX時間）
+    timestamp: float = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class SlowLogSink(object):
+    """
+    スロークエリの出力先
+    """
+
+    def emit(self, record: SlowLogRecord):
+        raise NotImplementedError()
+
+
+class LoggerSink(SlowLogSink):
+    """
+    | loggingに出力する
+    | メッセージはJSON、extraのslow_queryに辞書を付与するので構造化ロガーからも扱える
+    """
+
+    def __init__(self, logger: Logger = None, level: int = WARNING):
+        self.logger = logger or _logger
+        self.level = level
+
+    def emit(self, record: SlowLogRecord):
+        d = record.to_dict()
+        self.logger.log(self.level, '[SLOW] ' + json.dumps(d, ensure_ascii=False, default=str),
+                        extra={'slow_query': d})
+
+
+class MemorySink(SlowLogSink):
+    """
+    直近の記録をメモリに保持する
+    """
+
+    def __init__(self, maxlen: int = 1000):
+        self.records = deque(maxlen=maxlen)
+
+    def emit(self, record: SlowLogRecord):
+        self.records.append(record)
+
+    def to_list(self) -> List[dict]:
+        return [r.to_dict() for r in self.records]
+
+
+@dataclass
+class SlowLogStats:
+    """
+    スロークエリログの出力状況
+    """
+    # 閾値を超えたリクエスト数
+    slow: int = 0
+    # 出力した数
+    emitted: int = 0
+    # サンプリングもしくはレート制限で出力しなかった数
+    suppressed: int = 0
+
+    def to_dict(self):
+        return {
+            'slow': self.slow,
+            'emitted': self.emitted,
+            'suppressed': self.suppressed,
+        }
+
+
+class SlowLog(object):
+    """
+    | スロークエリログ
+    | 閾値を超えたリクエストだけを対象にサンプリングとレート制限を行い、通過したものだけ記録を組み立てて出力する
+    | 閾値未満のリクエストは時刻の比較だけで済むので本番環境で有効にしても負荷は小さい
+    """
+
+    def __init__(self, threshold: float, sink: SlowLogSink = None, sample_rate: float = 1.0,
+                 max_per_sec: float = 10):
+        """
+        イニシャライザ
+
+        :param threshold: 閾値（秒）
+        :param sink: 出力先。省略時はLoggerSink
+        :param sample_rate: 閾値を超えたリクエストのうち出力する割合（0〜1）
+        :param max_per_sec: 1秒あたりの最大出力数
+        """
+        self.threshold = threshold
+        self.sink = sink or LoggerSink()
+        self.sample_rate = sample_rate
+        self.max_per_sec = max_per_sec
+        self.stats = SlowLogStats()
+        self._tokens = max_per_sec
+        self._last = time.monotonic()
+
+    def _allow(self):
+        if self.sample_rate < 1 and random() >= self.sample_rate:
+            return False
+        now = time.monotonic()
+        self._tokens = min(self.max_per_sec, self._tokens + (now - self._last) * self.max_per_sec)
+        self._last = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def on_request(self, operation: str, params: dict, res: dict, latency: float, retries: int):
+        """
+        リクエスト完了時に呼び出す
+
+        :param operation: オペレーション名
+        :param params: リクエストパラメータ
+        :param res: AWSレスポンス
+        :param latency: レイテンシ（秒）
+        :param retries: リトライ回数
+        :return: None
+        """
+        if latency < self.threshold:
+            return
+        self.stats.slow += 1
+        if not self._allow():
+            self.stats.suppressed += 1
+            return
+
+        try:
+            self.sink.emit(self.build_record(operation, params, res, latency, retries))
+            self.stats.emitted += 1
+        except Exception as e:
+            # ログ出力の失敗でリクエストを失敗させない
+            _logger.error(f'slow log emit failed. {e}')
+
+    @staticmethod
+    def build_record(operation: str, params: dict, res: dict, latency: float, retries: int) -> SlowLogRecord:
+        """
+        記録を組み立てる
+
+        :param operation: オペレーション名
+        :param params: リクエストパラメータ
+        :param res: AWSレスポンス
+        :param latency: レイテンシ（秒）
+        :param retries: リトライ回数
+        :return: SlowLogRecord
+        """
+        r = SlowLogRecord(operation=operation, table=table_label(params), latency=latency, retries=retries,
+                          index=params.get('IndexName'), expressions=render_expressions(params),
+                          timestamp=time.time())
+
+        if 'Key' in params:
+            r.key = ', '.join(f'{k}={_format_value(v)}' for k, v in params['Key'].items())
+
+        r.items = item_count(operation, res)
+        r.scanned = res.get('ScannedCount')
+        r.bytes = payload_size(params, res)
+        r.consumed_capacity = consumed_units(res)
+        return r
@@ -4,11 +4,14 @@ from hatsudenki.define.config import TAG_SEPARATOR, CURSOR_SEPARATOR
 from hatsudenki.packages.field.base import BaseHatsudenkiField
 from hatsudenki.packages.table.define import TableType
 from hatsudenki.packages.table.multi import MultiHatsudenkiTable
+from hatsudenki.packages.table.queryplan import QueryPlan, split_query_keys
 
 T = TypeVar("T")
 
 
 class ChildMultiHatsudenkiTable(MultiHatsudenkiTable):
+    __slots__ = ()
+
     class Meta(MultiHatsudenkiTable.Meta):
         key_alias_name = ''
         key_alias_type: BaseHatsudenkiField = None
@@ -55,26 +58,20 @@ class ChildMultiHatsudenkiTable(MultiHatsudenkiTable):
         return r
 
     @classmethod
-    def query_parse(cls, query_dict: dict):
+    def _plan_query(cls, keys: Tuple[str, ...]) -> QueryPlan:
         # childテーブルはkindを自動設定する
 
         # 使用するインデックスを判定
         ak = cls.get_alias_key()
         rk = cls.get_range_key_name()
-        hash_key, range_key, op, use_index = cls._find_index_by_query_dict(query_dict)
+        hash_key, range_key, op = split_query_keys(keys)
         if range_key == ak:
             if op is None:
-                # エイリアスキーが明示的に指定されている
-                query_dict[rk] = cls.resolve_alias(query_dict[ak])
-                # エイリアスキーは実在しないので消す
-                del query_dict[ak]
+                # エイリアスキーが明示的に指定されている。エイリアスキーは実在しないのでレンジキーに変換する
+                return cls._make_query_plan(hash_key, rk, range_source=ak, range_resolver=cls.resolve_alias)
             elif op == 'beginsWith':
                 # エイリアスキーが指定され、且つオペレータが指定されている
-                k = ak + '__' + op
-                v = query_dict[k]
-                # エイリアスキーは実在しないので消す
-                query_dict[rk + '__' + op] = cls.resolve_alias(v)
-                del query_dict[ak + '__' + op]
+                return cls._make_query_plan(hash_key, rk, op, range_source=keys[1], range_resolver=cls.resolve_alias)
             else:
                 # ごめんね、まだできてないんだ
                 raise Exception(f'alias_key operation [{op}] is not supported yet.')
@@ -82,9 +79,9 @@ class ChildMultiHatsudenkiTable(MultiHatsudenkiTable):
         elif range_key is None and hash_key == cls.get_hash_key_name():
             # レンジキーが指定されていない且つ、ハッシュキーがプライマリーのもの（GSIでない）場合は
             # 暗黙的に本来のレンジキーをTAG_NAMEの前方一致検索とする
-            query_dict[cls.get_range_key_name() + '__beginsWith'] = f'{cls.get_tag_name()}{TAG_SEPARATOR}'
+            return cls._make_query_plan(hash_key, rk, 'beginsWith', range_fixed=f'{cls.get_tag_name()}{TAG_SEPARATOR}')
 
-        return super().query_parse(query_dict)
+        return super()._plan_query(keys)
 
     @property
     def many_cursor(self):
@@ -114,7 +111,3 @@ class ChildMultiHatsudenkiTable(MultiHatsudenkiTable):
 
     async def remove(self):
         await self.__class__.delete(self.hash_value, self.alias_value)
-
-    async def reget(self):
-        c = await self.__class__.get(self.hash_value, self.alias_value)
-        self.copy(c)
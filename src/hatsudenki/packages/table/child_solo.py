@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Tuple
 
 from hatsudenki.packages.table.child import ChildMultiHatsudenkiTable
 from hatsudenki.packages.table.define import TableType
+from hatsudenki.packages.table.queryplan import QueryPlan
 
 
 class ChildSoloHatsudenkiTable(ChildMultiHatsudenkiTable):
+    __slots__ = ()
 
     @classmethod
     def get_table_type(cls):
@@ -31,16 +33,14 @@ class ChildSoloHatsudenkiTable(ChildMultiHatsudenkiTable):
         raise Exception('invalid operation')
 
     @classmethod
-    def query_parse(cls, query_dict: dict):
-        hk = query_dict.get(cls.get_hash_key_name(), None)
-        if hk is not None:
+    def _plan_query(cls, keys: Tuple[str, ...]) -> QueryPlan:
+        hk = cls.get_hash_key_name()
+        if hk in keys:
             # Hashキーが明示的に指定されている場合はプライマリキーを使用していると仮定する
-            ak = query_dict.get(cls.get_alias_key(), None)
-            if ak is not None:
+            if cls.get_alias_key() in keys:
                 # SoloテーブルはAliasキーを明示的に指定できない
                 raise Exception('invalid key.')
-            else:
-                # SoloテーブルのAliasキーは固定で設定される
-                query_dict[cls.get_range_key_name()] = cls.get_tag_name()
+            # SoloテーブルのAliasキーは固定で設定される
+            return cls._make_query_plan(hk, cls.get_range_key_name(), range_fixed=cls.get_tag_name())
 
-        return super().query_parse(query_dict)
+        return super()._plan_query(keys)
@@ -0,0 +1,256 @@
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+from uuid import UUID
+
+from hatsudenki.packages.field.base import BaseHatsudenkiField
+
+#: 生成コードから参照できる名前（フィールドのテンプレートで使用する）
+_GLOBALS = {
+    '_new': object.__new__,
+    '_set': object.__setattr__,
+    '_UUID': UUID,
+    '_fromtimestamp': datetime.fromtimestamp,
+}
+
+
+def _defined_in(field_class: type, name: str) -> Optional[type]:
+    for c in field_class.__mro__:
+        if name in c.__dict__:
+            return c
+    return None
+
+
+#: テンプレートごとに、テンプレートと食い違ってはいけないメソッド
+_TEMPLATE_DEPENDS = {
+    'DeserializeTemplate': ('deserialize',),
+    'SerializeTemplate': ('serialize', 'is_empty', 'build_update_expression'),
+    'EmptyTemplate': ('serialize', 'is_empty', 'build_update_expression'),
+}
+
+
+def inline_template(field: BaseHatsudenkiField, name: str = 'DeserializeTemplate', v: str = 'v') -> Optional[str]:
+    """
+    | フィールドの処理をインライン展開するテンプレートを取得
+    | サブクラスでメソッドだけがオーバーライドされている場合はテンプレートと処理が食い違うので展開しない
+
+    :param field: フィールドインスタンス
+    :param name: テンプレートの属性名
+    :param v: テンプレートの{v}に埋め込む変数名
+    :return: 展開済みの式。展開できない場合はNone
+    """
+    t = getattr(field, name)
+    if t is None:
+        return None
+    fc = type(field)
+    owner = _defined_in(fc, name)
+    # テンプレートより下位のクラスでメソッドがオーバーライドされていないこと
+    if any(not issubclass(owner, _defined_in(fc, m)) for m in _TEMPLATE_DEPENDS[name]):
+        return None
+    return t.replace('{v}', v)
+
+
+def build_deserializer_source(model_cls) -> str:
+    """
+    モデルクラスのデシリアライザのソースコードを生成する
+
+    :param model_cls: モデルクラス
+    :return: ソースコード
+    """
+    slotted = model_cls._slotted
+    lazy = model_cls.is_lazy_deserialize()
+    if slotted:
+        # __dict__を持たないので__setattr__を経由せずにスロットに書き込む
+        lines = [
+            'def deserialize(cls, raw_dict, prj=None):',
+            '    ret = _new(cls)',
+            "    _set(ret, '_lazy_raw', lazy)" if lazy else "    _set(ret, '_lazy_raw', None)",
+            "    _set(ret, '_dirty', 0)",
+            "    _set(ret, '_is_new', True)",
+            '    g = raw_dict.get',
+        ]
+    else:
+        lines = [
+            'def deserialize(cls, raw_dict, prj=None):',
+            '    ret = _new(cls)',
+            '    d = ret.__dict__',
+            # ネストしたオブジェクトのデシリアライズ中に変更マークが親に伝搬するのでイニシャライザと同じ状態にしておく
+            "    d['_update_keys'] = {}",
+            "    d['_is_new'] = True",
+            '    g = raw_dict.get',
+        ]
+        if lazy:
+            lines.append("    d['_lazy_raw'] = lazy")
+    if lazy:
+        # 未展開のフィールドの生データはインスタンスごとに保持する
+        lines.insert(2, '    lazy = {}')
+    not_scalar = []
+    for i, (k, f) in enumerate(model_cls._attributes.items()):
+        key = repr(k)
+        lines.append(f'    v = g({key})')
+        t = inline_template(f)
+        expr = t if t is not None else f'_f{i}.deserialize(v, ret)'
+        if k == '_v':
+            # _vはイニシャライザで0が設定される
+            default = '0'
+        else:
+            default = f'_f{i}.get_data(None, ret)'
+        if lazy and not f.IsScalar:
+            # 値があれば生データのまま保持し、はじめてアクセスされたときにデシリアライズする
+            read = f'ret.{k}' if slotted else f'd[{key}]'
+            lines += [
+                '    if v is None:',
+                f'        _set(ret, {key}, {default})' if slotted else f'        d[{key}] = {default}',
+                f'        {read}.flush()',
+                '    else:',
+                f'        lazy[{key}] = v',
+            ]
+            continue
+        if slotted:
+            lines.append(f'    _set(ret, {key}, {default} if v is None else {expr})')
+        else:
+            lines.append(f'    d[{key}] = {default} if v is None else {expr}')
+        if not f.IsScalar:
+            not_scalar.append(k)
+
+    # flush相当の処理
+    for k in not_scalar:
+        lines.append(f'    ret.{k}.flush()' if slotted else f'    d[{k!r}].flush()')
+    if slotted:
+        lines += [
+            "    _set(ret, '_dirty', 0)",
+            "    _set(ret, '_is_new', False)",
+        ]
+    else:
+        lines += [
+            "    d['_update_keys'] = {}",
+            "    d['_is_new'] = False",
+        ]
+    lines += [
+        '    if prj is not None:',
+        '        ret._set_projection(prj)',
+        '    return ret',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def compile_deserializer(model_cls) -> Callable:
+    """
+    | モデルクラス専用のデシリアライザを生成する
+    | フィールドごとの処理を直線的なコードに展開し、イニシャライザや__setattr__を経由せずにインスタンスを組み立てる
+    | SlottedTableMixinを使用したモデルの場合は__dict__ではなくスロットに書き込む
+    | 遅延デシリアライズするモデルの場合、値のある非スカラー型フィールドは生データのまま保持する
+    | 生成した関数は (cls, raw_dict, prj) を受け取る
+
+    :param model_cls: モデルクラス
+    :return: 関数
+    """
+    src = build_deserializer_source(model_cls)
+    ns = dict(_GLOBALS)
+    for i, f in enumerate(model_cls._attributes.values()):
+        ns[f'_f{i}'] = f
+    exec(compile(src, f'<hatsudenki deserializer {model_cls.__name__}>', 'exec'), ns)
+    return ns['deserialize']
+
+
+def build_serializer_source(model_cls) -> str:
+    """
+    モデルクラスのシリアライザと更新式ビルダのソースコードを生成する
+
+    :param model_cls: モデルクラス
+    :return: ソースコード
+    """
+    slotted = model_cls._slotted
+    lazy = model_cls.is_lazy_deserialize()
+    ser = [
+        'def serialize(self):',
+        '    ret = {}',
+    ] if slotted else [
+        'def serialize(self):',
+        '    d = self.__dict__',
+        '    ret = {}',
+    ]
+    upd = []
+    builders = []
+    # 変更されたフィールドのビット判定（スロット版のみ）
+    dirty = []
+    for i, (k, f) in enumerate(model_cls._attributes.items()):
+        key = repr(k)
+        # 未展開のフィールドは__getattr__でデシリアライズさせる
+        read = f'self.{k}' if slotted or (lazy and not f.IsScalar) else f'd[{key}]'
+        s = inline_template(f, 'SerializeTemplate')
+        e = inline_template(f, 'EmptyTemplate')
+        if s is not None and e is not None:
+            ser += [
+                f'    v = {read}',
+                f'    if not ({e}):',
+                f'        ret[{key}] = {s}',
+            ]
+        else:
+            ser += [
+                f'    v = _f{i}.serialize({read})',
+                '    if v is not None:',
+                f'        ret[{key}] = v',
+            ]
+
+        if k == '_v':
+            # _vは更新時に別途加算する
+            continue
+        upd += [
+            f'def _u{i}(upd, v):',
+        ]
+        if s is not None and e is not None:
+            upd += [
+                f'    if {e}:',
+                f'        upd.remove({key})',
+                '    else:',
+                f'        upd.set({key}, {s}, raw=True)',
+            ]
+        else:
+            upd += [
+                f'    if _f{i}.is_empty(v):',
+                f'        upd.remove({key})',
+                '    else:',
+                f'        _f{i}.build_update_expression(upd, v)',
+            ]
+        builders.append(f'{key}: _u{i}')
+        dirty += [
+            f'    if m & {model_cls._field_bits[k]}:',
+            f'        _u{i}(upd, self.{k})',
+        ]
+    ser.append('    return ret')
+
+    if slotted:
+        return '\n'.join(ser + upd + [
+            'def build_update_expression(self, upd):',
+            '    m = self._dirty',
+        ] + dirty) + '\n'
+
+    lines = ser + upd + [
+        '_builders = {' + ', '.join(builders) + '}',
+        'def build_update_expression(self, upd):',
+        '    d = self.__dict__',
+        '    b = _builders',
+        '    for key in self._update_keys:',
+        '        f = b.get(key)',
+        '        if f is not None:',
+        '            f(upd, d[key])',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def compile_serializer(model_cls) -> Tuple[Callable, Callable]:
+    """
+    | モデルクラス専用のシリアライザと更新式ビルダを生成する
+    | フィールドごとの空判定とシリアライズを直線的なコードに展開する
+    | SlottedTableMixinを使用したモデルの更新式ビルダは変更ビットを順に判定する
+    | 生成した関数はどちらもメソッドとして (self, ...) を受け取る
+
+    :param model_cls: モデルクラス
+    :return: (serialize, build_update_expression)
+    """
+    src = build_serializer_source(model_cls)
+    ns = dict(_GLOBALS)
+    for i, f in enumerate(model_cls._attributes.values()):
+        ns[f'_f{i}'] = f
+    exec(compile(src, f'<hatsudenki serializer {model_cls.__name__}>', 'exec'), ns)
+    return ns['serialize'], ns['build_update_expression']
@@ -9,6 +9,7 @@ T = TypeVar('T')
 
 
 class MultiHatsudenkiTable(SoloHatsudenkiTable):
+    __slots__ = ()
 
     @classmethod
     def get_table_type(cls):
@@ -52,31 +53,26 @@ class MultiHatsudenkiTable(SoloHatsudenkiTable):
         c = self.__class__
         hk = c._hash_key_name
         rk = c._range_key_name
-        d = self.__dict__
 
         return {
-            hk: c._serializer[hk](d[hk]),
-            rk: c._serializer[rk](d[rk])
+            hk: c._serializer[hk](getattr(self, hk)),
+            rk: c._serializer[rk](getattr(self, rk))
         }
 
     @classmethod
-    def not_exist_condition(cls, cond: ConditionExpression = None):
-        p = super().not_exist_condition(cond)
+    def _build_not_exist_condition(cls, cond: ConditionExpression):
+        p = super()._build_not_exist_condition(cond)
         p.op_and()
         p.attribute_not_exists(cls.get_range_key_name())
         return p
 
     @classmethod
-    def exist_condition(cls, cond: ConditionExpression = None):
-        p = super().exist_condition(cond)
+    def _build_exist_condition(cls, cond: ConditionExpression):
+        p = super()._build_exist_condition(cond)
         p.op_and()
         p.attribute_exists(cls.get_range_key_name())
         return p
 
-    async def reget(self):
-        c = await self.__class__.get(self.hash_value, self.range_value)
-        self.copy(c)
-
     @classmethod
     def get_serialized_key(cls, hash_val: any, range_val: any = None):
         if range_val is None:
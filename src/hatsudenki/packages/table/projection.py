@@ -0,0 +1,195 @@
+from contextvars import ContextVar, Token
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Type
+
+_current_profiler: ContextVar[Optional['ProjectionProfiler']] = ContextVar('hatsudenki_projection_profiler',
+                                                                          default=None)
+
+
+class FieldRef(str):
+    """
+    | モデルのフィールドを指す名前
+    | 文字列として振る舞うので、フィールド名の代わりにそのままプロジェクション等へ渡せる
+    """
+
+    def __new__(cls, model_cls: Type, name: str):
+        ret = super().__new__(cls, name)
+        ret.model = model_cls
+        return ret
+
+
+class ModelFields(object):
+    """
+    | Model.fieldsの実体
+    | 定義されているフィールドだけを属性として持つので、存在しないフィールド名を指定すると即座に例外が発生する
+
+    .. code-block:: python
+
+        prj = User.projection(User.fields.name, User.fields.level)
+        users = await User.query_list({'user_id': uid}, prj_exp=prj)
+    """
+
+    def __init__(self, model_cls: Type):
+        object.__setattr__(self, '_model', model_cls)
+        for k in model_cls._attributes.keys():
+            object.__setattr__(self, k, FieldRef(model_cls, k))
+
+    def __getattr__(self, item):
+        raise AttributeError(f'{self._model.__name__} has no field {item}')
+
+    def __setattr__(self, key, value):
+        raise AttributeError('fields is read only')
+
+    def __iter__(self):
+        return (getattr(self, k) for k in self._model._attributes.keys())
+
+
+@lru_cache(maxsize=256)
+def projection_keys(prj: Tuple[str, ...]) -> FrozenSet[str]:
+    """
+    プロジェクションで取得されるトップレベルの属性名
+
+    :param prj: 属性名（map.keyやlist[0]形式も可）
+    :return: 属性名の集合（_vを含む）
+    """
+    return frozenset([p.split('.', 1)[0].split('[', 1)[0] for p in prj] + ['_v'])
+
+
+class ProjectionProfiler(object):
+    """
+    | ブロック内で読み込んだモデルインスタンスのうち、実際に参照された属性を記録する
+    | 記録した属性から読み取り専用の処理に必要なプロジェクションを提案できる
+    | 記録中はインスタンスのクラスを記録用のサブクラスに差し替えるので、開発時の調査用途に限ること
+    | 保存（serialize）で参照された属性も記録される
+
+    .. code-block:: python
+
+        with ProjectionProfiler() as p:
+            users = await User.query_list({'user_id': uid})
+            render(users)
+        prj = p.suggest(User)
+    """
+    # 記録中のプロファイラ数（記録していない場合の判定を軽くするため）
+    _active = 0
+
+    def __init__(self):
+        self.touched: Dict[Type, Set[str]] = {}
+        self.loaded: Dict[Type, int] = {}
+        # モデルクラス -> 記録用サブクラス
+        self._classes: Dict[Type, Type] = {}
+        self._token: Optional[Token] = None
+
+    @staticmethod
+    def current() -> Optional['ProjectionProfiler']:
+        """
+        現在のコンテキストのプロファイラを取得
+
+        :return: ProjectionProfiler。記録中でない場合はNone
+        """
+        if ProjectionProfiler._active == 0:
+            return None
+        return _current_profiler.get()
+
+    def __enter__(self):
+        self._token = _current_profiler.set(self)
+        ProjectionProfiler._active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        ProjectionProfiler._active -= 1
+        _current_profiler.reset(self._token)
+        self._token = None
+
+    def _profiled_class(self, model_cls: Type) -> Type:
+        p = self._classes.get(model_cls)
+        if p is not None:
+            return p
+        attrs = model_cls._attributes
+        touched = self.touched.setdefault(model_cls, set())
+
+        def __getattribute__(ins, name):
+            if name in attrs:
+                touched.add(name)
+            return model_cls.__getattribute__(ins, name)
+
+        def __getitem__(ins, item):
+            touched.add(item)
+            return model_cls.__getitem__(ins, item)
+
+        # テーブル名が同じなのでTableManagerには登録されない
+        p = type(model_cls.__name__, (model_cls,), {
+            '__slots__': (),
+            '__module__': model_cls.__module__,
+            '__qualname__': model_cls.__qualname__,
+            '__getattribute__': __getattribute__,
+            '__getitem__': __getitem__,
+            '_profiled_origin': model_cls,
+        })
+        self._classes[model_cls] = p
+        return p
+
+    def watch(self, model):
+        """
+        モデルインスタンスの属性参照を記録対象にする
+
+        :param model: モデルインスタンス
+        :return: 同じインスタンス
+        """
+        model_cls = model.__class__
+        if '_profiled_origin' in model_cls.__dict__:
+            # 記録済み
+            return model
+        # インスタンスに属性を追加せずに済むよう記録先はクラスに持たせる（スロット版のモデルのため）
+        model.__class__ = self._profiled_class(model_cls)
+        self.loaded[model_cls] = self.loaded.get(model_cls, 0) + 1
+        return model
+
+    def suggest(self, model_cls: Type) -> List[str]:
+        """
+        参照された属性からプロジェクションを提案する
+
+        :param model_cls: モデルクラス
+        :return: 属性名リスト（キーと_vを含む）
+        """
+        touched = self.touched.get(model_cls, set())
+        return model_cls.projection(*[k for k in model_cls._attributes.keys() if k in touched])
+
+    def report(self) -> Dict[str, dict]:
+        """
+        記録したすべてのモデルについて提案を出力する
+
+        :return: dict
+        """
+        ret = {}
+        for model_cls in self.touched.keys():
+            prj = self.suggest(model_cls)
+            ret[model_cls.get_table_name()] = {
+                'loaded': self.loaded.get(model_cls, 0),
+                'projection': prj,
+                'unused': [k for k in model_cls._attributes.keys() if k not in prj],
+            }
+        return ret
+
+
+def build_projection(model_cls: Type, fields: Iterable[str]) -> List[str]:
+    """
+    モデルのプロジェクションを生成する
+
+    :param model_cls: モデルクラス
+    :param fields: フィールド名もしくはModel.fieldsの要素
+    :return: 属性名リスト（キーと_vを含む）
+    """
+    ret = list(model_cls.get_primary_key_names())
+    for f in fields:
+        model = getattr(f, 'model', None)
+        if model is not None and not issubclass(model_cls, model):
+            raise Exception(f'{f} is a field of {model.__name__}, not {model_cls.__name__}')
+        name = str(f)
+        top = name.split('.', 1)[0].split('[', 1)[0]
+        if top not in model_cls._attributes:
+            raise Exception(f'{model_cls.__name__} has no field {top}')
+        if name not in ret:
+            ret.append(name)
+    if '_v' not in ret:
+        ret.append('_v')
+    return ret
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from hatsudenki.packages.expression.base import ExpressionTemplate, TEMPLATE_SLOT
+from hatsudenki.packages.expression.condition import KeyConditionExpression
+from hatsudenki.packages.field import primal_serializer
+from hatsudenki.packages.field.base import BaseHatsudenkiField
+from hatsudenki.packages.table.index import IndexBase
+
+#: クラスごとに保持するクエリプランの上限（クエリの形は有限なので通常は到達しない）
+MAX_QUERY_PLANS = 256
+
+
+def split_query_keys(keys: Tuple[str, ...]) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    クエリ辞書のキーをハッシュキー名、レンジキー名、オペレータに分解する
+
+    :param keys: クエリ辞書のキー
+    :return: (ハッシュキー名, レンジキー名, オペレータ)
+    """
+    hash_key = keys[0]
+    range_key = keys[1] if len(keys) > 1 else None
+    op = None
+    if range_key is not None:
+        sp = range_key.split('__')
+        if len(sp) == 2:
+            range_key, op = sp
+    return hash_key, range_key, op
+
+
+@dataclass
+class QueryPlan:
+    """
+    | クエリ辞書の形（キーの並び）ごとに解決済みのクエリ情報
+    | インデックスの判定と条件式の組み立てを済ませておき、実行時は値をシリアライズして埋め込むだけにする
+    """
+    # 使用するインデックス
+    index: IndexBase
+    # KeyConditionExpressionのテンプレート（値はハッシュキー、レンジキーの順）
+    template: ExpressionTemplate
+    # ハッシュキーの値を取り出すクエリ辞書のキー
+    hash_source: str
+    # レンジキーのフィールド（レンジキーを使用しない場合はNone）
+    range_field: Optional[BaseHatsudenkiField] = None
+    # レンジキーの値を取り出すクエリ辞書のキー（Noneの場合はrange_fixedを使用する）
+    range_source: Optional[str] = None
+    range_fixed: any = None
+    # レンジキーの値の変換（エイリアスキーの解決など）
+    range_resolver: Optional[Callable] = None
+    op: Optional[str] = None
+
+    @classmethod
+    def build(cls, index: IndexBase, hash_key: str, range_key: Optional[str] = None, op: Optional[str] = None,
+              range_field: Optional[BaseHatsudenkiField] = None, range_source: Optional[str] = None,
+              range_fixed: any = None, range_resolver: Optional[Callable] = None) -> 'QueryPlan':
+        """
+        クエリプランを組み立てる
+
+        :param index: 使用するインデックス
+        :param hash_key: ハッシュキー名
+        :param range_key: レンジキー名
+        :param op: レンジキーのオペレータ（gt, beginsWith, betweenなど）
+        :param range_field: レンジキーのフィールド
+        :param range_source: レンジキーの値を取り出すクエリ辞書のキー
+        :param range_fixed: レンジキーの固定値（range_sourceがNoneの場合）
+        :param range_resolver: レンジキーの値の変換
+        :return: QueryPlan
+        """
+        kc = KeyConditionExpression()
+        kc.equal(hash_key, TEMPLATE_SLOT, raw=True)
+        if range_key is not None:
+            kc.op_and()
+            if op is None:
+                kc.equal(range_key, TEMPLATE_SLOT, raw=True)
+            elif op == 'between':
+                kc.between(range_key, TEMPLATE_SLOT, TEMPLATE_SLOT, raw=True)
+            elif op in KeyConditionExpression.FilterWordMap:
+                kc.get_operation_by_word(op, range_key, TEMPLATE_SLOT, raw=True)
+            else:
+                raise Exception(f'invalid operation word. {op}')
+        return cls(index=index, template=ExpressionTemplate.capture(kc), hash_source=hash_key, range_field=range_field,
+                   range_source=range_source, range_fixed=range_fixed, range_resolver=range_resolver, op=op)
+
+    def bind(self, query_dict: dict) -> KeyConditionExpression:
+        """
+        クエリ辞書の値を埋め込んだ条件式を生成する
+
+        :param query_dict: クエリ辞書
+        :return: KeyConditionExpression
+        """
+        vals = [primal_serializer(query_dict[self.hash_source])]
+        f = self.range_field
+        if f is not None:
+            v = self.range_fixed if self.range_source is None else query_dict[self.range_source]
+            if self.range_resolver is not None:
+                v = self.range_resolver(v)
+            if self.op == 'between':
+                lo, hi = v
+                vals.append(f.serialize(lo))
+                vals.append(f.serialize(hi))
+            else:
+                vals.append(f.serialize(v))
+        return self.template.bind(*vals)
@@ -0,0 +1,85 @@
+from typing import Dict
+
+from hatsudenki.packages.unitofwork import UnitOfWork
+
+_set = object.__setattr__
+
+
+class SlottedTableMixin(object):
+    """
+    | __slots__で属性を保持するモデル用のミックスイン
+    | インスタンスが__dict__を持たず、変更情報も変更前の値の辞書ではなくフィールドごとのビットで保持するので、
+    | 大量のインスタンスをメモリに保持する場合のメモリ使用量と属性書き込みのコストを抑えられる
+    | 継承元の先頭に指定し、モデルクラスには全フィールド名（_v以外）を__slots__として定義すること
+    | インスタンスにフィールド以外の属性を追加することはできない
+
+    .. code-block:: python
+
+        class User(SlottedTableMixin, SoloHatsudenkiTable):
+            __slots__ = ('user_id', 'name')
+            ...
+    """
+    __slots__ = ('_v', '_dirty', '_is_new', '_lazy_raw')
+
+    _slotted = True
+    #: フィールド名 -> 変更ビット（SoloHatsudenkiTable.__init_subclass__で設定される）
+    _field_bits: Dict[str, int] = {}
+
+    def __init__(self, **kwargs):
+        # SoloHatsudenkiTableのイニシャライザは__dict__前提なので呼び出さない
+        _set(self, '_lazy_raw', None)
+        _set(self, '_dirty', 0)
+        _set(self, '_is_new', True)
+        self._v = 0
+
+    def __setstate__(self, state):
+        # copy/pickleからの復元。__setattr__を経由すると変更扱いになるのでスロットに直接書き込む
+        _, slots = state
+        for k, v in slots.items():
+            _set(self, k, v)
+
+    def __getitem__(self, item):
+        try:
+            return getattr(self, item)
+        except AttributeError:
+            raise KeyError(item)
+
+    def modify_mark(self, key):
+        b = self._field_bits.get(key)
+        if b is None:
+            return
+        d = self._dirty
+        if not d and not self._is_new:
+            # DBから取得したモデルがはじめて変更されたのでUnitOfWorkに登録する
+            UnitOfWork.track(self)
+        _set(self, '_dirty', d | b)
+
+    def flush(self):
+        """
+        更新キー情報をクリア
+
+        :return: None
+        """
+        lazy = self._lazy_raw
+        for k in self._not_scalar_key:
+            if lazy and k in lazy:
+                # 未展開のフィールドは変更されていない
+                continue
+            getattr(self, k).flush()
+        _set(self, '_dirty', 0)
+        _set(self, '_is_new', False)
+
+    @property
+    def _update_keys(self) -> Dict[str, None]:
+        """
+        | 変更されたフィールド名
+        | 互換性のため辞書で返すが、変更前の値は保持していないので値はすべてNone
+
+        :return: dict
+        """
+        d = self._dirty
+        return {k: None for k, b in self._field_bits.items() if d & b}
+
+    @property
+    def is_modified_record(self):
+        return self._dirty != 0
@@ -1,16 +1,22 @@
 from logging import getLogger, ERROR
 from typing import Type, TypeVar, List, Dict, Tuple, Generator, Callable, Optional, AsyncGenerator
 
-from hatsudenki.packages.client import HatsudenkiClient
+from hatsudenki.packages.client import HatsudenkiClient, QueryPage
+from hatsudenki.packages.expression.base import ExpressionTemplate, TEMPLATE_SLOT
 from hatsudenki.packages.expression.condition import ConditionExpression, KeyConditionExpression, \
     FilterConditionExpression
 from hatsudenki.packages.expression.update import UpdateExpression
-from hatsudenki.packages.field import NumberField
+from hatsudenki.packages.field import NumberField, primal_serializer
 from hatsudenki.packages.field.base import BaseHatsudenkiField
 from hatsudenki.packages.field.extra import CreateDateField, UpdateDateField
 from hatsudenki.packages.manager.date import DateManager
+from hatsudenki.packages.session import HatsudenkiSession
+from hatsudenki.packages.table.compiler import compile_deserializer, compile_serializer
 from hatsudenki.packages.table.define import TableType
-from hatsudenki.packages.table.index import PrimaryIndex
+from hatsudenki.packages.table.index import PrimaryIndex, SecondaryIndex
+from hatsudenki.packages.table.projection import ModelFields, ProjectionProfiler, projection_keys, build_projection
+from hatsudenki.packages.table.queryplan import QueryPlan, split_query_keys, MAX_QUERY_PLANS
+from hatsudenki.packages.unitofwork import UnitOfWork
 
 T = TypeVar('T')
 
@@ -18,6 +24,9 @@ _logger = getLogger(__name__)
 
 
 class SoloHatsudenkiTable(object):
+    # SlottedTableMixinを使用したモデルが__dict__を持たないようにする
+    __slots__ = ()
+
     # テーブルメタ情報定義
     class Meta:
         label = 'default'
@@ -26,6 +35,11 @@ class SoloHatsudenkiTable(object):
         collection_name = ''
         primary_index: PrimaryIndex = None
         table_name = ''
+        # 専用のデシリアライザを生成するか。イニシャライザを呼ばずに生成するので、イニシャライザでフィールドの初期化以外を行わないモデルのみTrueにすること
+        fast_deserialize = False
+        # List/Map/DictMapフィールドをはじめてアクセスされるまでデシリアライズしないか
+        # 専用のデシリアライザで実現しているため、Trueにするとfast_deserializeも有効になる
+        lazy_deserialize = False
 
     class Field:
         _v = NumberField()
@@ -45,6 +59,20 @@ class SoloHatsudenkiTable(object):
     _hash_key_name: Optional[str] = None
     _range_key_name: Optional[str] = None
     _collection_name: Optional[str] = None
+    _compiled_deserializer: Optional[Callable] = None
+    _compiled_serializer: Optional[Callable] = None
+    _compiled_update_builder: Optional[Callable] = None
+    # __slots__で属性を保持するか（SlottedTableMixinで上書きされる）
+    _slotted = False
+    _field_bits: Dict[str, int] = {}
+    # 遅延デシリアライズ中のフィールドの生データ（フィールド名 -> DynamoDB形式の値）
+    _lazy_raw: Optional[Dict[str, dict]] = None
+    # フィールド名の参照（Model.fields.xxx）
+    fields: ModelFields = None
+    # クエリ辞書のキーの並び -> 解決済みのクエリ
+    _query_plans: Dict[Tuple[str, ...], QueryPlan] = {}
+    # 存在確認などの組み立て済みの条件式
+    _condition_templates: Dict[str, ExpressionTemplate] = {}
 
     @classmethod
     def get_table_type(cls):
@@ -84,6 +112,8 @@ class SoloHatsudenkiTable(object):
         cls._hash_key_name = None
         cls._range_key_name = None
         cls._collection_name = None
+        cls._query_plans = {}
+        cls._condition_templates = {}
 
         cls._hook_update_key = []
         cls._hook_put_key = []
@@ -104,6 +134,9 @@ class SoloHatsudenkiTable(object):
             if not v.IsScalar:
                 cls._not_scalar_key.append(k)
 
+        cls._field_bits = {k: 1 << i for i, k in enumerate(cls._attributes.keys())}
+        cls.fields = ModelFields(cls)
+
         cls._hash_key_name = cls.Meta.primary_index.hash_key
         cls._range_key_name = cls.Meta.primary_index.range_key
         cls._collection_name = cls.Meta.collection_name
@@ -111,11 +144,64 @@ class SoloHatsudenkiTable(object):
         if hasattr(cls.Meta, 'alias_key_type'):
             cls.Meta.alias_key_type.name = cls.Mata.alias_key_name
 
+        if getattr(cls.Meta, 'fast_deserialize', False) or getattr(cls.Meta, 'lazy_deserialize', False):
+            cls._compiled_deserializer = compile_deserializer(cls)
+        else:
+            cls._compiled_deserializer = None
+        if cls.is_lazy_deserialize():
+            # 存在しない属性へのアクセスが遅くならないよう遅延デシリアライズするモデルにだけ設定する
+            cls.__getattr__ = SoloHatsudenkiTable._lazy_getattr
+        cls._compiled_serializer, cls._compiled_update_builder = compile_serializer(cls)
+
+    @classmethod
+    def is_lazy_deserialize(cls):
+        """
+        非スカラー型フィールドを遅延デシリアライズするか
+
+        :return: boolean
+        """
+        return bool(cls._not_scalar_key) and getattr(cls.Meta, 'lazy_deserialize', False)
+
+    def _lazy_getattr(self, key):
+        """
+        | 遅延デシリアライズするモデルの__getattr__
+        | 未展開のフィールドにはじめてアクセスされた時点で生データからデシリアライズする
+
+        :param key: 属性名
+        :return: フィールドの値
+        """
+        if key == '_lazy_raw':
+            # スロット未設定
+            raise AttributeError(key)
+        lazy = self._lazy_raw
+        if not lazy or key not in lazy:
+            raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{key}'")
+        raw = lazy.pop(key)
+        # 組み立て中の変更マークがモデルに伝搬しないよう親なしでデシリアライズしてから親を設定する
+        v = self.__class__._attributes[key].deserialize(raw, None)
+        v._parent = self
+        v.flush()
+        object.__setattr__(self, key, v)
+        return v
+
     def __getitem__(self, item):
         # self[xxx]で属性にアクセスできるようにしている
-        return self.__dict__[item]
+        try:
+            return self.__dict__[item]
+        except KeyError:
+            lazy = self._lazy_raw
+            if lazy and item in lazy:
+                # 未展開のフィールド
+                return getattr(self, item)
+            raise
 
     def __setattr__(self, key: str, value, force=False):
+        # copy等で__init__を経由せずに復元される場合はスロットが未設定の可能性がある
+        lazy = getattr(self, '_lazy_raw', None)
+        if lazy and key in lazy:
+            # 未展開のフィールドが上書きされるので生データは不要
+            del lazy[key]
+
         if force or key not in self.__class__._attributes:
             # 以下の場合は何もしない
             # 強制フラグがON
@@ -138,7 +224,11 @@ class SoloHatsudenkiTable(object):
 
     def modify_mark(self, key):
         prev = getattr(self, str(key), None)
-        self._update_keys.setdefault(key, prev)
+        u = self._update_keys
+        if not u and not self.__dict__.get('_is_new', True):
+            # DBから取得したモデルがはじめて変更されたのでUnitOfWorkに登録する
+            UnitOfWork.track(self)
+        u.setdefault(key, prev)
 
     @property
     def hash_key_name(self):
@@ -209,7 +299,28 @@ class SoloHatsudenkiTable(object):
     @classmethod
     def deserialize(cls: Type[T], raw_dict: dict, prj: List[str] = None) -> T:
         """
-        AWSレスポンスからインスタンスを生成する
+        | AWSレスポンスからインスタンスを生成する
+        | モデルクラス専用のデシリアライザが生成されている場合はそちらを使用する
+
+        :param raw_dict: awsアイテムレスポンス
+        :return: モデルインスタンス
+        """
+        f = cls._compiled_deserializer
+        if f is not None:
+            ret = f(cls, raw_dict, prj)
+        else:
+            ret = cls._deserialize_dynamic(raw_dict, prj)
+        if ProjectionProfiler._active:
+            p = ProjectionProfiler.current()
+            if p is not None:
+                p.watch(ret)
+        return ret
+
+    @classmethod
+    def _deserialize_dynamic(cls: Type[T], raw_dict: dict, prj: List[str] = None) -> T:
+        """
+        | AWSレスポンスからインスタンスを生成する（汎用版）
+        | イニシャライザで初期化した上でレスポンスに含まれるフィールドを上書きする
 
         :param raw_dict: awsアイテムレスポンス
         :return: モデルインスタンス
@@ -242,8 +353,12 @@ class SoloHatsudenkiTable(object):
         """
 
         d = self.__dict__
+        lazy = self._lazy_raw
 
         for k in self._not_scalar_key:
+            if lazy and k in lazy:
+                # 未展開のフィールドは変更されていない
+                continue
             d[k].flush()
 
         self._update_keys = {}
@@ -254,24 +369,49 @@ class SoloHatsudenkiTable(object):
         シリアライズされたアイテム情報を取得
         :return: シリアライズされたアイテム情報を格納した連想配列
         """
-        a = self.__dict__
+        f = self.__class__._compiled_serializer
+        if f is not None:
+            return f(self)
         ret = {}
         for k, v in self.__class__._serializer.items():
-            vv = v(a[k])
+            vv = v(self[k])
             if vv is not None:
                 ret[k] = vv
 
         return ret
 
+    @classmethod
+    def _condition_template(cls, name: str, build: Callable[[ConditionExpression], ConditionExpression],
+                            *values: any):
+        """
+        | 組み立て済みの条件式から新しいインスタンスを生成する
+        | 初回のみbuildで組み立ててクラスごとに保持する
+
+        :param name: 条件式の名前
+        :param build: 条件式を組み立てる関数（値の位置にはTEMPLATE_SLOTを登録する）
+        :param values: シリアライズ済みの値
+        :return: ConditionExpression
+        """
+        t = cls._condition_templates.get(name)
+        if t is None:
+            t = ExpressionTemplate.capture(build(ConditionExpression()))
+            cls._condition_templates[name] = t
+        return t.bind(*values)
+
     @classmethod
     def not_exist_condition(cls, cond: ConditionExpression = None):
         """
         存在を確認する条件式インスタンスを生成
 
+        :param cond: 追記する条件式。省略時は組み立て済みの式から生成する
         :return: 存在確認式が設定された条件式インスタンス
         """
         if cond is None:
-            cond = ConditionExpression()
+            return cls._condition_template('not_exist', cls._build_not_exist_condition)
+        return cls._build_not_exist_condition(cond)
+
+    @classmethod
+    def _build_not_exist_condition(cls, cond: ConditionExpression):
         cond.attribute_not_exists(cls.get_hash_key_name())
         return cond
 
@@ -280,13 +420,29 @@ class SoloHatsudenkiTable(object):
         """
         存在を確認する条件式インスタンスを生成
 
+        :param cond: 追記する条件式。省略時は組み立て済みの式から生成する
         :return: 存在確認式が設定された条件式インスタンス
         """
         if cond is None:
-            cond = ConditionExpression()
+            return cls._condition_template('exist', cls._build_exist_condition)
+        return cls._build_exist_condition(cond)
+
+    @classmethod
+    def _build_exist_condition(cls, cond: ConditionExpression):
         cond.attribute_exists(cls.get_hash_key_name())
         return cond
 
+    @classmethod
+    def _build_version_condition(cls, cond: ConditionExpression):
+        cls._build_exist_condition(cond)
+        cond.op_and()
+        with cond:
+            cond.equal('_v', TEMPLATE_SLOT, raw=True)
+            cond.op_or()
+            # アイテムが存在しない時用
+            cond.attribute_not_exists('_v')
+        return cond
+
     def _hook_put(self):
         for pk in self.__class__._hook_put_key:
             # self.force_set_key(pk.name, TableManager.resolve_date_now())
@@ -317,6 +473,7 @@ class SoloHatsudenkiTable(object):
         )
 
         self.flush()
+        self._store_session()
         return res
 
     def _hook_update(self):
@@ -325,6 +482,10 @@ class SoloHatsudenkiTable(object):
             setattr(self, pk.name, DateManager.get_now())
 
     def build_update_expression(self, upd: UpdateExpression):
+        f = self.__class__._compiled_update_builder
+        if f is not None:
+            f(self, upd)
+            return
         for update_key, prev_val in self._update_keys.items():
             if update_key == '_v':
                 # _vは後で強制的に入れるのでここでは無視
@@ -353,7 +514,7 @@ class SoloHatsudenkiTable(object):
         :param error_level: 失敗時のエラーレベル
         :return: awsレスポンス
         """
-        if len(self._update_keys) is 0:
+        if not self.is_modified_record:
             # 何も更新されていないのでスキップ
             _logger.debug('update key is nothing. skip update...')
             return
@@ -366,22 +527,14 @@ class SoloHatsudenkiTable(object):
 
         self.build_update_expression(upd)
 
-        cond = self.exist_condition() if not upsert else None
-
+        cond = None
         if increment:
             # バージョンカウンタの操作
             upd.add('_v', 1)
             if not upsert:
-                if cond is None:
-                    cond = ConditionExpression()
-                else:
-                    cond.op_and()
-
-                with cond:
-                    cond.equal('_v', self._v)
-                    cond.op_or()
-                    # アイテムが存在しない時用
-                    cond.attribute_not_exists('_v')
+                cond = self._condition_template('version', self._build_version_condition, primal_serializer(self._v))
+        elif not upsert:
+            cond = self.exist_condition()
 
         keys = self.serialized_key
 
@@ -390,13 +543,31 @@ class SoloHatsudenkiTable(object):
         self.flush()
 
         if increment:
-            self._v += 1
+            # 変更扱いにならないよう直接書き換える
+            self.force_set_key('_v', self._v + 1)
 
+        self._store_session()
         return res
 
+    def _store_session(self):
+        s = HatsudenkiSession.current()
+        if s is not None:
+            s.store(self)
+
     async def reget(self):
-        c = await self.__class__.get(self.hash_value)
+        """
+        DBから取得し直して内容を上書きする
+
+        :return: None
+        """
+        key = self.serialized_key
+        s = HatsudenkiSession.current()
+        if s is not None:
+            # セッションに保持している自分自身が返却されないよう一旦破棄する
+            s.invalidate(self.get_collection_name(), key)
+        c = await self.__class__.get_raw(key)
         self.copy(c)
+        self._store_session()
 
     def copy(self, model):
 
@@ -456,12 +627,31 @@ class SoloHatsudenkiTable(object):
         return await cls.get_raw(k, prj_exp)
 
     @classmethod
-    async def get_raw(cls, raw_dict: dict, prj_exp: List[str] = None):
-        r = await HatsudenkiClient.get_item(cls.get_collection_name(), raw_dict, prj_exp)
+    async def get_raw(cls, raw_dict: dict, prj_exp: List[str] = None, consistent_read=False):
+        """
+        | シリアライズされたキーを指定して一件取得
+        | セッション内でプロジェクションが指定されていない場合はセッションが保持しているインスタンスを優先する
+        | consistent_readを指定した場合はセッションを参照せず、強い整合性でDBから読み込む
+
+        :param raw_dict: シリアライズされたキー情報
+        :param prj_exp: プロジェクション情報
+        :param consistent_read: 強い整合性で読み込むか
+        :return: モデルインスタンス。アイテムが見つからない場合はNone
+        """
+        s = HatsudenkiSession.current() if prj_exp is None else None
+        if s is not None and not consistent_read:
+            m = s.get(cls, raw_dict)
+            if m is not None:
+                return m
+
+        r = await HatsudenkiClient.get_item(cls.get_collection_name(), raw_dict, prj_exp, consistent_read)
         if r is None:
             return None
 
-        return cls.deserialize(r, prj_exp)
+        m = cls.deserialize(r, prj_exp)
+        if s is not None:
+            return s.merge(m)
+        return m
 
     @classmethod
     async def get_iter(cls: Type[T], hash_val: any, limit=0, prj_exp: List[str] = None) -> Generator[T, None, None]:
@@ -480,6 +670,25 @@ class SoloHatsudenkiTable(object):
         """
         return map(cls.deserialize, raw_dict_list)
 
+    @classmethod
+    def _from_raw_dict_list_with_session(cls, raw_dict_list: List[dict], idx=None, prj: List[str] = None):
+        """
+        | AWSレスポンスからインスタンスを生成し、セッションに登録する
+        | 全属性を取得している場合のみ登録し、既に保持しているキーはそのインスタンスに置き換える
+
+        :param raw_dict_list: awsアイテムリストレスポンス
+        :param idx: 使用したインデックス
+        :param prj: プロジェクション情報
+        :return: モデルインスタンス
+        """
+        s = HatsudenkiSession.current()
+        if s is None or prj is not None:
+            return cls.from_raw_dict_list(raw_dict_list)
+        if isinstance(idx, SecondaryIndex) and len(idx.projection) > 0:
+            # 一部の属性しか射影されていないインデックス
+            return cls.from_raw_dict_list(raw_dict_list)
+        return map(s.merge, cls.from_raw_dict_list(raw_dict_list))
+
     @classmethod
     async def query_list(cls: Type[T],
                          query_dict: dict, limit=0, prj_exp: List[str] = None,
@@ -492,10 +701,64 @@ class SoloHatsudenkiTable(object):
 
         res = await HatsudenkiClient.query(table_name=cls.get_collection_name(), key_cond=kc,
                                            use_index_name=index_name, limit=limit, prj=prj_exp, filter_cond=fc)
-        return cls.from_raw_dict_list(res)
+        return cls._from_raw_dict_list_with_session(res, idx, prj_exp)
+
+    @classmethod
+    async def paginator(cls: Type[T], query_dict: dict, page_size=100, prj_exp: List[str] = None,
+                        filter_dict: dict = None, start_key: dict = None,
+                        max_pages: int = None) -> AsyncGenerator[QueryPage, None]:
+        """
+        | 検索結果をページ単位で返却するジェネレータ
+        | 返却されるQueryPageのitemsはデシリアライズ済みのモデルインスタンスのリスト
+        | last_keyをstart_keyに渡すことで続きから再開できる
+
+        :param query_dict: クエリ
+        :param page_size: 1ページあたりの最大評価件数
+        :param prj_exp: プロジェクション情報
+        :param filter_dict: フィルタ
+        :param start_key: 再開位置
+        :param max_pages: 最大ページ数
+        :return: QueryPageのジェネレータ
+        """
+        kc, idx = cls.query_parse(query_dict)
+        index_name = idx.name if idx is not None else None
+        fc = None
+        if filter_dict:
+            fc = cls.filter_parse(filter_dict)
+
+        gen = HatsudenkiClient.query_generator(table_name=cls.get_collection_name(), key_cond=kc,
+                                               filter_cond=fc, use_index_name=index_name, page_size=page_size,
+                                               prj=prj_exp, start_key=start_key, max_pages=max_pages)
+        async for page in gen:
+            yield QueryPage(items=list(cls._from_raw_dict_list_with_session(page.items, idx, prj_exp)),
+                            last_key=page.last_key)
+
+    @classmethod
+    async def query_stream(cls: Type[T], query_dict: dict, limit=0, page_size=100, prj_exp: List[str] = None,
+                           filter_dict: dict = None) -> AsyncGenerator[T, None]:
+        """
+        | 検索結果をモデルインスタンス単位で返却するジェネレータ
+        | limit件返却した時点、もしくは呼び出し側がループを抜けた時点で以降のページは取得しない
+
+        :param query_dict: クエリ
+        :param limit: 最大件数（0の場合は無制限）
+        :param page_size: 1ページあたりの最大評価件数
+        :param prj_exp: プロジェクション情報
+        :param filter_dict: フィルタ
+        :return: モデルインスタンスのジェネレータ
+        """
+        if 0 < limit < page_size:
+            page_size = limit
 
-    # @classmethod
-    # async def paginator(cls: Type[T], query_dict: dict, page_size=100) -> Generator[T, None, None]:
+        num = 0
+        gen = cls.paginator(query_dict, page_size, prj_exp, filter_dict)
+        async for page in gen:
+            for item in page.items:
+                yield item
+                num += 1
+                if num == limit:
+                    await gen.aclose()
+                    return
 
     @classmethod
     async def query(cls: Type[T], query_dict: dict, prj_exp: List[str] = None, filter_dict: dict = None) -> T:
@@ -523,12 +786,24 @@ class SoloHatsudenkiTable(object):
 
     @classmethod
     async def scan_generator(cls: Type[T],
-                             filter_dict: dict = None, tick=50, prj: List[str] = None) -> AsyncGenerator[List[T], None]:
+                             filter_dict: dict = None, tick=50, prj: List[str] = None, segments: int = 1,
+                             max_pages: int = None) -> AsyncGenerator[List[T], None]:
+        """
+        フルスキャンをページ単位で返却するジェネレータ
+
+        :param filter_dict: フィルタ
+        :param tick: 1リクエストあたりの取得件数
+        :param prj: プロジェクション情報
+        :param segments: 並列スキャンのセグメント数。2以上の場合ページの順序は保証されない
+        :param max_pages: 並列スキャン時に保持できる未処理ページ数の上限
+        :return: モデルインスタンスのジェネレータ
+        """
         fc = None
         if filter_dict:
             fc = cls.filter_parse(filter_dict)
         async for l in HatsudenkiClient.scan_generator(
-                table_name=cls.get_collection_name(), filter_cond=fc, tick=tick, prj=prj):
+                table_name=cls.get_collection_name(), filter_cond=fc, tick=tick, prj=prj, segments=segments,
+                max_pages=max_pages):
             yield cls.from_raw_dict_list(l)
 
     @classmethod
@@ -544,45 +819,62 @@ class SoloHatsudenkiTable(object):
 
     @classmethod
     def _find_index_by_query_dict(cls, query_dict: dict):
-        kv = list(query_dict.keys())
-        hash_key = kv[0]
-        range_key = kv[1] if len(kv) > 1 else None
-        op = None
-
-        if range_key is not None:
-            sp = range_key.split('__')
-            if len(sp) is 2:
-                range_key = sp[0]
-                op = sp[1]
-
+        hash_key, range_key, op = split_query_keys(tuple(query_dict))
         use_index = cls.find_index(hash_key, range_key)
         return hash_key, range_key, op, use_index
 
     @classmethod
     def query_parse(cls, query_dict: dict):
         """
-        クエリ
-        :param query_dict:
-        :return:
+        | クエリ辞書から条件式と使用するインデックスを取得する
+        | キーの並びごとに解決済みのクエリプランを保持し、2回目以降は値を埋め込むだけにする
+        | クエリ辞書は書き換えない
+
+        :param query_dict: クエリ辞書（例: {'user_id': xxx, 'kind__beginsWith': 'item'}）
+        :return: (KeyConditionExpression, インデックス)
         """
-        hash_key, range_key, op, use_index = cls._find_index_by_query_dict(query_dict)
-        if use_index is None:
-            raise Exception(f'invalid keys {query_dict}')
+        shape = tuple(query_dict)
+        plan = cls._query_plans.get(shape)
+        if plan is None:
+            plan = cls._plan_query(shape)
+            if len(cls._query_plans) >= MAX_QUERY_PLANS:
+                cls._query_plans.clear()
+            cls._query_plans[shape] = plan
+        return plan.bind(query_dict), plan.index
 
-        kc = KeyConditionExpression()
+    @classmethod
+    def _plan_query(cls, keys: Tuple[str, ...]) -> QueryPlan:
+        """
+        クエリ辞書のキーの並びからクエリプランを生成する
 
-        kc.equal(hash_key, query_dict[hash_key])
-        if range_key is not None:
-            kc.op_and()
+        :param keys: クエリ辞書のキー
+        :return: QueryPlan
+        """
+        hash_key, range_key, op = split_query_keys(keys)
+        if range_key is None:
+            return cls._make_query_plan(hash_key)
+        return cls._make_query_plan(hash_key, range_key, op, range_source=keys[1])
 
-            if op is not None:
-                rv = cls.get_serialized_field_value(range_key, query_dict[range_key + '__' + op])
-                kc.get_operation_by_word(op, range_key, rv, raw=True)
-            else:
-                rv = cls.get_serialized_field_value(range_key, query_dict[range_key])
-                kc.equal(range_key, rv, raw=True)
+    @classmethod
+    def _make_query_plan(cls, hash_key: str, range_key: str = None, op: str = None, range_source: str = None,
+                         range_fixed: any = None, range_resolver: Callable = None) -> QueryPlan:
+        """
+        使用するインデックスを判定してクエリプランを生成する
 
-        return kc, use_index
+        :param hash_key: ハッシュキー名
+        :param range_key: レンジキー名
+        :param op: レンジキーのオペレータ
+        :param range_source: レンジキーの値を取り出すクエリ辞書のキー
+        :param range_fixed: レンジキーの固定値
+        :param range_resolver: レンジキーの値の変換
+        :return: QueryPlan
+        """
+        use_index = cls.find_index(hash_key, range_key)
+        if use_index is None:
+            raise Exception(f'invalid keys {hash_key} {range_key}')
+        range_field = cls.get_field_class(range_key) if range_key is not None else None
+        return QueryPlan.build(use_index, hash_key, range_key, op, range_field=range_field, range_source=range_source,
+                               range_fixed=range_fixed, range_resolver=range_resolver)
 
     @classmethod
     def filter_parse(cls, filter_dict: dict):
@@ -637,6 +929,9 @@ class SoloHatsudenkiTable(object):
         key = cls.get_serialized_key(hash_val, range_val)
         cond = cls.exist_condition()
         await HatsudenkiClient.delete_item(cls.get_collection_name(), key, cond)
+        s = HatsudenkiSession.current()
+        if s is not None:
+            s.invalidate(cls.get_collection_name(), key)
 
     async def remove(self):
         await self.__class__.delete(self.hash_value)
@@ -649,14 +944,37 @@ class SoloHatsudenkiTable(object):
         if prj is None:
             return
 
-        # _v は必須
-        prj.append('_v')
-        [self.__delattr__(key) for key in self._attributes.keys() if key not in prj]
+        # _v は必須。map.keyのような指定はトップレベルの属性を残す
+        keep = projection_keys(tuple(prj))
+        lazy = self._lazy_raw
+        for key in self._attributes.keys():
+            if key in keep:
+                continue
+            if lazy and key in lazy:
+                del lazy[key]
+                continue
+            self.__delattr__(key)
 
     @classmethod
     def get_primary_key_names(cls):
         return [cls.get_hash_key_name()]
 
+    @classmethod
+    def projection(cls, *fields: str) -> List[str]:
+        """
+        | プロジェクション情報を生成する
+        | キーと_vは常に含まれる。存在しないフィールドを指定した場合は例外が発生する
+
+        .. code-block:: python
+
+            prj = User.projection(User.fields.name, User.fields.level)
+            user = await User.get(uid, prj_exp=prj)
+
+        :param fields: Model.fieldsの要素もしくはフィールド名
+        :return: 属性名リスト
+        """
+        return build_projection(cls, fields)
+
     @classmethod
     def direct_update(cls):
         from hatsudenki.packages.direct.update import DirectUpdate
@@ -0,0 +1,186 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+
+from hatsudenki.packages.counter import table_names, item_count, consumed_units
+
+#: 属性値として扱える型（OpenTelemetryの制約に合わせる）
+AttributeValue = Union[str, bool, int, float, List[str]]
+
+
+class Span(object):
+    """
+    | スパン
+    | OpenTelemetryのSpanと同じメソッド名にしてあるので、OpenTelemetryのスパンをそのまま返してもよい
+    """
+
+    def set_attribute(self, key: str, value: AttributeValue):
+        raise NotImplementedError()
+
+    def add_event(self, name: str, attributes: Dict[str, AttributeValue] = None):
+        raise NotImplementedError()
+
+    def record_exception(self, exception: BaseException):
+        raise NotImplementedError()
+
+    def end(self):
+        raise NotImplementedError()
+
+
+class Tracer(object):
+    """
+    | トレーサー
+    | HatsudenkiClient.set_tracerで設定すると、DynamoDBへのリクエストごとにstart_spanが呼び出される
+    | OpenTelemetryのTracerと同じシグネチャにしてあるので、opentelemetry.trace.get_tracer()の戻り値をそのまま設定できる
+    """
+
+    def start_span(self, name: str, attributes: Dict[str, AttributeValue] = None) -> Span:
+        raise NotImplementedError()
+
+
+class NoopSpan(Span):
+    def set_attribute(self, key: str, value: AttributeValue):
+        pass
+
+    def add_event(self, name: str, attributes: Dict[str, AttributeValue] = None):
+        pass
+
+    def record_exception(self, exception: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+class NoopTracer(Tracer):
+    """
+    何もしないトレーサー
+    """
+    _span = NoopSpan()
+
+    def start_span(self, name: str, attributes: Dict[str, AttributeValue] = None) -> Span:
+        return self._span
+
+
+@dataclass
+class RecordedSpan(Span):
+    """
+    RecordingTracerが記録したスパン
+    """
+    name: str
+    attributes: Dict[str, AttributeValue] = field(default_factory=dict)
+    # (イベント名, 属性)
+    events: List[tuple] = field(default_factory=list)
+    exception: Optional[BaseException] = None
+    start: float = 0
+    finish: Optional[float] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.finish is None:
+            return None
+        return self.finish - self.start
+
+    @property
+    def is_ended(self):
+        return self.finish is not None
+
+    def set_attribute(self, key: str, value: AttributeValue):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Dict[str, AttributeValue] = None):
+        self.events.append((name, dict(attributes or {})))
+
+    def record_exception(self, exception: BaseException):
+        self.exception = exception
+
+    def end(self):
+        self.finish = time.perf_counter()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'attributes': self.attributes,
+            'events': self.events,
+            'exception': repr(self.exception) if self.exception is not None else None,
+            'duration': self.duration,
+        }
+
+
+class RecordingTracer(Tracer):
+    """
+    | スパンをメモリに記録するトレーサー
+    | テストやデバッグ用
+    """
+
+    def __init__(self):
+        self.spans: List[RecordedSpan] = []
+
+    def start_span(self, name: str, attributes: Dict[str, AttributeValue] = None) -> Span:
+        s = RecordedSpan(name, dict(attributes or {}), start=time.perf_counter())
+        self.spans.append(s)
+        return s
+
+    def find(self, name: str) -> List[RecordedSpan]:
+        """
+        指定した名前のスパンを取得
+
+        :param name: スパン名
+        :return: RecordedSpanのリスト
+        """
+        return [s for s in self.spans if s.name == name]
+
+    def clear(self):
+        self.spans = []
+
+
+def span_name(operation: str) -> str:
+    """
+    スパン名を生成する
+
+    :param operation: オペレーション名
+    :return: スパン名
+    """
+    return f'dynamodb.{operation}'
+
+
+def request_attributes(operation: str, params: dict) -> Dict[str, AttributeValue]:
+    """
+    | リクエスト開始時のスパン属性を生成する
+    | 属性名はOpenTelemetryのセマンティック規約に合わせる
+
+    :param operation: オペレーション名
+    :param params: リクエストパラメータ
+    :return: dict
+    """
+    a = {
+        'db.system': 'dynamodb',
+        'db.operation': operation,
+        'aws.dynamodb.table_names': table_names(params),
+    }
+    if 'IndexName' in params:
+        a['aws.dynamodb.index_name'] = params['IndexName']
+    if 'Limit' in params:
+        a['aws.dynamodb.limit'] = params['Limit']
+    return a
+
+
+def set_response_attributes(span: Span, operation: str, res: dict, retries: int):
+    """
+    レスポンスの内容をスパン属性に設定する
+
+    :param span: スパン
+    :param operation: オペレーション名
+    :param res: AWSレスポンス
+    :param retries: リトライ回数
+    :return: None
+    """
+    span.set_attribute('hatsudenki.retries', retries)
+    n = item_count(operation, res)
+    if n is not None:
+        span.set_attribute('aws.dynamodb.count', n)
+    if 'ScannedCount' in res:
+        span.set_attribute('aws.dynamodb.scanned_count', res['ScannedCount'])
+    cu = consumed_units(res)
+    if cu is not None:
+        span.set_attribute('hatsudenki.consumed_capacity', cu)
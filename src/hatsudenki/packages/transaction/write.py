@@ -1,8 +1,14 @@
-from dataclasses import dataclass
+import asyncio
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import List
+from logging import getLogger
+from typing import List, Optional
 
 from hatsudenki.packages.client import HatsudenkiClient
+from hatsudenki.packages.retry import RetryPolicy
 from hatsudenki.packages.expression.update import UpdateExpression
 from hatsudenki.packages.table.solo import SoloHatsudenkiTable
 
@@ -20,7 +26,19 @@ class TransactWriteTask:
     condition: str = None
 
 
-MAX_TRANSACTION_ITEM = 10
+_logger = getLogger(__name__)
+
+#: TransactWriteItems1リクエストあたりの最大件数
+MAX_TRANSACTION_ITEM = 100
+#: 競合（TransactionConflict）によるキャンセル時の最大リトライ回数（デフォルト）
+DEFAULT_TRANSACTION_CONFLICT_RETRY = 5
+
+#: キャンセル理由のコード。競合によるキャンセル
+CANCEL_CODE_CONFLICT = 'TransactionConflict'
+#: キャンセル理由のコード。このアイテムはキャンセルの原因ではない
+CANCEL_CODE_NONE = 'None'
+#: 先行するチャンクが失敗したため発行されなかったアイテムのコード
+CANCEL_CODE_SKIPPED = 'Skipped'
 
 
 class QueryTransactWriteItem(object):
@@ -85,3 +103,212 @@ class QueryTransactWriteItem(object):
     async def exec(self):
         res = await HatsudenkiClient.transaction_write(self._task)
         return res
+
+
+def decode_cancellation_reasons(e: Exception) -> List[dict]:
+    """
+    | TransactionCanceledExceptionからアイテムごとのキャンセル理由を取り出す
+    | レスポンスにCancellationReasonsが含まれない場合はメッセージから復元する
+
+    :param e: 例外
+    :return: CancellationReasons（{'Code': str, 'Message': str, 'Item': dict}のリスト）
+    """
+    res = getattr(e, 'response', None) or {}
+    reasons = res.get('CancellationReasons')
+    if reasons is not None:
+        return reasons
+    # Transaction cancelled, please refer cancellation reasons for specific reasons [None, ConditionalCheckFailed]
+    m = re.search(r'\[([^\]]*)\]\s*$', res.get('Error', {}).get('Message', '') or str(e))
+    if m is None:
+        return []
+    return [{'Code': c.strip()} for c in m.group(1).split(',')]
+
+
+@dataclass
+class TransactionItemResult:
+    """
+    トランザクション内の1アイテムの結果
+    """
+    # 追加した順の位置
+    index: int
+    kind: TransactionWriteKind
+    # 実テーブル名
+    table_name: str
+    # キャンセル理由のコード（書き込めた場合はNone）
+    code: Optional[str] = None
+    message: Optional[str] = None
+    # ReturnValuesOnConditionCheckFailureで返却された既存のアイテム
+    item: Optional[dict] = None
+
+    @property
+    def is_written(self):
+        return self.code is None
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'kind': self.kind.value,
+            'table_name': self.table_name,
+            'code': self.code,
+            'message': self.message,
+        }
+
+
+@dataclass
+class TransactionWriteReport:
+    """
+    TransactionWriterの実行結果
+    """
+    # アイテムごとの結果（追加した順）
+    items: List[TransactionItemResult] = field(default_factory=list)
+    # 分割されたトランザクション数
+    chunks: int = 0
+    # コミットされたトランザクション数
+    committed: int = 0
+    # リトライを含むリクエスト数
+    requests: int = 0
+    # 競合によるリトライ数
+    conflicts: int = 0
+    # 処理時間（秒）
+    elapsed: float = 0
+
+    @property
+    def is_complete(self):
+        """
+        すべてのトランザクションがコミットされたか
+
+        :return: bool
+        """
+        return self.committed == self.chunks
+
+    @property
+    def failed(self) -> List[TransactionItemResult]:
+        """
+        | キャンセルの原因となったアイテム
+        | 原因ではないが巻き込まれたアイテム（コードがNone）や発行されなかったアイテムは含まない
+
+        :return: list
+        """
+        return [r for r in self.items if r.code not in (None, CANCEL_CODE_NONE, CANCEL_CODE_SKIPPED)]
+
+    def to_dict(self):
+        return {
+            'chunks': self.chunks,
+            'committed': self.committed,
+            'requests': self.requests,
+            'conflicts': self.conflicts,
+            'elapsed': self.elapsed,
+            'failed': [r.to_dict() for r in self.failed],
+        }
+
+
+class TransactionWriter(QueryTransactWriteItem):
+    """
+    | 件数制限の無いTransactWriteItems
+    | MAX_TRANSACTION_ITEM件ずつのトランザクションに分割して順に発行する（原子性はトランザクション単位）
+    | トランザクションごとにClientRequestTokenを発行するので、通信エラー等による再送でも二重に適用されない
+    | 競合（TransactionConflict）のみが原因でキャンセルされた場合は同じトークンでバックオフしながらリトライする
+    | それ以外の理由でキャンセルされた場合は以降のトランザクションを発行せず、アイテムごとの理由を結果に格納する
+
+    .. code-block:: python
+
+        w = TransactionWriter()
+        for m in items:
+            w.append_update(m)
+        report = await w.exec()
+        if not report.is_complete:
+            for r in report.failed:
+                ...
+    """
+
+    def __init__(self, limit=MAX_TRANSACTION_ITEM, max_retry=DEFAULT_TRANSACTION_CONFLICT_RETRY,
+                 return_values_on_failure=False, policy: RetryPolicy = None):
+        """
+        イニシャライザ
+
+        :param limit: 1トランザクションあたりの件数
+        :param max_retry: 競合によるキャンセル時の最大リトライ回数
+        :param return_values_on_failure: 条件チェックに失敗したアイテムの既存の値を取得するか
+        :param policy: バックオフに使用するリトライポリシー。省略時はクライアントのもの
+        """
+        super().__init__()
+        self.limit = min(limit, MAX_TRANSACTION_ITEM)
+        self.max_retry = max_retry
+        self.return_values_on_failure = return_values_on_failure
+        self.policy = policy
+
+    def _check(self):
+        # 件数は実行時に分割するので制限しない
+        pass
+
+    def _request_items(self, chunk: List[dict]) -> List[dict]:
+        if not self.return_values_on_failure:
+            return chunk
+        return [{k: {**v, 'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'} for k, v in q.items()} for q in chunk]
+
+    def _results(self, begin: int, chunk: List[dict], reasons: List[dict] = None) -> List[TransactionItemResult]:
+        ret = []
+        for i, q in enumerate(chunk):
+            kind, body = next(iter(q.items()))
+            r = TransactionItemResult(index=begin + i, kind=TransactionWriteKind(kind), table_name=body['TableName'])
+            if reasons is not None:
+                reason = reasons[i] if i < len(reasons) else {}
+                r.code = reason.get('Code', CANCEL_CODE_NONE)
+                r.message = reason.get('Message')
+                r.item = reason.get('Item')
+            ret.append(r)
+        return ret
+
+    async def _exec_chunk(self, chunk: List[dict], report: TransactionWriteReport,
+                          policy: RetryPolicy) -> Optional[List[dict]]:
+        items = self._request_items(chunk)
+        # リトライでも同じトークンを使う
+        token = str(uuid.uuid4())
+        attempt = 0
+        while True:
+            report.requests += 1
+            try:
+                await HatsudenkiClient.transaction_write(items, token)
+                return None
+            except Exception as e:
+                if RetryPolicy.get_error_code(e) != 'TransactionCanceledException':
+                    raise
+                reasons = decode_cancellation_reasons(e)
+            codes = {r.get('Code', CANCEL_CODE_NONE) for r in reasons}
+            if CANCEL_CODE_CONFLICT not in codes or not codes <= {CANCEL_CODE_CONFLICT, CANCEL_CODE_NONE} or \
+                    attempt >= self.max_retry:
+                return reasons
+            report.conflicts += 1
+            delay = policy.backoff(attempt)
+            _logger.warning(f'transaction conflict. retry={attempt} delay={delay:.3f}')
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def exec(self) -> TransactionWriteReport:
+        """
+        実行
+
+        :return: TransactionWriteReport
+        """
+        report = TransactionWriteReport()
+        begin = time.perf_counter()
+        policy = self.policy or HatsudenkiClient.get_retry_policy()
+        tasks = self._task
+        failed = False
+        for h in range(0, len(tasks), self.limit):
+            chunk = tasks[h:h + self.limit]
+            report.chunks += 1
+            if failed:
+                # 先行するトランザクションが失敗しているので発行しない
+                for r in self._results(h, chunk):
+                    r.code = CANCEL_CODE_SKIPPED
+                    report.items.append(r)
+                continue
+            reasons = await self._exec_chunk(chunk, report, policy)
+            report.items.extend(self._results(h, chunk, reasons))
+            if reasons is None:
+                report.committed += 1
+            else:
+                failed = True
+        report.elapsed = time.perf_counter() - begin
+        return report
@@ -0,0 +1,273 @@
+import asyncio
+import time
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Dict, List, Optional, Tuple
+
+_logger = getLogger(__name__)
+
+_current_unit_of_work: ContextVar[Optional['UnitOfWork']] = ContextVar('hatsudenki_unit_of_work', default=None)
+
+
+@dataclass
+class UnitOfWorkReport:
+    """
+    UnitOfWorkの書き込み結果
+    """
+    # 新規作成したモデル
+    created: list = field(default_factory=list)
+    # 更新したモデル
+    updated: list = field(default_factory=list)
+    # 変更が無かったためスキップしたモデル数
+    skipped: int = 0
+    # 失敗したモデルと例外
+    failed: List[Tuple[object, Exception]] = field(default_factory=list)
+    # 発行したリクエスト数
+    requests: int = 0
+    # 処理時間（秒）
+    elapsed: float = 0
+
+    @property
+    def is_success(self):
+        return len(self.failed) == 0
+
+    def to_dict(self):
+        return {
+            'created': len(self.created),
+            'updated': len(self.updated),
+            'skipped': self.skipped,
+            'failed': len(self.failed),
+            'requests': self.requests,
+            'elapsed': self.elapsed,
+        }
+
+
+class UnitOfWork(object):
+    """
+    | 変更されたモデルを溜めておき、ブロックを抜ける際にまとめて書き込む
+    | ブロック内でDBから取得したモデルは変更された時点で自動的に登録される
+    | 新規作成したモデルは意図せず保存されるのを防ぐため、addで明示的に登録すること
+    | 新規作成は存在しないことを条件にしたput_item、更新はupdate_itemを並列で発行する
+    | overwrite=Trueの場合、新規作成は既存のアイテムを上書きするQueryBatchWriteItemでまとめて書き込む
+    | transaction=Trueの場合はすべてを1トランザクションで書き込む
+    | ブロック内で例外が発生した場合は何も書き込まない
+
+    .. code-block:: python
+
+        async with UnitOfWork(concurrency=8) as uow:
+            user = await User.get('hoge')
+            user.name = 'fuga'
+            uow.add(Item(user_id='hoge', item_id=1))
+        print(uow.report.to_dict())
+    """
+
+    def __init__(self, concurrency: int = 10, transaction: bool = False, skip_hook: bool = False,
+                 raise_on_error: bool = True, overwrite: bool = False):
+        """
+        イニシャライザ
+
+        :param concurrency: put_item/update_itemの最大同時発行数
+        :param transaction: トランザクションで書き込むか
+        :param skip_hook: 作成日時・更新日時のフック処理をスキップするか
+        :param raise_on_error: 書き込みに失敗したモデルがあった場合に例外を送出するか
+        :param overwrite: 新規作成したモデルで既存のアイテムを上書きするか
+        """
+        self.concurrency = concurrency
+        self.transaction = transaction
+        self.skip_hook = skip_hook
+        self.raise_on_error = raise_on_error
+        self.overwrite = overwrite
+        self.report: Optional[UnitOfWorkReport] = None
+        # 登録順を保つためにidをキーにした辞書で保持する
+        self._models: Dict[int, object] = {}
+        self._token: Optional[Token] = None
+
+    @staticmethod
+    def current() -> Optional['UnitOfWork']:
+        """
+        現在のコンテキストのUnitOfWorkを取得
+
+        :return: UnitOfWork。ブロック外の場合はNone
+        """
+        return _current_unit_of_work.get()
+
+    @staticmethod
+    def track(model):
+        """
+        現在のコンテキストにUnitOfWorkがあればモデルを登録する
+
+        :param model: モデルインスタンス
+        :return: None
+        """
+        uow = _current_unit_of_work.get()
+        if uow is not None:
+            uow.add(model)
+
+    def add(self, model):
+        """
+        書き込み対象のモデルを登録する
+
+        :param model: モデルインスタンス
+        :return: 登録したモデルインスタンス
+        """
+        self._models[id(model)] = model
+        return model
+
+    def discard(self, model):
+        """
+        登録したモデルを書き込み対象から外す
+
+        :param model: モデルインスタンス
+        :return: None
+        """
+        self._models.pop(id(model), None)
+
+    def __len__(self):
+        return len(self._models)
+
+    async def flush(self) -> UnitOfWorkReport:
+        """
+        登録されたモデルを書き込む
+
+        :return: UnitOfWorkReport
+        """
+        begin = time.perf_counter()
+        models = list(self._models.values())
+        self._models = {}
+
+        report = UnitOfWorkReport()
+        created = [m for m in models if m.is_created_record]
+        updated = [m for m in models if not m.is_created_record and m.is_modified_record]
+        report.skipped = len(models) - len(created) - len(updated)
+
+        if self.transaction:
+            await self._flush_transaction(created, updated, report)
+        else:
+            await asyncio.gather(self._flush_create(created, report), self._flush_update(updated, report))
+
+        report.elapsed = time.perf_counter() - begin
+        self.report = report
+        if report.failed:
+            _logger.error(f'unit of work flush failed. {report.to_dict()}')
+        return report
+
+    def _prepare_create(self, model):
+        if not self.skip_hook:
+            model._hook_put()
+        model.force_set_key('_v', model._v + 1)
+
+    @staticmethod
+    def _collect(models: list, res: list, succeeded: list, report: UnitOfWorkReport):
+        for m, r in zip(models, res):
+            if isinstance(r, asyncio.CancelledError):
+                # キャンセルされた書き込みを成功扱いにしない
+                raise r
+            if isinstance(r, BaseException):
+                report.failed.append((m, r))
+            else:
+                succeeded.append(m)
+
+    async def _flush_create(self, models: list, report: UnitOfWorkReport):
+        if not models:
+            return
+        if self.overwrite:
+            await self._flush_create_batch(models, report)
+            return
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _put(m):
+            async with sem:
+                await m.put(skip_hook=self.skip_hook)
+
+        res = await asyncio.gather(*[_put(m) for m in models], return_exceptions=True)
+        report.requests += len(models)
+        self._collect(models, res, report.created, report)
+
+    async def _flush_create_batch(self, models: list, report: UnitOfWorkReport):
+        from hatsudenki.packages.batch import QueryBatchWriteItem
+
+        # BatchWriteItemは条件を指定できないので既存のアイテムは上書きされる
+        q = QueryBatchWriteItem()
+        for m in models:
+            self._prepare_create(m)
+            q.append_create(m)
+        try:
+            r = await q.exec(concurrency=self.concurrency)
+        except Exception as e:
+            report.failed.extend((m, e) for m in models)
+            return
+        report.requests += r.requests
+        if not r.is_complete:
+            # どれが書き込めなかったかは分からないのですべて失敗扱いにする
+            e = Exception(f'UnprocessedItems remain. num={r.abandoned}')
+            report.failed.extend((m, e) for m in models)
+            return
+
+        for m in models:
+            m.flush()
+            m._store_session()
+        report.created.extend(models)
+
+    async def _flush_update(self, models: list, report: UnitOfWorkReport):
+        if not models:
+            return
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _update(m):
+            async with sem:
+                await m.update(skip_hook=self.skip_hook)
+
+        res = await asyncio.gather(*[_update(m) for m in models], return_exceptions=True)
+        report.requests += len(models)
+        self._collect(models, res, report.updated, report)
+
+    async def _flush_transaction(self, created: list, updated: list, report: UnitOfWorkReport):
+        from hatsudenki.packages.transaction.write import QueryTransactWriteItem, MAX_TRANSACTION_ITEM
+
+        if not created and not updated:
+            return
+        if len(created) + len(updated) > MAX_TRANSACTION_ITEM:
+            raise Exception(f'transaction item too many. max {MAX_TRANSACTION_ITEM}')
+
+        q = QueryTransactWriteItem()
+        for m in created:
+            self._prepare_create(m)
+            q.append_put(m, self.overwrite)
+        for m in updated:
+            if not self.skip_hook:
+                m._hook_update()
+            q.append_update(m)
+
+        report.requests += 1
+        try:
+            await q.exec()
+        except Exception as e:
+            report.failed.extend((m, e) for m in created + updated)
+            return
+
+        for m in created:
+            m.flush()
+            m._store_session()
+        for m in updated:
+            m.flush()
+            m.force_set_key('_v', m._v + 1)
+            m._store_session()
+        report.created.extend(created)
+        report.updated.extend(updated)
+
+    async def __aenter__(self):
+        self._token = _current_unit_of_work.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        _current_unit_of_work.reset(self._token)
+        self._token = None
+        if exc_type is not None:
+            # ブロック内で例外が発生したので書き込まない
+            self._models = {}
+            return
+
+        report = await self.flush()
+        if self.raise_on_error and report.failed:
+            raise report.failed[0][1]